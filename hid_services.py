@@ -16,12 +16,50 @@
 
 
 from micropython import const
+import micropython
 import struct
 import bluetooth
-import json
-import binascii
+import time
+import gc
+import errno
+from array import array
 from bluetooth import UUID
 from lib.hidservices.constants import Constants
+from lib.hidservices.dispatch import EVENT_STATE, EVENT_PASSKEY, EVENT_TUNABLES, EVENT_SECRETS
+from lib.hidservices.transport import BLETransport
+
+# Class that holds the state of a single connected central.
+class Connection(object):
+    def __init__(self, conn_handle, addr_type, addr):
+        self.conn_handle = conn_handle                                                                                  # The handle of the connection.
+        self.addr_type = addr_type                                                                                      # The address type and address of the central.
+        self.addr = bytes(addr)
+        self.encrypted = False                                                                                          # Is the connection encrypted?
+        self.authenticated = False                                                                                      # Is the central authenticated?
+        self.bonded = False                                                                                             # Are we bonded with the central?
+        self.key_size = 0                                                                                               # The encryption key size.
+        self.interval = 0                                                                                               # The connection interval in units of 1.25 ms, 0 until updated.
+        self.latency = 0                                                                                                # The peripheral latency.
+        self.timeout = 0                                                                                                # The supervision timeout in units of 10 ms.
+        self.mtu = 23                                                                                                   # The exchanged MTU.
+
+
+# Class that separates a packed report between the code updating the device
+# state and the code notifying it, e.g., a timer or a scheduled IRQ.
+# Setters pack into back, which keeps the state between updates. commit()
+# copies it once into an immutable front snapshot and publishes that with a
+# single reference store, and the notify path only ever sends front. No
+# locks are needed, a reader sees either the old or the new snapshot as a
+# whole, and front can be kept, e.g., as the characteristic value.
+class ReportBuffer(object):
+    def __init__(self, size):
+        self.front = bytes(size)                                                                                        # The committed snapshot, read by the notify path. Never changed in place.
+        self.back = bytearray(size)                                                                                     # The state being written by the setters.
+
+    # Publish the back buffer as the new snapshot.
+    def commit(self):
+        self.front = bytes(self.back)                                                                                   # The one copy, published by the reference store.
+
 
 # Class that represents a general HID device services.
 class HumanInterfaceDevice(object):
@@ -31,29 +69,93 @@ class HumanInterfaceDevice(object):
     DEVICE_ADVERTISING = const(2)
     DEVICE_CONNECTED = const(3)
 
+    service_uuids = (UUID(0x180A), UUID(0x180F), UUID(0x1200), UUID(0x1812))                                            # Service UUIDs: DIS, BAS, DID, HIDS (Device Information Service, BAttery Service, Device Identification service, Human Interface Device Service). These are required for a HID.
+
+    DIS = (                                                                                                        # Device Information Service (DIS) description.
+        UUID(0x180A),                                                                                                   # 0x180A = Device Information.
+        (
+            (UUID(0x2A24), Constants.F_READ),                                                                                     # 0x2A24 = Model number string, to be read by client.
+            (UUID(0x2A25), Constants.F_READ),                                                                                     # 0x2A25 = Serial number string, to be read by client.
+            (UUID(0x2A26), Constants.F_READ),                                                                                     # 0x2A26 = Firmware revision string, to be read by client.
+            (UUID(0x2A27), Constants.F_READ),                                                                                     # 0x2A27 = Hardware revision string, to be read by client.
+            (UUID(0x2A28), Constants.F_READ),                                                                                     # 0x2A28 = Software revision string, to be read by client.
+            (UUID(0x2A29), Constants.F_READ),                                                                                     # 0x2A29 = Manufacturer name string, to be read by client.
+            (UUID(0x2A50), Constants.F_READ),                                                                                     # 0x2A50 = PnP ID, to be read by client.
+        ),
+    )
+
+    BAS = (                                                                                                        # Battery Service (BAS) description.
+        UUID(0x180F),                                                                                                   # 0x180F = Battery Information.
+        (
+            (UUID(0x2A19), Constants.F_READ_NOTIFY, (                                                                             # 0x2A19 = Battery level, to be read by client after being notified of change.
+                (UUID(0x2904), Constants.DSC_F_READ),                                                                             # 0x2904 = Characteristic Presentation Format.
+            )),
+        ),
+    )
+
+    DID = (                                                                                                        # Device Identification Profile (DID) description.
+        UUID(0x1200),                                                                                                   # 0x1200 = PnPInformation.
+        (
+            (UUID(0x0200), Constants.F_READ),                                                                                     # 0x0200 = SpecificationID.
+            (UUID(0x0201), Constants.F_READ),                                                                                     # 0x0201 = VendorID.
+            (UUID(0x0202), Constants.F_READ),                                                                                     # 0x0202 = ProductID.
+            (UUID(0x0203), Constants.F_READ),                                                                                     # 0x0203 = Version.
+            (UUID(0x0204), Constants.F_READ),                                                                                     # 0x0204 = PrimaryRecord.
+            (UUID(0x0205), Constants.F_READ),                                                                                     # 0x0205 = VendorIDSource.
+        ),
+    )
+
+    HID_INPUT_REPORT = None                                                                                             # The HID USB input report. We will specify these in their respective subclasses.
+
+    # The radio is shared by all devices, e.g., personalities of one board, see switch_personality().
+    _owner = None                                                                                                       # The device whose services are registered with the radio.
+    _radio_config = {}                                                                                                  # The settings applied to the radio since it was turned on, see configure().
+    _resume = None                                                                                                      # The snapshot the next device resumes from after deep sleep, see hidservices/snapshot.py.
+    _closing = set()                                                                                                    # Connection handles disconnected by stop() that the radio still holds.
+    _switch_to = None                                                                                                   # (device, start tick) of a switch_personality() waiting for _closing to empty.
+
     def __init__(self, device_name="Generic HID Device"):
         self._ble = bluetooth.BLE()                                                                                     # The BLE.
+        self.transport = BLETransport(self._ble)                                                                        # Sends the reports, see set_transport().
         self.adv = None                                                                                                 # The advertiser.
         self.device_state = HumanInterfaceDevice.DEVICE_STOPPED                                                         # The initial device state.
-        self.conn_handle = None                                                                                         # The handle of the connected client. HID devices can only have a single connection.
+        self.conn_handle = None                                                                                         # The handle of the most recently connected client.
+        self.connections = {}                                                                                           # The connected clients: conn_handle -> Connection.
+        self.max_connections = 1                                                                                        # The number of clients served at once. The HIDS specification expects a single one.
+        self.secure_notify = False                                                                                      # Only notify clients that meet the security requirements? Off by default, see set_secure_notify().
         self.state_change_callback = None                                                                               # The user defined callback function which gets called when the device state changes.
+        self.passkey_callback = None                                                                                    # The user defined callback function for pairing events, see set_passkey_callback().
+        self.dispatcher = None                                                                                          # Defers user callbacks out of the IRQ when set, see set_dispatcher().
+        self.log_level = Constants.LOG_VERBOSE                                                                          # Print messages up to this level, see set_log_level().
         self.io_capability = Constants.IO_CAPABILITY_NO_INPUT_OUTPUT                                                             # The IO capability of the device. This is used to allow for different ways of identification during pairing.
         self.bond = True                                                                                                # Do we wish to bond with connecting clients? Normally True. Not supported by older Micropython versions.
         self.le_secure = True                                                                                           # Do we wish to use a secure connection? Normally True. Not supported by older Micropython versions.
 
-        self.encrypted = False                                                                                          # Is our connection encrypted?
+        self.encrypted = False                                                                                          # Is our connection encrypted? Mirrors the most recently updated connection, or the one left after a disconnect.
         self.authenticated = False                                                                                      # Is the connected client authenticated?
         self.bonded = False                                                                                             # Are we bonded with the connected client?
         self.key_size = 0                                                                                               # The encryption key size.
 
         self.passkey = 1234                                                                                             # The standard passkey for pairing. Only used when io capability allows so. Use the set_passkey(passkey) function to overwrite.
-        self.secrets = {}                                                                                               # The key store for bonding
+        self.host_slots = {}                                                                                            # Bonding partitions per host: slot name -> [key store, last peer (addr_type, addr) or None].
+        self.active_slot = "default"                                                                                    # The name of the host slot in use.
+        self.secrets = {}                                                                                               # The key store for bonding of the active host slot.
+        self.host_slots[self.active_slot] = [self.secrets, None]                                                        # Start with a single, default host slot.
+        self.switch_start = None                                                                                        # Tick at which switch_host() was called, None if no switch is pending.
+        self.switch_latency = None                                                                                      # Milliseconds from the last switch_host() call to the host connecting.
+        self._switch_pending = False                                                                                    # Advertise to the new host once the old one is disconnected.
+        self.personality_latency = None                                                                                 # Microseconds the last switch_personality() to this device took.
+        self.fast_advertising = False                                                                                   # Advertise fast until a host connects, set when resuming a snapshot with a last peer.
+        self.fast_advertising_ms = 30000                                                                                # Milliseconds to advertise fast before falling back to the normal interval.
+        self.fast_advertising_interval = 20000                                                                          # The fast advertising interval in microseconds.
+        self._fast_timer = None                                                                                         # Ends fast advertising, created on first use.
 
-        self.load_secrets()                                                                                             # Call the function to load the known keys for bonding into the key store.
+        resume = HumanInterfaceDevice._resume
+        if resume is None or not resume.restore_secrets(self):                                                          # A snapshot holds the keys, keys.json is not read.
+            self.load_secrets()                                                                                         # Call the function to load the known keys for bonding into the key store.
 
         # General characteristics.
         self.device_name = device_name                                                                                  # The device name.
-        self.service_uuids = [UUID(0x180A), UUID(0x180F), UUID(0x1200), UUID(0x1812)]                                   # Service UUIDs: DIS, BAS, DID, HIDS (Device Information Service, BAttery Service, Device Identification service, Human Interface Device Service). These are required for a HID.
         self.device_appearance = 960                                                                                    # The device appearance: 960 = Generic HID.
 
         # Device Information Service (DIS) characteristics.
@@ -72,124 +174,160 @@ class HumanInterfaceDevice(object):
 
         # BAttery Service (BAS) characteristics.
         self.battery_level = 100                                                                                        # The battery level characteristic (percentages).
-
-
-        self.DIS = (                                                                                                    # Device Information Service (DIS) description.
-            UUID(0x180A),                                                                                               # 0x180A = Device Information.
-            (
-                (UUID(0x2A24), Constants.F_READ),                                                                                 # 0x2A24 = Model number string, to be read by client.
-                (UUID(0x2A25), Constants.F_READ),                                                                                 # 0x2A25 = Serial number string, to be read by client.
-                (UUID(0x2A26), Constants.F_READ),                                                                                 # 0x2A26 = Firmware revision string, to be read by client.
-                (UUID(0x2A27), Constants.F_READ),                                                                                 # 0x2A27 = Hardware revision string, to be read by client.
-                (UUID(0x2A28), Constants.F_READ),                                                                                 # 0x2A28 = Software revision string, to be read by client.
-                (UUID(0x2A29), Constants.F_READ),                                                                                 # 0x2A29 = Manufacturer name string, to be read by client.
-                (UUID(0x2A50), Constants.F_READ),                                                                                 # 0x2A50 = PnP ID, to be read by client.
-            ),
-        )
-
-        self.BAS = (                                                                                                    # Battery Service (BAS) description.
-            UUID(0x180F),                                                                                               # 0x180F = Battery Information.
-            (
-                (UUID(0x2A19), Constants.F_READ_NOTIFY, (                                                                         # 0x2A19 = Battery level, to be read by client after being notified of change.
-                    (UUID(0x2904), Constants.DSC_F_READ),                                                                         # 0x2904 = Characteristic Presentation Format.
-                )),
-            ),
-        )
-
-        self.DID = (                                                                                                    # Device Identification Profile (DID) description.
-            UUID(0x1200),                                                                                               # 0x1200 = PnPInformation.
-            (
-                (UUID(0x0200), Constants.F_READ),                                                                                 # 0x0200 = SpecificationID.
-                (UUID(0x0201), Constants.F_READ),                                                                                 # 0x0201 = VendorID.
-                (UUID(0x0202), Constants.F_READ),                                                                                 # 0x0202 = ProductID.
-                (UUID(0x0203), Constants.F_READ),                                                                                 # 0x0203 = Version.
-                (UUID(0x0204), Constants.F_READ),                                                                                 # 0x0204 = PrimaryRecord.
-                (UUID(0x0205), Constants.F_READ),                                                                                 # 0x0205 = VendorIDSource.
-            ),
-        )
+        self.battery = None                                                                                             # The battery monitor used by update_battery_level(), see hidservices/battery.py.
+        self.power = None                                                                                               # The power policy told about input, see set_power_policy().
+        self.tunables = None                                                                                            # The settings the host can tune through a feature report, see set_tunables().
+        self.h_tune = None                                                                                              # The handle of the feature report of the tunables.
 
         self.services = [self.DIS, self.BAS, self.DID]                                                                  # List of service descriptions. We will append HIDS in their respective subclasses.
 
-        self.HID_INPUT_REPORT = None                                                                                    # The HID USB input report. We will specify these in their respective subclasses.
-
         self.characteristics = {}                                                                                       # List which maps handles to (description, value) tuple.
+        self.lean = False                                                                                               # Drop construction data after start(), see set_lean().
+        self._handles = None                                                                                            # The handles of the last registration, reused by restarts.
+        self._layout = None                                                                                             # The registered service descriptions, to compare with other devices.
 
-        print("Server created")
+        if self.log_level >= Constants.LOG_INFO:
+            print("Server created")
 
     # Interrupt request callback function.
     def ble_irq(self, event, data):
         if event == Constants.IRQ_CENTRAL_CONNECT:                                                                               # Central connected.
-            self.conn_handle, _, _ = data                                                                               # Save the handle. HIDS specification only allow one central to be connected.
+            conn_handle, addr_type, addr = data
+            self.connections[conn_handle] = Connection(conn_handle, addr_type, addr)                                    # Keep per connection state.
+            self.conn_handle = conn_handle                                                                              # Save the handle of the most recent connection.
             self.set_state(HumanInterfaceDevice.DEVICE_CONNECTED)                                                       # Set the device state to connected.
-            print("Central connected:", self.conn_handle)
+            if self.log_level >= Constants.LOG_INFO:
+                print("Central connected:", self.conn_handle)
+            self.adv.advertising = False                                                                                # The stack stops advertising on connect.
+            self.fast_advertising = False                                                                               # A host is back, advertise for others at the normal interval.
+            if len(self.connections) < self.max_connections:                                                            # Keep advertising for the next central.
+                self.adv.start_advertising()
+            slot = self.host_slots[self.active_slot]
+            if slot[1] is None or slot[1][1] != bytes(addr):                                                            # Remember the last peer of this host slot.
+                slot[1] = (addr_type, bytes(addr))
+                self._schedule_save_secrets()                                                                           # Writing the file does not belong in the IRQ.
+            if self.switch_start is not None:                                                                           # Measure switch-to-connected latency.
+                self.switch_latency = time.ticks_diff(time.ticks_ms(), self.switch_start)
+                self.switch_start = None
+                if self.log_level >= Constants.LOG_INFO:
+                    print("Switched to host", self.active_slot, "in", self.switch_latency, "ms")
         elif event == Constants.IRQ_CENTRAL_DISCONNECT:                                                                          # Central disconnected.
             conn_handle, addr_type, addr = data
+            closing = HumanInterfaceDevice._closing
+            if conn_handle in closing:                                                                                  # Dropped by stop(), the radio let it go.
+                closing.discard(conn_handle)
+                if not closing and HumanInterfaceDevice._switch_to is not None:                                         # A personality switch waited for the links to go.
+                    try:
+                        micropython.schedule(self._continue_switch, None)
+                    except RuntimeError:                                                                                # Schedule queue full, do not leave the switch hanging.
+                        self._continue_switch()
+                return
+            if conn_handle not in self.connections:                                                                     # Dropped by another personality, nothing to update.
+                return
+            del self.connections[conn_handle]
+            if self.log_level >= Constants.LOG_INFO:
+                print("Central disconnected:", conn_handle)
+            if self.connections:
+                if conn_handle == self.conn_handle:                                                                     # Fall back to another connection.
+                    self.conn_handle = next(iter(self.connections))
+                self._mirror_security(self.connections.get(self.conn_handle))                                           # The remaining centrals keep their security.
+                if len(self.connections) < self.max_connections:                                                        # Advertise for a replacement central.
+                    self.adv.start_advertising()
+                return
             self.conn_handle = None                                                                                     # Discard old handle.
-            self.set_state(HumanInterfaceDevice.DEVICE_IDLE)
-            self.encrypted = False
-            self.authenticated = False
-            self.bonded = False
-            print("Central disconnected:", conn_handle)
+            self._mirror_security(None)
+            if self.adv.advertising:                                                                                    # Still advertising for another central.
+                self.set_state(HumanInterfaceDevice.DEVICE_ADVERTISING)
+            else:
+                self.set_state(HumanInterfaceDevice.DEVICE_IDLE)
+            if self._switch_pending:                                                                                    # A host switch is waiting for the old host to go.
+                self._switch_pending = False
+                self.start_advertising()
         elif event == Constants.IRQ_GATTS_WRITE:                                                                                 # Write operation from client.
             conn_handle, attr_handle = data
             value = self._ble.gatts_read(attr_handle)
+            if attr_handle == self.h_tune and self.tunables is not None:
+                return self.write_tunables(conn_handle, value)
             description, _val = self.characteristics.get(attr_handle, (None, None))
             if description is None:
-                print("Client initiated write on unknown handle:", attr_handle, "with value", value)
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print("Client initiated write on unknown handle:", attr_handle, "with value", value)
                 return Constants.GATTS_ERROR_ATTR_NOT_FOUND
             else:
                 self.characteristics[attr_handle] = (description, value)
-                print("Client initiated write on", description, "with value", value)
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print("Client initiated write on", description, "with value", value)
                 return Constants.GATTS_NO_ERROR
         elif event == Constants.IRQ_GATTS_READ_REQUEST:                                                                          # Read request from client.
             conn_handle, attr_handle = data
             description, val = self.characteristics.get(attr_handle, (None, None))
-            print("Read request:", description if description else attr_handle, "with value" if val else "", val if val else "")
-            if conn_handle != self.conn_handle:                                                                         # If different connection, return no permission.
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Read request:", description if description else attr_handle, "with value" if val else "", val if val else "")
+            connection = self.connections.get(conn_handle)
+            if connection is None:                                                                                      # If unknown connection, return no permission.
                 return Constants.GATTS_ERROR_READ_NOT_PERMITTED
             elif description == None:                                                                                   # If the handle is unknown, return invalid handle.
                 return Constants.GATTS_ERROR_INVALID_HANDLE
-            elif self.bond and not self.bonded:                                                                         # If we wish to bond but are not bonded, return insufficient authorization.
-                return Constants.GATTS_ERROR_INSUFFICIENT_AUTHORIZATION
-            elif self.io_capability > Constants.IO_CAPABILITY_NO_INPUT_OUTPUT and not self.authenticated:                        # If we can authenticate but the client hasn't authenticated, return insufficient authentication.
-                return Constants.GATTS_ERROR_INSUFFICIENT_AUTHENTICATION
-            elif self.le_secure and (not self.encrypted or self.key_size < 16):                                         # If we wish for a secure connection but it is unencrypted or not strong enough, return insufficient encryption.
-                return Constants.GATTS_ERROR_INSUFFICIENT_ENCRYPTION
-            else:                                                                                                       # Otherwise, return no error.
-                return Constants.GATTS_NO_ERROR
+            else:
+                return self.check_security(connection)
         elif event == Constants.IRQ_GATTS_INDICATE_DONE:                                                                         # A sent indication was done. (We don't use indications currently. If needed, define a callback function and override this function.)
             conn_handle, value_handle, status = data
-            print("Indicate done:", data)
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Indicate done:", data)
         elif event == Constants.IRQ_MTU_EXCHANGED:                                                                               # MTU was exchanged, set it.
             conn_handle, mtu = data
+            connection = self.connections.get(conn_handle)
+            if connection is not None:
+                connection.mtu = mtu
             self._ble.config(mtu=mtu)
-            print("MTU exchanged:", mtu)
+            HumanInterfaceDevice._radio_config["mtu"] = mtu
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("MTU exchanged:", mtu)
         elif event == Constants.IRQ_CONNECTION_UPDATE:                                                                           # Connection parameters were updated.
-            self.conn_handle, conn_interval, conn_latency, supervision_timeout, status = data                           # The new parameters.
-            print("Connection update. Interval=", conn_interval, "latency=", conn_latency, "timeout=", supervision_timeout, "status=", status)
+            conn_handle, conn_interval, conn_latency, supervision_timeout, status = data                                # The new parameters.
+            connection = self.connections.get(conn_handle)
+            if connection is not None:
+                connection.interval = conn_interval
+                connection.latency = conn_latency
+                connection.timeout = supervision_timeout
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Connection update. Interval=", conn_interval, "latency=", conn_latency, "timeout=", supervision_timeout, "status=", status)
             return None                                                                                                 # Return an empty packet.
         elif event == Constants.IRQ_ENCRYPTION_UPDATE:                                                                           # Encryption was updated.
             conn_handle, self.encrypted, self.authenticated, self.bonded, self.key_size = data                          # Update the values.
-            print("Encryption update:", conn_handle, self.encrypted, self.authenticated, self.bonded, self.key_size)
+            connection = self.connections.get(conn_handle)
+            if connection is not None:
+                connection.encrypted = self.encrypted
+                connection.authenticated = self.authenticated
+                connection.bonded = self.bonded
+                connection.key_size = self.key_size
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Encryption update:", conn_handle, self.encrypted, self.authenticated, self.bonded, self.key_size)
         elif event == Constants.IRQ_PASSKEY_ACTION:                                                                              # Passkey actions: accept connection or show/enter passkey.
             conn_handle, action, passkey = data
-            print("Passkey action:", conn_handle, action, passkey)
-            if action == Constants.PASSKEY_ACTION_NUMCMP:                                                                        # Do we accept this connection?
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Passkey action:", conn_handle, action, passkey)
+            if self.dispatcher is not None and action != Constants.PASSKEY_ACTION_DISP and self.dispatcher.post(EVENT_PASSKEY, conn_handle, action, passkey):
+                pass                                                                                                    # Answered later, outside the IRQ. With the ring full, answered below.
+            elif action == Constants.PASSKEY_ACTION_NUMCMP:                                                             # Do we accept this connection?
                 accept = False
                 if self.passkey_callback is not None:                                                                   # Is callback function set?
                     accept = self.passkey_callback()                                                                    # Call callback for input.
                 self._ble.gap_passkey(conn_handle, action, accept)
             elif action == Constants.PASSKEY_ACTION_DISP:                                                                        # Show our passkey.
-                print("Displaying passkey")
+                if self.log_level >= Constants.LOG_INFO:
+                    print("Displaying passkey")
                 self._ble.gap_passkey(conn_handle, action, self.passkey)
             elif action == Constants.PASSKEY_ACTION_INPUT:                                                                       # Enter passkey.
-                print("Prompting for passkey")
+                if self.log_level >= Constants.LOG_INFO:
+                    print("Prompting for passkey")
                 pk = None
                 if self.passkey_callback is not None:                                                                   # Is callback function set?
                     pk = self.passkey_callback()                                                                        # Call callback for input.
                 self._ble.gap_passkey(conn_handle, action, pk)
             else:
-                print("Unknown passkey action")
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print("Unknown passkey action")
         elif event == Constants.IRQ_SET_SECRET:                                                                                  # Set secret for bonding.
             sec_type, key, value = data
             key = (sec_type, bytes(key))
@@ -198,15 +336,18 @@ class HumanInterfaceDevice(object):
                 if key in self.secrets:                                                                                 # If key is known then
                     del self.secrets[key]                                                                               # Forget key
                     self.save_secrets()
-                    print("Removing secret:", key)
+                    if self.log_level >= Constants.LOG_DEBUG:
+                        print("Removing secret:", key)
                     return True
                 else:
-                    print("Secret not found:", key)
+                    if self.log_level >= Constants.LOG_DEBUG:
+                        print("Secret not found:", key)
                     return False
             else:
                 self.secrets[key] = value                                                                               # Remember key/value
                 self.save_secrets()
-                print("Saving secret:", key, value)
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print("Saving secret:", key, value)
             return True
         elif event == Constants.IRQ_GET_SECRET:                                                                                  # Get secret for bonding
             sec_type, index, key = data
@@ -221,39 +362,75 @@ class HumanInterfaceDevice(object):
                         i += 1
             else:
                 value = self.secrets.get(_key, None)
-            print("Returning secret:", bytes(value) if value else None, "for", "key" if key else "index", _key if key else index, "with type", sec_type)
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Returning secret:", bytes(value) if value else None, "for", "key" if key else "index", _key if key else index, "with type", sec_type)
             return value
         else:
-            print("Unhandled IRQ event:", event)
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Unhandled IRQ event:", event)
+
+    # Check whether a connection meets our security requirements.
+    # Returns GATTS_NO_ERROR, or the error code to refuse access with.
+    def check_security(self, connection):
+        if self.bond and not connection.bonded:                                                                         # If we wish to bond but are not bonded, return insufficient authorization.
+            return Constants.GATTS_ERROR_INSUFFICIENT_AUTHORIZATION
+        elif self.io_capability > Constants.IO_CAPABILITY_NO_INPUT_OUTPUT and not connection.authenticated:             # If we can authenticate but the client hasn't authenticated, return insufficient authentication.
+            return Constants.GATTS_ERROR_INSUFFICIENT_AUTHENTICATION
+        elif self.le_secure and (not connection.encrypted or connection.key_size < 16):                                 # If we wish for a secure connection but it is unencrypted or not strong enough, return insufficient encryption.
+            return Constants.GATTS_ERROR_INSUFFICIENT_ENCRYPTION
+        else:                                                                                                           # Otherwise, return no error.
+            return Constants.GATTS_NO_ERROR
+
+    # Mirror the security of connection in encrypted, authenticated, bonded
+    # and key_size, or clear them if connection is None.
+    def _mirror_security(self, connection):
+        if connection is None:
+            self.encrypted = self.authenticated = self.bonded = False
+            self.key_size = 0
+        else:
+            self.encrypted = connection.encrypted
+            self.authenticated = connection.authenticated
+            self.bonded = connection.bonded
+            self.key_size = connection.key_size
 
     # Start the service.
     # Must be overwritten by subclass, and called in
     # the overwritten function by using super(Subclass, self).start().
+    # After stop(power_off=False) the radio is still on and configured, so
+    # only the settings that differ are written.
     def start(self):
         if self.device_state is HumanInterfaceDevice.DEVICE_STOPPED:
+            if self.services is None:                                                                                   # Rebuild the list released by a lean start().
+                self.services = [self.DIS, self.BAS, self.DID, self.HIDS]
             self._ble.irq(self.ble_irq)                                                                                 # Set interrupt request callback function.
-            self._ble.active(1)                                                                                         # Turn on BLE radio.
+            if not self._ble.active():
+                self._ble.active(1)                                                                                     # Turn on BLE radio.
+                HumanInterfaceDevice._owner = None                                                                      # A radio turned on has no services nor settings.
+                HumanInterfaceDevice._radio_config = {}
+                HumanInterfaceDevice._closing = set()
 
             # Configure BLE interface
-            self._ble.config(gap_name=self.device_name)                                                                 # Set GAP device name.
-            self._ble.config(mtu=23)                                                                                    # Configure MTU.
-            self._ble.config(bond=self.bond)                                                                            # Allow bonding.
-            self._ble.config(le_secure=self.le_secure)                                                                  # Require secure pairing.
-            self._ble.config(mitm=self.le_secure)                                                                       # Require man in the middle protection.
-            self._ble.config(io=self.io_capability)                                                                     # Set our input/output capabilities. Determines whether and how passkeys are used.
+            self.configure(gap_name=self.device_name)                                                                   # Set GAP device name.
+            self.configure(mtu=23)                                                                                      # Configure MTU.
+            self.configure(bond=self.bond)                                                                              # Allow bonding.
+            self.configure(le_secure=self.le_secure)                                                                    # Require secure pairing.
+            self.configure(mitm=self.le_secure)                                                                         # Require man in the middle protection.
+            self.configure(io=self.io_capability)                                                                       # Set our input/output capabilities. Determines whether and how passkeys are used.
 
             self.set_state(HumanInterfaceDevice.DEVICE_IDLE)                                                            # Update the device state.
 
             (addr_type, addr) = self._ble.config('mac')                                                                 # Get our address type and mac address.
 
-            print("BLE on with", "random" if addr_type else "public", "mac address", addr)
+            if self.log_level >= Constants.LOG_INFO:
+                print("BLE on with", "random" if addr_type else "public", "mac address", addr)
 
     # After registering the DIS and BAS services, write their characteristic values.
     # Must be overwritten by subclass, and called in
     # the overwritten function by using
     # super(Subclass, self).save_service_characteristics(handles).
     def save_service_characteristics(self, handles):
-        print("Writing service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Writing service characteristics")
 
         (h_mod, h_ser, h_fwr, h_hwr, h_swr, h_man, h_pnp) = handles[0]                                                  # Get handles to DIS service characteristics. These correspond directly to its definition in self.DIS. Position 0 because of the order of self.services.
         (self.h_bat, h_bfmt,) = handles[1]                                                                              # Get handles to BAS service characteristics. These correspond directly to its definition in self.BAS. Position 1 because of the order of self.services.
@@ -263,7 +440,8 @@ class HumanInterfaceDevice(object):
         def string_pack(in_str, nr_bytes):
             return struct.pack(str(nr_bytes)+"s", in_str.encode('UTF-8'))
 
-        print("Saving device information service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving device information service characteristics")
         self.characteristics[h_mod] = ("Model number", string_pack(self.model_number, 24))
         self.characteristics[h_ser] = ("Serial number", string_pack(self.serial_number, 16))
         self.characteristics[h_fwr] = ("Firmware revision", string_pack(self.firmware_revision, 8))
@@ -272,11 +450,13 @@ class HumanInterfaceDevice(object):
         self.characteristics[h_man] = ("Manufacturer name", string_pack(self.manufacture_name, 36))
         self.characteristics[h_pnp] = ("PnP information", struct.pack(">BHHH", self.pnp_manufacturer_source, self.pnp_manufacturer_uuid, self.pnp_product_id, self.pnp_product_version))
 
-        print("Saving battery service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving battery service characteristics")
         self.characteristics[self.h_bat] = ("Battery level", struct.pack("<B", self.battery_level))
         self.characteristics[h_bfmt] = ("Battery format", b'\x04\x00\xad\x27\x01\x00\x00')
 
-        print("Saving device identification service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving device identification service characteristics")
         self.characteristics[h_sid] = ("Specification ID", b'0x0103')
         self.characteristics[h_vid] = ("Vendor ID", struct.pack(">H", self.pnp_manufacturer_uuid))
         self.characteristics[h_pid] = ("Product ID", struct.pack(">H", self.pnp_product_id))
@@ -284,53 +464,226 @@ class HumanInterfaceDevice(object):
         self.characteristics[h_rec] = ("Primary record", b'0x01')
         self.characteristics[h_vs] = ("Vendor source", struct.pack(">H", self.pnp_manufacturer_source))
 
+        if self.tunables is not None:
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Saving tunables characteristics")
+            from lib.hidservices.tunables import TUNABLES_REPORT_ID
+            (self.h_tune, h_dt) = handles[3][-2:]                                                                       # The feature report is the last characteristic of the HIDS, see set_tunables().
+            self.characteristics[self.h_tune] = ("Tunables report", self.tunables.pack())
+            self.characteristics[h_dt] = ("Tunables reference", struct.pack("<BB", TUNABLES_REPORT_ID, 3))              # HID reference: id=0xF0, type=feature.
+
+    # Configure the radio, e.g., configure(mtu=23). Settings that hold the
+    # same value since the radio was turned on are not written again.
+    def configure(self, **settings):
+        applied = HumanInterfaceDevice._radio_config
+        for key, value in settings.items():
+            if key not in applied or applied[key] != value:
+                self._ble.config(**{key: value})
+                applied[key] = value
+
+    # Register the services and write their characteristic values.
+    # Called by subclasses in start(). The values are rebuilt on every start,
+    # so changes made while stopped, e.g., set_device_information() or the
+    # battery level, reach the radio. After deep sleep, the values come from
+    # a snapshot, see hidservices/snapshot.py. Nothing is registered when the
+    # radio still holds these services, e.g., after stop(power_off=False),
+    # and only the values that changed are written. When it holds the
+    # services of another device with the same layout, e.g., a Mouse and a
+    # Gamepad personality, their handles are taken over and only the values
+    # that differ, such as the report map, are written.
+    def register_services(self):
+        owner = HumanInterfaceDevice._owner
+        if owner is self:
+            self.write_changed_characteristics(self._handles, dict(self.characteristics))                               # Values set while stopped, e.g., the battery level.
+            return
+
+        layout = tuple(self.services)
+        if owner is not None and owner._layout == layout:
+            self._handles = owner._handles
+            self.write_changed_characteristics(self._handles, owner.characteristics)
+        else:
+            handles = self._ble.gatts_register_services(self.services)                                                  # Register services and get read/write handles for all services.
+            self._handles = handles
+            resume = HumanInterfaceDevice._resume
+            if resume is None or not resume.restore_characteristics(self, handles):                                     # A snapshot holds the values after deep sleep.
+                self.save_service_characteristics(handles)                                                              # Save the values for the characteristics.
+            self.write_service_characteristics()                                                                        # Write the values for the characteristics.
+        self._layout = layout
+        HumanInterfaceDevice._owner = self
+
+    # Rebuild the values for the characteristics and write those that differ
+    # from registered, the values the radio holds, as handle -> (name, value).
+    def write_changed_characteristics(self, handles, registered):
+        self.save_service_characteristics(handles)                                                                      # Save the values for the characteristics.
+        for handle, (_name, value) in self.characteristics.items():
+            if handle not in registered or registered[handle][1] != value:
+                self._ble.gatts_write(handle, value)
+
     # Stop the service.
-    def stop(self):
+    # With power_off=False the radio stays on with the services registered,
+    # so the next start() only configures what differs and advertises.
+    def stop(self, power_off=True):
         if self.device_state is not HumanInterfaceDevice.DEVICE_STOPPED:
-            if self.device_state is HumanInterfaceDevice.DEVICE_ADVERTISING:
+            if self.adv is not None:                                                                                    # Also when connected, it may advertise for more centrals.
                 self.adv.stop_advertising()
+            if self._fast_timer is not None:
+                self._fast_timer.deinit()
 
-            if self.conn_handle is not None:
-                self._ble.gap_disconnect(self.conn_handle)
-                self.conn_handle = None
+            for conn_handle in list(self.connections):
+                if self._ble.gap_disconnect(conn_handle) and not power_off:
+                    HumanInterfaceDevice._closing.add(conn_handle)                                                      # Up until its disconnect event.
+            self.connections = {}
+            self.conn_handle = None
 
-            self._ble.active(0)
+            if power_off:
+                self._ble.active(0)
+                HumanInterfaceDevice._owner = None
+                HumanInterfaceDevice._radio_config = {}
+                HumanInterfaceDevice._closing = set()
 
             self.set_state(HumanInterfaceDevice.DEVICE_STOPPED)
-            print("Server stopped")
+            if self.log_level >= Constants.LOG_INFO:
+                print("Server stopped")
+
+    # Hand the radio over to another device, e.g., to switch a board from a
+    # Keyboard to a Mouse personality, without turning the radio off.
+    # The hosts are disconnected and the other device starts advertising.
+    # Only what differs is updated: the radio settings, the services or, with
+    # the same layout, only their differing values, and the advertising
+    # payload with the appearance. The stack refuses to register services
+    # while it holds links (EBUSY), so with hosts connected the other device
+    # starts once their disconnect events came in, from micropython.schedule.
+    # The time taken is stored in the personality_latency of the other
+    # device. Returns the other device.
+    def switch_personality(self, device):
+        start = time.ticks_us()
+        self.stop(power_off=False)
+        HumanInterfaceDevice._switch_to = (device, start)
+        if not HumanInterfaceDevice._closing:
+            self._continue_switch()
+        return device
+
+    # Start the device of a pending switch_personality().
+    def _continue_switch(self, _arg=None):
+        if HumanInterfaceDevice._switch_to is None:
+            return
+        device, start = HumanInterfaceDevice._switch_to
+        HumanInterfaceDevice._switch_to = None
+        device.start()
+        device.start_advertising()
+        device.personality_latency = time.ticks_diff(time.ticks_us(), start)
+        if device.log_level >= Constants.LOG_INFO:
+            print("Switched personality in", device.personality_latency, "us")
 
     # Write service characteristics
     def write_service_characteristics(self):
-        print("Writing service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Writing service characteristics")
 
-        for handle, (name, value) in self.characteristics.items():
-            print(f"{name}")
-            name_cleaned = ''.join([chr(x) if 32 <= x < 128 else '?' for x in name])            
-#            name_cleaned = name.decode('utf-8', errors='replace')
-            print(f"Name: {name_cleaned} | value: {value}")
+        if not self.lean and self.log_level >= Constants.LOG_DEBUG:                                                     # Lean and quieter devices do not load the pretty-printers.
+            from lib.hidservices.debug import print_characteristics
+            print_characteristics(self.characteristics)
+
+        for handle, (_name, value) in self.characteristics.items():
             self._ble.gatts_write(handle, value)
 
     # Load bonding keys from json file.
+    # The file holds the key store and last peer of every host slot, or a flat
+    # list of keys for files written before host slots existed.
+    # json and binascii are only imported when there is a file to load.
     def load_secrets(self):
         try:
             with open("keys.json", "r") as file:
+                import json
+                import binascii
                 entries = json.load(file)
-                for sec_type, key, value in entries:
-                    self.secrets[sec_type, binascii.a2b_base64(key)] = binascii.a2b_base64(value)
+                if isinstance(entries, list):                                                                           # Old format: a single key store.
+                    entries = {"active": self.active_slot, "slots": {self.active_slot: {"peer": None, "secrets": entries}}}
+                for name, slot in entries["slots"].items():
+                    secrets = {}
+                    for sec_type, key, value in slot["secrets"]:
+                        secrets[sec_type, binascii.a2b_base64(key)] = binascii.a2b_base64(value)
+                    peer = slot["peer"]
+                    if peer is not None:
+                        peer = (peer[0], binascii.a2b_base64(peer[1]))
+                    self.host_slots[name] = [secrets, peer]
+                if entries["active"] in self.host_slots:
+                    self.active_slot = entries["active"]
+                self.secrets = self.host_slots[self.active_slot][0]
         except:
-            print("No secrets available")
+            if self.log_level >= Constants.LOG_INFO:
+                print("No secrets available")
 
     # Save bonding keys to json file.
+    # The base64 strings are decoded before dumping, CPython's json does not
+    # take bytes. The entries are built first, so a failure cannot leave a
+    # truncated file.
     def save_secrets(self):
+        import json
+        import binascii
         try:
+            slots = {}
+            for name, (secrets, peer) in self.host_slots.items():
+                slots[name] = {
+                    "peer": (peer[0], binascii.b2a_base64(peer[1], newline=False).decode()) if peer else None,
+                    "secrets": [
+                        (sec_type, binascii.b2a_base64(key, newline=False).decode(), binascii.b2a_base64(value, newline=False).decode())
+                        for (sec_type, key), value in secrets.items()
+                    ],
+                }
             with open("keys.json", "w") as file:
-                json_secrets = [
-                    (sec_type, binascii.b2a_base64(key, newline=False), binascii.b2a_base64(value, newline=False))
-                    for (sec_type, key), value in self.secrets.items()
-                ]
-                json.dump(json_secrets, file)
+                json.dump({"active": self.active_slot, "slots": slots}, file)
         except:
-            print("Failed to save secrets")
+            if self.log_level >= Constants.LOG_ERROR:
+                print("Failed to save secrets")
+
+    # Add a named host slot with its own bonding keys. Does nothing if it exists.
+    def add_host_slot(self, slot):
+        if slot not in self.host_slots:
+            self.host_slots[slot] = [{}, None]
+
+    # Forget the bonding keys and last peer of a host slot.
+    # The active slot is emptied but kept.
+    def remove_host_slot(self, slot):
+        if slot == self.active_slot:
+            self.secrets.clear()
+            self.host_slots[slot][1] = None
+        elif slot in self.host_slots:
+            del self.host_slots[slot]
+        self.save_secrets()
+
+    # Returns the names of the host slots.
+    def get_host_slots(self):
+        return list(self.host_slots.keys())
+
+    # Returns the name of the active host slot.
+    def get_host_slot(self):
+        return self.active_slot
+
+    # Returns the last peer (addr_type, addr) of a host slot, or None.
+    def get_host_peer(self, slot=None):
+        return self.host_slots[self.active_slot if slot is None else slot][1]
+
+    # Switch to another host slot, creating it if needed.
+    # Disconnects the current host, swaps in the key store of the slot so only
+    # that host's bond is presented to the stack, and advertises to it.
+    # The time until the host connects is stored in switch_latency.
+    def switch_host(self, slot):
+        self.add_host_slot(slot)
+        self.switch_start = time.ticks_ms()
+        if slot != self.active_slot:
+            self.active_slot = slot
+            self.secrets = self.host_slots[slot][0]                                                                     # Swap the active key store, no reload needed.
+            self.save_secrets()
+
+        if self.device_state is HumanInterfaceDevice.DEVICE_CONNECTED:                                                  # Advertise once the old host is gone.
+            self._switch_pending = True
+            for conn_handle in list(self.connections):
+                self._ble.gap_disconnect(conn_handle)
+        elif self.device_state is HumanInterfaceDevice.DEVICE_ADVERTISING:                                              # Already advertising, the new key store is used on the next pairing.
+            pass
+        else:
+            self.start_advertising()
 
     # Returns whether the device is not stopped.
     def is_running(self):
@@ -347,7 +700,9 @@ class HumanInterfaceDevice(object):
     # Set a new state and notify the user's callback function.
     def set_state(self, state):
         self.device_state = state
-        if self.state_change_callback is not None:
+        if self.dispatcher is not None:
+            self.dispatcher.post(EVENT_STATE, state)
+        elif self.state_change_callback is not None:
             self.state_change_callback()
 
     # Returns the state of the device, i.e.
@@ -367,11 +722,28 @@ class HumanInterfaceDevice(object):
         self.state_change_callback = callback
 
     # Begin advertising the device services.
+    # With fast_advertising, e.g., after resuming from deep sleep with a last
+    # peer, see hidservices/snapshot.py, advertise at fast_advertising_interval
+    # so the host reconnects sooner, for fast_advertising_ms or until a host
+    # connects. MicroPython does not offer directed advertising.
     def start_advertising(self):
         if self.device_state is not HumanInterfaceDevice.DEVICE_STOPPED and self.device_state is not HumanInterfaceDevice.DEVICE_ADVERTISING:
-            self.adv.start_advertising()
+            if self.fast_advertising:
+                self.adv.start_advertising(self.fast_advertising_interval)
+                if self._fast_timer is None:
+                    from machine import Timer
+                    self._fast_timer = Timer(-1)
+                self._fast_timer.init(period=self.fast_advertising_ms, mode=self._fast_timer.ONE_SHOT, callback=self._end_fast_advertising)
+            else:
+                self.adv.start_advertising()
             self.set_state(HumanInterfaceDevice.DEVICE_ADVERTISING)
 
+    # Timer callback: go on advertising at the normal interval.
+    def _end_fast_advertising(self, _timer):
+        self.fast_advertising = False
+        if self.adv.advertising and self.adv.interval_us == self.fast_advertising_interval:
+            self.adv.start_advertising()
+
     # Stop advertising the device services.
     def stop_advertising(self):
         if self.device_state is not HumanInterfaceDevice.DEVICE_STOPPED:
@@ -404,6 +776,22 @@ class HumanInterfaceDevice(object):
         else:
             self.battery_level = level
 
+    # Set a battery monitor that turns voltage samples into a smoothed battery level.
+    # See hidservices/battery.py.
+    def set_battery_monitor(self, battery):
+        self.battery = battery
+
+    # Take a sample from the battery monitor and write and notify the level
+    # only if it changed beyond the monitor's hysteresis, see
+    # notify_battery_level(). Returns whether the level changed.
+    def update_battery_level(self):
+        level = self.battery.update()
+        if level is None:
+            return False
+        self.set_battery_level(level)
+        self.notify_battery_level()
+        return True
+
     # Set device information.
     # Must be called before calling Start().
     # Variables must be Strings.
@@ -460,19 +848,235 @@ class HumanInterfaceDevice(object):
     def set_passkey_callback(self, passkey_callback):
         self.passkey_callback = passkey_callback
 
+    # Set a Dispatcher (see hidservices/dispatch.py) to run the user callbacks
+    # outside the BLE IRQ. Events are copied into the dispatcher and the
+    # callbacks run later from micropython.schedule, the main loop or asyncio.
+    # The passkey callback is then answered through gap_passkey() once it returns.
+    def set_dispatcher(self, dispatcher):
+        self.dispatcher = dispatcher
+        dispatcher.set_handler(EVENT_STATE, self._dispatch_state)
+        dispatcher.set_handler(EVENT_PASSKEY, self._dispatch_passkey)
+        dispatcher.set_handler(EVENT_TUNABLES, self._dispatch_tunables)
+        dispatcher.set_handler(EVENT_SECRETS, self._dispatch_secrets)
+
+    # Run the state change callback for a deferred state event.
+    def _dispatch_state(self, state, _b, _c):
+        if self.state_change_callback is not None:
+            self.state_change_callback()
+
+    # Run the passkey callback for a deferred passkey event and answer the stack.
+    def _dispatch_passkey(self, conn_handle, action, _passkey):
+        value = None
+        if self.passkey_callback is not None:
+            value = self.passkey_callback()
+        if action == Constants.PASSKEY_ACTION_NUMCMP:
+            value = bool(value)
+        self._ble.gap_passkey(conn_handle, action, value)
+
+    # Apply and save tunables written by the central for a deferred tunables event.
+    def _dispatch_tunables(self, _conn_handle, _b, _c):
+        self._apply_tunables()
+
+    # Apply and save tunables written by the central, scheduled by write_tunables().
+    def _apply_tunables(self, _arg=None):
+        self.tunables.apply()
+        self.tunables.save()
+
+    # Save the bonding keys for a deferred secrets event.
+    def _dispatch_secrets(self, _a, _b, _c):
+        self.save_secrets()
+
+    # Save the bonding keys, scheduled by _schedule_save_secrets().
+    def _save_secrets(self, _arg=None):
+        self.save_secrets()
+
+    # Save the bonding keys later, outside the IRQ: through the dispatcher if
+    # set, else or if its ring is full through micropython.schedule. If that
+    # fails too, they are saved at once rather than lost.
+    def _schedule_save_secrets(self):
+        if self.dispatcher is not None and self.dispatcher.post(EVENT_SECRETS):
+            return
+        try:
+            micropython.schedule(self._save_secrets, None)
+        except RuntimeError:                                                                                            # Schedule queue full.
+            self.save_secrets()
+
     # Set the passkey used during pairing when entering a passkey at the main.
     def set_passkey(self, passkey):
         self.passkey = passkey
 
-    # Notifies the client by writing to the battery level handle.
+    # Writes the battery level to its characteristic, also while no client is
+    # connected, so the next client reads the current level. Notifies the
+    # connected clients. While stopped, the next start() writes it.
     def notify_battery_level(self):
+        if not self.is_running():
+            return
+        value = struct.pack("<B", self.battery_level)
+        self.characteristics[self.h_bat] = ("" if self.lean else "Battery level", value)
+        self._ble.gatts_write(self.h_bat, value)
         if self.is_connected():
-            print("Notify battery level: ", self.battery_level)
-            value = struct.pack("<B", self.battery_level)
-            self.characteristics[self.h_bat] = ("Battery level", value)
-            self._ble.gatts_notify(self.conn_handle, self.h_bat, value)
+            if self.log_level >= Constants.LOG_VERBOSE:
+                print("Notify battery level: ", self.battery_level)
+            self.notify_report(self.h_bat, value)
+
+    # Set the transport that sends reports to the clients, see hidservices/transport.py.
+    # Defaults to the BLE radio.
+    def set_transport(self, transport):
+        self.transport = transport
+
+    # Set lean mode to save RAM on small boards. In lean mode, the list of
+    # service descriptions and the registered layout are released once the
+    # services are registered, and the debug pretty-printers are not loaded.
+    # The report maps and service descriptions are held once per class, and
+    # the characteristic descriptions are interned literals, so nothing else
+    # is kept per instance. A lean device does not take over the handles of
+    # another personality with the same layout, see register_services(), it
+    # registers its services again. See tools/measure_lean.py.
+    def set_lean(self, lean=True):
+        self.lean = lean
+
+    # Release the data only needed to register the services.
+    # Called by subclasses at the end of start().
+    def release_construction_data(self):
+        if not self.lean:
+            return
+        self.services = None
+        self._layout = None                                                                                             # Rebuilt from the class data by the next start().
+        gc.collect()
+
+    # Set a power policy that follows the input activity, see hidservices/power.py.
+    # Every notify of a report counts as input.
+    def set_power_policy(self, policy):
+        self.power = policy
+
+    # Let the host tune the device at runtime through a vendor defined feature
+    # report, see hidservices/tunables.py. Must be called before start(): the
+    # report is added to the HIDS and to the report map of this device. The
+    # values of the tunables are applied at once.
+    def set_tunables(self, tunables):
+        from lib.hidservices.tunables import CHARACTERISTIC, REPORT_MAP
+        if self.tunables is None:
+            self.HIDS = (self.HIDS[0], self.HIDS[1] + (CHARACTERISTIC,))
+            self.HID_INPUT_REPORT = self.HID_INPUT_REPORT + REPORT_MAP                                                  # Per instance, the class keeps the plain report map.
+            if self.services is not None:
+                self.services[3] = self.HIDS
+        self.tunables = tunables
+        tunables.device = self
+        tunables.apply()
+
+    # Handle a write of the central to the tunables feature report.
+    # Writes of clients that do not meet the security requirements and invalid
+    # values are refused, and the current values are written back. Valid
+    # values are applied without restarting and saved if the tunables have a
+    # config file, outside the IRQ: through the dispatcher if set, else or if
+    # its ring is full through micropython.schedule, and only if that fails
+    # too at once.
+    def write_tunables(self, conn_handle, value):
+        tunables = self.tunables
+        connection = self.connections.get(conn_handle)
+        status = Constants.GATTS_ERROR_WRITE_NOT_PERMITTED if connection is None else self.check_security(connection)
+        if status == Constants.GATTS_NO_ERROR and not tunables.write(value):
+            status = Constants.GATTS_ERROR_WRITE_REQ_REJECTED
+        report = tunables.pack()
+        self.characteristics[self.h_tune] = ("" if self.lean else "Tunables report", report)
+        if status != Constants.GATTS_NO_ERROR:
+            if self.log_level >= Constants.LOG_DEBUG:
+                print("Refused tunables", value)
+            self._ble.gatts_write(self.h_tune, report)                                                                  # Restore the current values for the next read.
+            return status
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Tunables written:", report)
+        if self.dispatcher is None or not self.dispatcher.post(EVENT_TUNABLES, conn_handle):                            # Apply and save later, outside the IRQ.
+            try:
+                micropython.schedule(self._apply_tunables, None)
+            except RuntimeError:                                                                                        # Schedule queue full, apply now rather than lose the values.
+                self._apply_tunables()
+        return status
+
+    # Set the number of clients to serve at once, e.g., to drive several hosts
+    # with the same reports. Keeps advertising until that many are connected.
+    def set_max_connections(self, max_connections=1):
+        self.max_connections = max_connections
+
+    # Returns the Connection of a connected client, the most recent one by default.
+    def get_connection(self, conn_handle=None):
+        return self.connections.get(self.conn_handle if conn_handle is None else conn_handle)
+
+    # Set whether reports are only notified to clients that meet the security
+    # requirements, the same check read requests get, see check_security().
+    # Off by default: every connected client is notified, as a single client
+    # always was. Turn it on to keep reports from a client that connected
+    # but has not paired or encrypted yet.
+    def set_secure_notify(self, secure_notify=True):
+        self.secure_notify = secure_notify
+
+    # Set the level up to which the library prints messages, from
+    # Constants.LOG_QUIET to Constants.LOG_VERBOSE, the default, which prints
+    # every notified report. Tunables set it from their log level.
+    def set_log_level(self, log_level):
+        self.log_level = log_level
+        if self.adv is not None:
+            self.adv.log_level = log_level
+
+    # Notify every connected client of a new value of a characteristic, only
+    # those that meet the security requirements with set_secure_notify().
+    # The same packed value is sent to all.
+    def notify_report(self, handle, report):
+        for conn_handle, connection in tuple(self.connections.items()):                                                 # A copy, the IRQ handler may add or remove connections meanwhile.
+            if self._wants_report(connection, handle):
+                self.transport.notify(conn_handle, handle, report)
+
+    # Returns whether a connection is to be notified of a value of handle.
+    def _wants_report(self, connection, handle):
+        return not self.secure_notify or self.check_security(connection) == Constants.GATTS_NO_ERROR
 
     # Notifies the client of the HID state.
     # Must be overwritten by subclass.
     def notify_hid_report(self):
         return
+
+    # Notify a report like notify_report(), retrying while the stack is out
+    # of buffers. Only the connections that did not take the report yet are
+    # retried, so none gets it twice. Yields False while waiting, see
+    # _send_stream().
+    def _push_report(self, handle, report):
+        sent = []                                                                                                       # Connection handles that took this report.
+        while True:
+            try:
+                for conn_handle, connection in tuple(self.connections.items()):
+                    if conn_handle not in sent and self._wants_report(connection, handle):
+                        self.transport.notify(conn_handle, handle, report)
+                        sent.append(conn_handle)
+                return
+            except OSError as e:
+                if e.args[0] != errno.ENOMEM:
+                    raise
+                yield False
+
+    # Send a stream of reports, see send_stream() of the devices.
+    # Each sample is packed with fmt at offset into report, a copy of the
+    # current report, which is then notified. samples is either an iterable
+    # of tuples, or a flat bytes, bytearray, array or memoryview holding
+    # stride values per sample. Yields True after every report and False
+    # while the stack is out of buffers, so callers can pace, pause or
+    # cancel the stream (close() the generator), e.g.,
+    #   for sent in mouse.send_stream(array("b", [5, 0, 5, 0, 0, 5])):
+    #       if not sent:
+    #           time.sleep_ms(1)
+    # Ends early when the last client disconnects. The device state is not changed.
+    def _send_stream(self, handle, report, fmt, offset, samples, stride):
+        if isinstance(samples, (bytes, bytearray, memoryview, array)):
+            view = memoryview(samples)
+            for i in range(0, len(view) - stride + 1, stride):
+                if not self.is_connected():
+                    return
+                struct.pack_into(fmt, report, offset, *view[i:i + stride])
+                yield from self._push_report(handle, report)
+                yield True
+        else:
+            for sample in samples:
+                if not self.is_connected():
+                    return
+                struct.pack_into(fmt, report, offset, *sample)
+                yield from self._push_report(handle, report)
+                yield True
@@ -0,0 +1,43 @@
+# Device classes and subsystems, imported on first use. E.g.,
+#   from lib.hidservices import Mouse
+# only loads hidservices/mouse.py and what it needs. Importing the modules
+# directly, e.g., from lib.hidservices.mouse import Mouse, works as before.
+
+# Name -> module that defines it.
+_MODULES = {
+    "Keyboard": "keyboard",
+    "Mouse": "mouse",
+    "Joystick": "joystick",
+    "Gamepad": "gamepad",
+    "AbsoluteMouse": "absmouse",
+    "Touchpad": "touchpad",
+    "GenericDevice": "generic",
+    "Advertiser": "advertiser",
+    "Constants": "constants",
+    "Battery": "battery",
+    "Dispatcher": "dispatch",
+    "InputPipeline": "pipeline",
+    "PointerAcceleration": "pointer",
+    "PowerPolicy": "power",
+    "KeyboardLayout": "layout",
+    "LayoutStore": "layout",
+    "MacroCompiler": "macro",
+    "MacroStore": "macro",
+    "MacroPlayer": "macro",
+    "Typematic": "typematic",
+    "Snapshot": "snapshot",
+    "ThreadedInput": "threaded",
+    "EventRing": "threaded",
+    "Tunables": "tunables",
+    "BLETransport": "transport",
+    "StreamTransport": "transport",
+}
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(name)
+    value = getattr(__import__("lib.hidservices." + module, None, None, (name,)), name)
+    globals()[name] = value                                                                                             # Later lookups do not get here.
+    return value
@@ -0,0 +1,193 @@
+from micropython import const
+from bluetooth import UUID
+from lib.hid_services import HumanInterfaceDevice, ReportBuffer
+from lib.hidservices.constants import Constants
+import struct
+
+# Class that represents an absolute pointer, e.g., for touch overlays and kiosk automation.
+# The host maps the logical range 0..32767 onto the whole screen, so a single
+# report moves the cursor anywhere instead of a stream of relative moves.
+class AbsoluteMouse(HumanInterfaceDevice):
+    LOGICAL_MAX = const(32767)
+
+    HIDS = (                                                                                                       # Service description: describes the service and how we communicate.
+        UUID(0x1812),                                                                                                   # 0x1812 = Human Interface Device.
+        (
+            (UUID(0x2A4A), Constants.F_READ),                                                                           # 0x2A4A = HID information, to be read by client.
+            (UUID(0x2A4B), Constants.F_READ),                                                                           # 0x2A4B = HID report map, to be read by client.
+            (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                          # 0x2A4C = HID control point, to be written by client.
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                   # 0x2A4D = HID report, to be read by client after notification.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                   # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                          # 0x2A4E = HID protocol mode, to be written & read by client.
+        ),
+    )
+
+    # fmt: off
+    HID_INPUT_REPORT = bytes([                                                                                           # Report Description: describes what we communicate.
+        0x05, 0x01,                                                                                                     # USAGE_PAGE (Generic Desktop)
+        0x09, 0x02,                                                                                                     # USAGE (Mouse)
+        0xa1, 0x01,                                                                                                     # COLLECTION (Application)
+        0x85, 0x01,                                                                                                     #   REPORT_ID (1)
+        0x09, 0x01,                                                                                                     #   USAGE (Pointer)
+        0xa1, 0x00,                                                                                                     #   COLLECTION (Physical)
+        0x05, 0x09,                                                                                                     #         Usage Page (Buttons)
+        0x19, 0x01,                                                                                                     #         Usage Minimum (1)
+        0x29, 0x03,                                                                                                     #         Usage Maximum (3)
+        0x15, 0x00,                                                                                                     #         Logical Minimum (0)
+        0x25, 0x01,                                                                                                     #         Logical Maximum (1)
+        0x95, 0x03,                                                                                                     #         Report Count (3)
+        0x75, 0x01,                                                                                                     #         Report Size (1)
+        0x81, 0x02,                                                                                                     #         Input(Data, Variable, Absolute); 3 button bits
+        0x95, 0x01,                                                                                                     #         Report Count(1)
+        0x75, 0x05,                                                                                                     #         Report Size(5)
+        0x81, 0x03,                                                                                                     #         Input(Constant);                 5 bit padding
+        0x05, 0x01,                                                                                                     #         Usage Page (Generic Desktop)
+        0x09, 0x30,                                                                                                     #         Usage (X)
+        0x09, 0x31,                                                                                                     #         Usage (Y)
+        0x15, 0x00,                                                                                                     #         Logical Minimum (0)
+        0x26, 0xff, 0x7f,                                                                                               #         Logical Maximum (32767)
+        0x75, 0x10,                                                                                                     #         Report Size (16)
+        0x95, 0x02,                                                                                                     #         Report Count (2)
+        0x81, 0x02,                                                                                                     #         Input(Data, Variable, Absolute); 2 position words (X,Y)
+        0x09, 0x38,                                                                                                     #         Usage (Wheel)
+        0x15, 0x81,                                                                                                     #         Logical Minimum (-127)
+        0x25, 0x7F,                                                                                                     #         Logical Maximum (127)
+        0x75, 0x08,                                                                                                     #         Report Size (8)
+        0x95, 0x01,                                                                                                     #         Report Count (1)
+        0x81, 0x06,                                                                                                     #         Input(Data, Variable, Relative); wheel byte
+        0xc0,                                                                                                           #   END_COLLECTION
+        0xc0                                                                                                            # END_COLLECTION
+    ])
+    # fmt: on
+
+    def __init__(self, name="Bluetooth Absolute Mouse", screen_width=1920, screen_height=1080):
+        super(AbsoluteMouse, self).__init__(name)                                                                       # Set up the general HID services in super.
+        self.device_appearance = 962                                                                                    # Device appearance ID, 962 = mouse.
+
+        # Define the initial pointer state.
+        self.x = 0                                                                                                      # Logical position, 0..32767.
+        self.y = 0
+        self.w = 0
+
+        self.button1 = 0
+        self.button2 = 0
+        self.button3 = 0
+
+        self.set_screen_size(screen_width, screen_height)
+
+        self._state = ReportBuffer(6)                                                                                   # Report buffers: buttons, x, y, wheel.
+
+        self.services.append(self.HIDS)                                                                                 # Append to list of service descriptions.
+
+    # Overwrite super to register HID specific service.
+    def start(self):
+        super(AbsoluteMouse, self).start()                                                                              # Call super to register DIS and BAS services.
+
+        if self.log_level >= Constants.LOG_INFO:
+            print("Registering services")
+        self.register_services()                                                                                        # Register services, or reuse the registered ones, and write the characteristic values.
+        self.release_construction_data()                                                                                # Release what is only needed for registering in lean mode.
+        if self.adv is None:                                                                                            # Restarts reuse the advertiser and its payload.
+            from lib.hidservices.advertiser import Advertiser                                                           # Imported on first start.
+            self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance, self.device_name, self.log_level)                  # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
+
+        if self.log_level >= Constants.LOG_INFO:
+            print("Server started")
+
+    # Overwrite super to save HID specific characteristics.
+    def save_service_characteristics(self, handles):
+        super(AbsoluteMouse, self).save_service_characteristics(handles)                                                # Call super to write DIS and BAS characteristics.
+        (h_info, h_hid, h_ctrl, self.h_rep, h_d1, h_proto) = handles[3][:6]                                             # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS, set_tunables() may add one more. Position 3 because of the order of self.services.
+
+        self.pack_report()                                                                                              # Pack the initial pointer state as described by the input report.
+        self._state.commit()
+
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving HID service characteristics")
+        self.characteristics[h_info] = ("HID information", b"\x01\x01\x00\x00")                                         # HID info: ver=1.1, country=0, flags=000000cw with c=normally connectable w=wake up signal
+        self.characteristics[h_hid] = ("HID input report map", self.HID_INPUT_REPORT)                                   # HID input report map.
+        self.characteristics[h_ctrl] = ("HID control point", b"\x00")                                                   # HID control point.
+        self.characteristics[self.h_rep] = ("HID report", self._state.front)                                            # HID report.
+        self.characteristics[h_d1] = ("HID reference", struct.pack("<BB", 1, 1))                                        # HID reference: id=1, type=input.
+        self.characteristics[h_proto] = ("HID protocol mode", b"\x01")                                                  # HID protocol mode: report.
+
+    # Pack the pointer state into the back buffer.
+    def pack_report(self):
+        b = self.button1 | (self.button2 << 1) | (self.button3 << 2)
+        struct.pack_into("<BHHb", self._state.back, 0, b, self.x, self.y, self.w)
+        return self._state.back
+
+    # Overwrite super to notify central of a hid report.
+    # Commits the state set so far and notifies it.
+    def notify_hid_report(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self.pack_report()
+        self._state.commit()
+        self.notify_committed()
+
+    # Publish the state set so far as the next report.
+    def commit(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self.pack_report()
+        self._state.commit()
+
+    # Notify central of the last committed report. Safe to call from a timer
+    # or scheduled callback while other code is setting the next state.
+    def notify_committed(self):
+        if self.is_connected():
+            state = self._state.front                                                                                   # A bytes snapshot, kept as the value while the next state is set.
+            self.characteristics[self.h_rep] = ("" if self.lean else "HID report", state)
+            self.notify_report(self.h_rep, state)                                                                       # Notify central by writing to the report handle.
+
+    # Send a stream of absolute positions in logical units as fast as the link
+    # allows. samples holds (x, y) pairs, as tuples or flat in an array("H").
+    # A generator, see HumanInterfaceDevice._send_stream().
+    def send_stream(self, samples, stride=2):
+        if stride != 2:
+            raise ValueError("Stride must be 2")
+        return self._send_stream(self.h_rep, bytearray(self.pack_report()), "<HH", 1, samples, stride)
+
+    # Set the screen size in pixels used to scale move_to().
+    def set_screen_size(self, width, height):
+        self.screen_width = width
+        self.screen_height = height
+        self._x_max = width - 1 if width > 1 else 1                                                                     # Largest pixel coordinate, maps to LOGICAL_MAX.
+        self._y_max = height - 1 if height > 1 else 1
+
+    # Move the pointer to pixel (x, y) of the configured screen.
+    def move_to(self, x, y):
+        if x < 0:
+            x = 0
+        elif x > self._x_max:
+            x = self._x_max
+
+        if y < 0:
+            y = 0
+        elif y > self._y_max:
+            y = self._y_max
+
+        self.x = (x * AbsoluteMouse.LOGICAL_MAX + (self._x_max >> 1)) // self._x_max                                    # Scale with rounding.
+        self.y = (y * AbsoluteMouse.LOGICAL_MAX + (self._y_max >> 1)) // self._y_max
+
+    # Set the pointer position in logical units (0 to 32767).
+    def set_position(self, x=0, y=0):
+        self.x = 0 if x < 0 else (AbsoluteMouse.LOGICAL_MAX if x > AbsoluteMouse.LOGICAL_MAX else x)
+        self.y = 0 if y < 0 else (AbsoluteMouse.LOGICAL_MAX if y > AbsoluteMouse.LOGICAL_MAX else y)
+
+    # Set the mouse scroll wheel value.
+    def set_wheel(self, w=0):
+        if w > 127:
+            w = 127
+        elif w < -127:
+            w = -127
+
+        self.w = w
+
+    # Set the mouse button values.
+    def set_buttons(self, b1=0, b2=0, b3=0):
+        self.button1 = b1
+        self.button2 = b2
+        self.button3 = b3
@@ -20,7 +20,7 @@ class Advertiser:
         )
 
         if name:
-            _append(Constants.ADV_TYPE_NAME, name)
+            _append(Constants.ADV_TYPE_NAME, name.encode() if isinstance(name, str) else name)
 
         if services:
             for uuid in services:
@@ -40,13 +40,8 @@ class Advertiser:
 
 
     def decode_field(self, payload, adv_type):
-        i = 0
-        result = []
-        while i + 1 < len(payload):
-            if payload[i + 1] == adv_type:
-                result.append(payload[i + 2 : i + payload[i] + 1])
-            i += 1 + payload[i]
-        return result
+        from lib.hidservices.fastpath import decode_field
+        return decode_field(payload, adv_type)
 
 
     def decode_name(self, payload):
@@ -65,22 +60,31 @@ class Advertiser:
         return services
 
     # Init as generic HID device (960 = generic HID appearance value).
-    def __init__(self, ble, services=[UUID(0x1812)], appearance=const(960), name="Generic HID Device"):
+    def __init__(self, ble, services=[UUID(0x1812)], appearance=const(960), name="Generic HID Device", log_level=Constants.LOG_VERBOSE):
         self._ble = ble
         self._payload = self.advertising_payload(name=name, services=services, appearance=appearance)
 
-        self.advertising = False
-        print("Advertiser created: ", self.decode_name(self._payload), " with services: ", self.decode_services(self._payload))
-
-    # Start advertising at 100000 interval.
-    def start_advertising(self):
-        if not self.advertising:
-            self._ble.gap_advertise(100000, adv_data=self._payload)
-            print("Started advertising")
+        self.advertising = False                                                                                        # Whether the radio advertises this payload, cleared by the device on connect.
+        self.interval_us = 100000                                                                                       # The advertising interval in use.
+        self.log_level = log_level                                                                                      # Print messages up to this level, follows the device's.
+        if log_level >= Constants.LOG_INFO:
+            print("Advertiser created: ", name, " with services: ", services)                                               # The arguments, decoding the payload would load the decode helpers.
+
+    # Start advertising at 100000 interval, or at another interval in
+    # microseconds. Advertising at another interval restarts it.
+    def start_advertising(self, interval_us=100000):
+        if not self.advertising or interval_us != self.interval_us:
+            self._ble.gap_advertise(interval_us, adv_data=self._payload)
+            self.advertising = True
+            self.interval_us = interval_us
+            if self.log_level >= Constants.LOG_INFO:
+                print("Started advertising")
 
     # Stop advertising by setting interval of 0.
     def stop_advertising(self):
         if self.advertising:
             self._ble.gap_advertise(0, adv_data=self._payload)
-            print("Stopped advertising")
+            self.advertising = False
+            if self.log_level >= Constants.LOG_INFO:
+                print("Stopped advertising")
 
@@ -0,0 +1,117 @@
+from array import array
+
+# Single cell LiPo discharge curve as (millivolts, percent) points, ascending.
+LIPO_CURVE = (
+    (3300, 0),
+    (3500, 5),
+    (3600, 10),
+    (3650, 20),
+    (3700, 30),
+    (3750, 40),
+    (3800, 50),
+    (3900, 65),
+    (4000, 80),
+    (4100, 90),
+    (4200, 100),
+)
+
+# Battery voltage source reading an ADC pin through a voltage divider.
+# Any object with a read_mv() method returning millivolts can be used instead.
+class ADCSource:
+    def __init__(self, pin, divider=2):
+        from machine import ADC, Pin
+        self._adc = ADC(Pin(pin))
+        try:
+            self._adc.atten(ADC.ATTN_11DB)                                                                              # Full range on ESP32.
+        except AttributeError:
+            pass
+        self.divider = divider                                                                                          # Ratio of the battery voltage to the pin voltage.
+
+    def read_mv(self):
+        return self._adc.read_uv() // 1000 * self.divider
+
+
+# Battery source returning preset values, for testing without hardware.
+class FakeSource:
+    def __init__(self, mv=4200):
+        self.mv = mv
+
+    def read_mv(self):
+        return self.mv
+
+
+# Class that turns raw battery voltage samples into a stable battery level.
+# Samples are smoothed by a fixed-size integer moving average and mapped to a
+# percentage through a lookup table computed once from the discharge curve.
+# A new level is only reported once it moved by at least the hysteresis.
+class Battery:
+    def __init__(self, source, curve=LIPO_CURVE, window=8, hysteresis=2, resolution=2):
+        self.source = source                                                                                            # The voltage source, see ADCSource.
+        self.hysteresis = hysteresis                                                                                    # Minimum change in percent before a new level is reported.
+
+        self._samples = array("H", [0] * window)                                                                        # Ring of the last samples in millivolts.
+        self._index = 0                                                                                                 # Position of the oldest sample.
+        self._sum = 0                                                                                                   # Running sum of the samples.
+        self._filled = False                                                                                            # Is the ring primed with a first sample?
+
+        self._shift = resolution                                                                                        # Lookup table step is 2^resolution millivolts.
+        self._min_mv = curve[0][0]
+        self._max_mv = curve[-1][0]
+        self._table = self._build_table(curve)                                                                          # Percentage per voltage step.
+
+        self.level = None                                                                                               # The last reported level.
+
+    # Precompute the percentage for every voltage step by linear interpolation of the curve.
+    def _build_table(self, curve):
+        steps = ((self._max_mv - self._min_mv) >> self._shift) + 1
+        table = bytearray(steps)
+        segment = 0
+        for i in range(steps):
+            mv = self._min_mv + (i << self._shift)
+            while segment < len(curve) - 2 and mv > curve[segment + 1][0]:
+                segment += 1
+            (mv0, p0), (mv1, p1) = curve[segment], curve[segment + 1]
+            if mv >= mv1:
+                table[i] = p1
+            else:
+                table[i] = p0 + ((mv - mv0) * (p1 - p0) + ((mv1 - mv0) >> 1)) // (mv1 - mv0)
+        return table
+
+    # Add a sample in millivolts to the moving average.
+    def add_sample(self, mv):
+        samples = self._samples
+        if not self._filled:
+            for i in range(len(samples)):
+                samples[i] = mv
+            self._sum = mv * len(samples)
+            self._filled = True
+        else:
+            self._sum += mv - samples[self._index]
+            samples[self._index] = mv
+            self._index += 1
+            if self._index == len(samples):
+                self._index = 0
+
+    # Returns the smoothed voltage in millivolts.
+    def voltage(self):
+        return self._sum // len(self._samples)
+
+    # Returns the percentage for the smoothed voltage.
+    def percentage(self):
+        mv = self.voltage()
+        if mv <= self._min_mv:
+            return self._table[0]
+        elif mv >= self._max_mv:
+            return self._table[-1]
+        return self._table[(mv - self._min_mv) >> self._shift]
+
+    # Take a sample from the source and return the new level if it should be
+    # reported, or None if it did not change beyond the hysteresis.
+    def update(self):
+        self.add_sample(self.source.read_mv())
+        percent = self.percentage()
+        level = self.level
+        if level is None or percent - level >= self.hysteresis or level - percent >= self.hysteresis or (percent != level and (percent == 0 or percent == 100)):
+            self.level = percent
+            return percent
+        return None
@@ -78,3 +78,10 @@ class Constants(object):
     GATTS_ERROR_ATTR_NOT_FOUND = const(0x0a)
     GATTS_ERROR_INSUFFICIENT_ENCRYPTION = const(0x0f)
     GATTS_ERROR_WRITE_REQ_REJECTED = const(0xFC)
+
+    # Log levels, the library prints messages up to HumanInterfaceDevice.log_level.
+    LOG_QUIET = const(0)
+    LOG_ERROR = const(1)                                                                                                # Failures, e.g., to save the bonding keys.
+    LOG_INFO = const(2)                                                                                                 # Connections, state changes and start-up.
+    LOG_DEBUG = const(3)                                                                                                # IRQ events, characteristic writes and reads, bonding keys.
+    LOG_VERBOSE = const(4)                                                                                              # Every notified report.
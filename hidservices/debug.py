@@ -0,0 +1,9 @@
+# Pretty-printers for debugging, imported on first use so lean devices and
+# devices that do not print never load them.
+
+
+# Print the name and value of every characteristic.
+def print_characteristics(characteristics):
+    for handle, (name, value) in characteristics.items():
+        name_cleaned = "".join([x if 32 <= ord(x) < 128 else "?" for x in name])
+        print("Handle:", handle, "| Name:", name_cleaned, "| value:", value)
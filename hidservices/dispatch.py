@@ -0,0 +1,104 @@
+from micropython import const
+from array import array
+import micropython
+from lib.hidservices.fastpath import store_event
+
+# Event kinds.
+EVENT_STATE = const(0)                                                                                                  # Device state changed: a = new state.
+EVENT_LEDS = const(1)                                                                                                   # Keyboard LEDs written by the central: a = LED bits.
+EVENT_PASSKEY = const(2)                                                                                                # Passkey action: a = connection handle, b = action, c = passkey.
+EVENT_TUNABLES = const(3)                                                                                               # Tunables written by the central: a = connection handle.
+EVENT_SECRETS = const(4)                                                                                                # Bonding keys or last peer changed, to be saved: no arguments.
+_EVENTS = const(5)
+
+# Keyboard LED bits of the output report.
+LED_NUM_LOCK = const(0x01)
+LED_CAPS_LOCK = const(0x02)
+LED_SCROLL_LOCK = const(0x04)
+LED_COMPOSE = const(0x08)
+LED_KANA = const(0x10)
+
+# Decode keyboard LED bits into (num_lock, caps_lock, scroll_lock, compose, kana) booleans.
+def decode_leds(bits):
+    return (bool(bits & LED_NUM_LOCK), bool(bits & LED_CAPS_LOCK), bool(bits & LED_SCROLL_LOCK), bool(bits & LED_COMPOSE), bool(bits & LED_KANA))
+
+
+# Class that defers user callbacks out of the BLE IRQ.
+# post() copies an event into a preallocated slot of a ring and returns
+# immediately. The events are handled later, either through
+# micropython.schedule, by calling drain() from the main loop, or by running
+# serve() as an asyncio task. Events posted while the ring is full are
+# dropped and counted in overflows.
+class Dispatcher:
+    def __init__(self, size=8, schedule=True):
+        self._size = size + 1                                                                                           # Number of event slots, one is kept free to tell full from empty.
+        self._kinds = bytearray(self._size)                                                                             # Event kind per slot.
+        self._args = array("i", [0] * (self._size * 3))                                                                 # Three integer arguments per slot.
+        self._head = 0                                                                                                  # Next slot to write, only moved by post().
+        self._tail = 0                                                                                                  # Next slot to read, only moved by drain().
+
+        self._handlers = [None] * _EVENTS                                                                               # Handler per event kind, called with (a, b, c).
+        self.schedule = schedule                                                                                        # Drain through micropython.schedule?
+        self._scheduled = False                                                                                         # Is a drain scheduled already?
+        self._drain = self.drain                                                                                        # Bound method, created once so scheduling does not allocate.
+
+        self.overflows = 0                                                                                              # Number of events dropped because the ring was full.
+        self.dispatched = 0                                                                                             # Number of events handled.
+
+    # Set the handler of an event kind. It is called with the three event arguments.
+    def set_handler(self, kind, handler):
+        self._handlers[kind] = handler
+
+    # Returns the number of pending events.
+    def pending(self):
+        n = self._head - self._tail
+        return n if n >= 0 else n + self._size
+
+    # Queue an event. Safe to call from IRQ context. Returns False on overflow.
+    def post(self, kind, a=0, b=0, c=0):
+        i = self._head
+        head = i + 1 if i + 1 < self._size else 0
+        if head == self._tail:
+            self.overflows += 1
+            return False
+
+        store_event(self._kinds, self._args, i, kind, a, b, c)
+        self._head = head                                                                                               # Publish the event.
+
+        if self.schedule and not self._scheduled:
+            try:
+                micropython.schedule(self._drain, None)
+                self._scheduled = True
+            except RuntimeError:                                                                                        # Schedule queue full, the next post or drain() picks it up.
+                pass
+        return True
+
+    # Handle all pending events. Call from the main loop when not scheduling.
+    def drain(self, _arg=None):
+        self._scheduled = False
+        while self._tail != self._head:
+            i = self._tail
+            kind = self._kinds[i]
+            i3 = i * 3
+            a = self._args[i3]
+            b = self._args[i3 + 1]
+            c = self._args[i3 + 2]
+            self._tail = i + 1 if i + 1 < self._size else 0                                                             # Free the slot.
+
+            handler = self._handlers[kind]
+            if handler is not None:
+                handler(a, b, c)
+            self.dispatched += 1
+
+    # Drain events periodically as an asyncio task.
+    async def serve(self, period=10):
+        try:
+            import uasyncio as asyncio
+        except ImportError:
+            import asyncio
+        while True:
+            self.drain()
+            if hasattr(asyncio, "sleep_ms"):
+                await asyncio.sleep_ms(period)
+            else:
+                await asyncio.sleep(period / 1000)
@@ -0,0 +1,135 @@
+# Hot paths of the report setters, the IRQ event dispatch and the advertiser.
+# The native and viper versions in hidservices/native.py are used when they
+# compile on this port. Otherwise, e.g., on CPython or a port without the
+# native emitter, the pure Python versions below are used. NATIVE tells
+# which. check() compares both versions and benchmark() times them.
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:                                                                                                     # CPython, for benchmarks on the host.
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+# Clamp v to lo..hi.
+def py_clamp(v, lo, hi):
+    if v < lo:
+        return lo
+    if v > hi:
+        return hi
+    return v
+
+
+# Store two signed bytes, e.g., the x and y axes of a report.
+def py_put_s8x2(buf, offset, a, b):
+    buf[offset] = a & 0xFF
+    buf[offset + 1] = b & 0xFF
+
+
+# Assemble eight button or modifier values, 0 or 1, into a byte. b0 is bit 0.
+def py_bits8(b0, b1, b2, b3, b4, b5, b6, b7):
+    return b0 | (b1 << 1) | (b2 << 2) | (b3 << 3) | (b4 << 4) | (b5 << 5) | (b6 << 6) | (b7 << 7)
+
+
+# Store an event in slot i of a Dispatcher ring.
+def py_store_event(kinds, args, i, kind, a, b, c):
+    kinds[i] = kind
+    i3 = i * 3
+    args[i3] = a
+    args[i3 + 1] = b
+    args[i3 + 2] = c
+
+
+# Return the fields of an advertising type in an advertising payload.
+def py_decode_field(payload, adv_type):
+    i = 0
+    n = len(payload)
+    result = []
+    while i + 1 < n:
+        if payload[i + 1] == adv_type:
+            result.append(payload[i + 2 : i + payload[i] + 1])
+        i += 1 + payload[i]
+    return result
+
+
+try:
+    from lib.hidservices.native import clamp, put_s8x2, bits8, store_event, decode_field
+    NATIVE = True
+except (ImportError, SyntaxError, NameError, AttributeError):                                                           # No native emitter, or not MicroPython.
+    clamp = py_clamp
+    put_s8x2 = py_put_s8x2
+    bits8 = py_bits8
+    store_event = py_store_event
+    decode_field = py_decode_field
+    NATIVE = False
+
+
+# Compare the selected and the pure Python versions over their input ranges.
+# Returns the number of mismatches, 0 if equivalent.
+def check():
+    from array import array
+
+    errors = 0
+    for v in range(-300, 301, 7):
+        for lo, hi in ((-127, 127), (0, 255), (-32767, 32767)):
+            if clamp(v, lo, hi) != py_clamp(v, lo, hi):
+                errors += 1
+
+    a = bytearray(4)
+    b = bytearray(4)
+    for x in range(-127, 128):
+        put_s8x2(a, 1, x, -x)
+        py_put_s8x2(b, 1, x, -x)
+        if a != b:
+            errors += 1
+
+    for v in range(256):
+        bits = [(v >> i) & 1 for i in range(8)]
+        if bits8(*bits) != py_bits8(*bits) or py_bits8(*bits) != v:
+            errors += 1
+
+    kinds = (bytearray(4), bytearray(4))
+    args = (array("i", [0] * 12), array("i", [0] * 12))
+    for i in range(4):
+        store_event(kinds[0], args[0], i, i, -i, 1 << 20, i * 7)
+        py_store_event(kinds[1], args[1], i, i, -i, 1 << 20, i * 7)
+    if kinds[0] != kinds[1] or list(args[0]) != list(args[1]):
+        errors += 1
+
+    payload = b"\x02\x01\x06\x03\x19\xc2\x03\x03\x03\x12\x18\x05\x09abcd\x00"
+    for adv_type in (0x01, 0x03, 0x09, 0x19, 0x20):
+        if decode_field(payload, adv_type) != py_decode_field(payload, adv_type):
+            errors += 1
+    return errors
+
+
+# Time the selected and the pure Python versions. Returns a dict of
+# name: (selected_us, python_us), microseconds per call.
+def benchmark(n=1000):
+    from array import array
+
+    buf = bytearray(4)
+    kinds = bytearray(4)
+    args = array("i", [0] * 12)
+    payload = b"\x02\x01\x06\x03\x19\xc2\x03\x03\x03\x12\x18\x05\x09abcd"
+    cases = (
+        ("clamp", clamp, py_clamp, (300, -127, 127)),
+        ("put_s8x2", put_s8x2, py_put_s8x2, (buf, 1, -5, 9)),
+        ("bits8", bits8, py_bits8, (1, 0, 1, 0, 0, 1, 0, 1)),
+        ("store_event", store_event, py_store_event, (kinds, args, 2, 1, 3, 4, 5)),
+        ("decode_field", decode_field, py_decode_field, (payload, 0x09)),
+    )
+    result = {}
+    for name, fast, slow, call_args in cases:
+        times = []
+        for f in (fast, slow):
+            start = ticks_us()
+            for _ in range(n):
+                f(*call_args)
+            times.append(ticks_diff(ticks_us(), start) / n)
+        result[name] = tuple(times)
+    return result
@@ -0,0 +1,217 @@
+from micropython import const
+from bluetooth import UUID
+from lib.hid_services import HumanInterfaceDevice, ReportBuffer
+from lib.hidservices.constants import Constants
+from array import array
+import struct
+
+# Class that represents a high resolution gamepad: 4 to 6 16-bit axes, two
+# 16-bit triggers, a hat switch and 32 buttons.
+class Gamepad(HumanInterfaceDevice):
+    # Hat switch directions, clockwise starting at up.
+    HAT_UP = const(0)
+    HAT_UP_RIGHT = const(1)
+    HAT_RIGHT = const(2)
+    HAT_DOWN_RIGHT = const(3)
+    HAT_DOWN = const(4)
+    HAT_DOWN_LEFT = const(5)
+    HAT_LEFT = const(6)
+    HAT_UP_LEFT = const(7)
+    HAT_CENTER = const(8)                                                                                               # Null state, reported when no direction is pressed.
+
+    AXIS_MAX = const(32767)
+
+    # Generic desktop usages of the axes in report order: X, Y, Z, Rz, Rx, Ry.
+    AXIS_USAGES = b"\x30\x31\x32\x35\x33\x34"
+
+    HIDS = (                                                                                                       # HID service description: describes the service and how we communicate.
+        UUID(0x1812),                                                                                                   # 0x1812 = Human Interface Device.
+        (
+            (UUID(0x2A4A), Constants.F_READ),                                                                           # 0x2A4A = HID information characteristic, to be read by client.
+            (UUID(0x2A4B), Constants.F_READ),                                                                           # 0x2A4B = HID USB report map, to be read by client.
+            (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                          # 0x2A4C = HID control point, to be written by client.
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                   # 0x2A4D = HID report, to be read by client after notification.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                   # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                          # 0x2A4E = HID protocol mode, to be written & read by client.
+        ),
+    )
+
+    def __init__(self, name="Bluetooth Gamepad", axes=4):
+        super(Gamepad, self).__init__(name)                                                                             # Set up the general HID services in super.
+        self.device_appearance = 964                                                                                    # Device appearance ID, 964 = gamepad.
+
+        if axes < 4 or axes > 6:
+            raise ValueError("Gamepad supports 4 to 6 axes")
+        self.axis_count = axes
+
+        axis_usages = []
+        for usage in Gamepad.AXIS_USAGES[:axes]:
+            axis_usages += [0x09, usage]                                                                                # USAGE (X, Y, Z, Rz, Rx, Ry)
+
+        # fmt: off
+        self.HID_INPUT_REPORT = bytes([                                                                                   # USB Report Description: describes what we communicate.
+            0x05, 0x01,                                                                                                 # USAGE_PAGE (Generic Desktop)
+            0x09, 0x05,                                                                                                 # USAGE (Game Pad)
+            0xa1, 0x01,                                                                                                 # COLLECTION (Application)
+            0x85, 0x01,                                                                                                 #   REPORT_ID (1)
+            0x05, 0x09,                                                                                                 #   USAGE_PAGE (Button)
+            0x19, 0x01,                                                                                                 #   USAGE_MINIMUM (Button 1)
+            0x29, 0x20,                                                                                                 #   USAGE_MAXIMUM (Button 32)
+            0x15, 0x00,                                                                                                 #   LOGICAL_MINIMUM (0)
+            0x25, 0x01,                                                                                                 #   LOGICAL_MAXIMUM (1)
+            0x75, 0x01,                                                                                                 #   REPORT_SIZE (1)
+            0x95, 0x20,                                                                                                 #   REPORT_COUNT (32)
+            0x81, 0x02,                                                                                                 #   INPUT (Data,Var,Abs); 32 button bits
+            0x05, 0x01,                                                                                                 #   USAGE_PAGE (Generic Desktop)
+            0x09, 0x39,                                                                                                 #   USAGE (Hat switch)
+            0x15, 0x00,                                                                                                 #   LOGICAL_MINIMUM (0)
+            0x25, 0x07,                                                                                                 #   LOGICAL_MAXIMUM (7)
+            0x35, 0x00,                                                                                                 #   PHYSICAL_MINIMUM (0)
+            0x46, 0x3b, 0x01,                                                                                           #   PHYSICAL_MAXIMUM (315)
+            0x65, 0x14,                                                                                                 #   UNIT (Eng Rot:Angular Pos)
+            0x75, 0x04,                                                                                                 #   REPORT_SIZE (4)
+            0x95, 0x01,                                                                                                 #   REPORT_COUNT (1)
+            0x81, 0x42,                                                                                                 #   INPUT (Data,Var,Abs,Null); hat switch nibble
+            0x65, 0x00,                                                                                                 #   UNIT (None)
+            0x45, 0x00,                                                                                                 #   PHYSICAL_MAXIMUM (0); the axes use their logical range
+            0x81, 0x03,                                                                                                 #   INPUT (Constant); 4 bit padding
+            0xa1, 0x00,                                                                                                 #   COLLECTION (Physical)
+        ] + axis_usages + [
+            0x16, 0x01, 0x80,                                                                                           #     LOGICAL_MINIMUM (-32767)
+            0x26, 0xff, 0x7f,                                                                                           #     LOGICAL_MAXIMUM (32767)
+            0x75, 0x10,                                                                                                 #     REPORT_SIZE (16)
+            0x95, axes,                                                                                                 #     REPORT_COUNT (axes)
+            0x81, 0x02,                                                                                                 #     INPUT (Data,Var,Abs); axes
+            0xc0,                                                                                                       #   END_COLLECTION
+            0x05, 0x02,                                                                                                 #   USAGE_PAGE (Simulation Controls)
+            0x09, 0xc5,                                                                                                 #   USAGE (Brake); left trigger
+            0x09, 0xc4,                                                                                                 #   USAGE (Accelerator); right trigger
+            0x15, 0x00,                                                                                                 #   LOGICAL_MINIMUM (0)
+            0x26, 0xff, 0x7f,                                                                                           #   LOGICAL_MAXIMUM (32767)
+            0x75, 0x10,                                                                                                 #   REPORT_SIZE (16)
+            0x95, 0x02,                                                                                                 #   REPORT_COUNT (2)
+            0x81, 0x02,                                                                                                 #   INPUT (Data,Var,Abs); triggers
+            0xc0                                                                                                        # END_COLLECTION
+        ])
+        # fmt: on
+
+        # Define the initial gamepad state.
+        self.buttons = 0                                                                                                # Bitmask of the 32 buttons, bit 0 = button 1.
+        self.hat = Gamepad.HAT_CENTER                                                                                   # Hat switch direction.
+        self.axes = array("h", [0] * (axes + 2))                                                                        # Axes followed by the left and right trigger.
+
+        self._format = "<IB" + str(axes + 2) + "h"                                                                      # Report layout: buttons, hat, axes, triggers.
+        self._state = ReportBuffer(struct.calcsize(self._format))                                                       # Report buffers: buttons, hat, axes, triggers.
+
+        self.services.append(self.HIDS)                                                                                 # Append to list of service descriptions.
+
+    # Overwrite super to register HID specific service.
+    def start(self):
+        super(Gamepad, self).start()                                                                                    # Start super to register DIS and BAS services.
+
+        if self.log_level >= Constants.LOG_INFO:
+            print("Registering services")
+        self.register_services()                                                                                        # Register services, or reuse the registered ones, and write the characteristic values.
+        self.release_construction_data()                                                                                # Release what is only needed for registering in lean mode.
+        if self.adv is None:                                                                                            # Restarts reuse the advertiser and its payload.
+            from lib.hidservices.advertiser import Advertiser                                                           # Imported on first start.
+            self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance, self.device_name, self.log_level)                  # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
+        if self.log_level >= Constants.LOG_INFO:
+            print("Server started")
+
+    # Overwrite super to save HID specific characteristics.
+    def save_service_characteristics(self, handles):
+        super(Gamepad, self).save_service_characteristics(handles)                                                      # Call super to save DIS and BAS characteristics.
+
+        (h_info, h_hid, h_ctrl, self.h_rep, h_d1, h_proto) = handles[3][:6]                                             # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS, set_tunables() may add one more. Position 3 because of the order of self.services.
+
+        self.pack_report()                                                                                              # Pack the initial gamepad state as described by the input report.
+        self._state.commit()
+
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving HID service characteristics")
+        self.characteristics[h_info] = ("HID information", b"\x01\x01\x00\x00")                                         # HID info: ver=1.1, country=0, flags=000000cw with c=normally connectable w=wake up signal
+        self.characteristics[h_hid] = ("HID input report map", self.HID_INPUT_REPORT)                                   # HID input report map.
+        self.characteristics[h_ctrl] = ("HID control point", b"\x00")                                                   # HID control point.
+        self.characteristics[self.h_rep] = ("HID report", self._state.front)                                            # HID report.
+        self.characteristics[h_d1] = ("HID reference", struct.pack("<BB", 1, 1))                                        # HID reference: id=1, type=input.
+        self.characteristics[h_proto] = ("HID protocol mode", b"\x01")                                                  # HID protocol mode: report.
+
+    # Pack the gamepad state into the back buffer with a single pack_into.
+    def pack_report(self):
+        struct.pack_into(self._format, self._state.back, 0, self.buttons, self.hat, *self.axes)
+        return self._state.back
+
+    # Overwrite super to notify central of a hid report.
+    # Commits the state set so far and notifies it.
+    def notify_hid_report(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self.pack_report()
+        self._state.commit()
+        self.notify_committed()
+
+    # Publish the state set so far as the next report.
+    def commit(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self.pack_report()
+        self._state.commit()
+
+    # Notify central of the last committed report. Safe to call from a timer
+    # or scheduled callback while other code is setting the next state.
+    def notify_committed(self):
+        if self.is_connected():
+            state = self._state.front                                                                                   # A bytes snapshot, kept as the value while the next state is set.
+            self.characteristics[self.h_rep] = ("" if self.lean else "HID report", state)
+            self.notify_report(self.h_rep, state)                                                                       # Notify client by writing to the report handle.
+
+    # Send a stream of axis values as fast as the link allows. samples holds
+    # the first stride axes per sample, as tuples or flat in an array("h").
+    # A generator, see HumanInterfaceDevice._send_stream().
+    def send_stream(self, samples, stride=2):
+        if stride < 1 or stride > self.axis_count + 2:
+            raise ValueError("Stride out of range")
+        return self._send_stream(self.h_rep, bytearray(self.pack_report()), "<" + str(stride) + "h", 5, samples, stride)
+
+    # Press button n (1 to 32).
+    def press(self, n):
+        if n < 1 or n > 32:
+            raise IndexError("Button out of range")
+        self.buttons |= 1 << (n - 1)
+
+    # Release button n (1 to 32).
+    def release(self, n):
+        if n < 1 or n > 32:
+            raise IndexError("Button out of range")
+        self.buttons &= ~(1 << (n - 1))
+
+    # Set all buttons at once from a bitmask, bit 0 = button 1.
+    def set_mask(self, mask):
+        self.buttons = mask & 0xFFFFFFFF
+
+    # Set the value of axis i (0 = X, 1 = Y, 2 = Z, 3 = Rz, 4 = Rx, 5 = Ry).
+    def set_axis(self, i, value):
+        if i < 0 or i >= self.axis_count:
+            raise IndexError("Axis out of range")
+        if value > Gamepad.AXIS_MAX:
+            value = Gamepad.AXIS_MAX
+        elif value < -Gamepad.AXIS_MAX:
+            value = -Gamepad.AXIS_MAX
+        self.axes[i] = value
+
+    # Set the gamepad axes values, in the order X, Y, Z, Rz, Rx, Ry.
+    def set_axes(self, *values):
+        for i in range(len(values)):
+            self.set_axis(i, values[i])
+
+    # Set the left and right trigger values (0 to 32767).
+    def set_triggers(self, left=0, right=0):
+        n = self.axis_count
+        self.axes[n] = 0 if left < 0 else (Gamepad.AXIS_MAX if left > Gamepad.AXIS_MAX else left)
+        self.axes[n + 1] = 0 if right < 0 else (Gamepad.AXIS_MAX if right > Gamepad.AXIS_MAX else right)
+
+    # Set the hat switch direction, HAT_CENTER when released.
+    def set_hat(self, direction=HAT_CENTER):
+        self.hat = direction if 0 <= direction < Gamepad.HAT_CENTER else Gamepad.HAT_CENTER
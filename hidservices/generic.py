@@ -1,7 +1,8 @@
 from bluetooth import UUID
-from lib.hid_services import HumanInterfaceDevice
-from lib.hidservices.advertiser import Advertiser
+from lib.hid_services import HumanInterfaceDevice, ReportBuffer
 from lib.hidservices.constants import Constants
+from lib.hidservices.fastpath import clamp, put_s8x2, bits8
+from lib.hidservices.dispatch import EVENT_LEDS, decode_leds
 import struct
 
 # Class that represents the Mouse service.
@@ -9,6 +10,87 @@ class GenericDevice(HumanInterfaceDevice):
     REPORT_KEYBOARD=0x01
     REPORT_MOUSE=0x02
     
+    HIDS = (                                                                                                       # Service description: describes the service and how we communicate.
+        UUID(0x1812),                                                                                                   # Human Interface Device. -> Keyboard
+        (
+            (UUID(0x2A4A), Constants.F_READ),                                                                                     # 0x2A4A = HID information, to be read by client.
+            (UUID(0x2A4B), Constants.F_READ),                                                                                     # 0x2A4B = HID report map, to be read by client.
+            (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                                    # 0x2A4C = HID control point, to be written by client.
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                             # 0x2A4D = HID report, to be read by client after notification.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                             # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4D), Constants.F_READ_WRITE, (                                                                              # 0x2A4D = HID report
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                             # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                                    # 0x2A4E = HID protocol mode, to be written & read by client.
+
+            (UUID(0x2A4A), Constants.F_READ),                                                                                     # 0x2A4A = HID information, to be read by client.
+            (UUID(0x2A4B), Constants.F_READ),                                                                                     # 0x2A4B = HID report map, to be read by client.
+            (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                                    # 0x2A4C = HID control point, to be written by client.
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                             # 0x2A4D = HID report, to be read by client after notification.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                             # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                                    # 0x2A4E = HID protocol mode, to be written & read by client.
+        ),
+    )
+
+    # fmt: off
+    HID_INPUT_REPORT = bytes([
+        0x05, 0x01,			# USAGE_PAGE (Generic Desktop)
+        0x09, 0x06,			# USAGE (Keyboard)
+        0xa1, 0x01,			# COLLECTION (Application)
+        0x85, 0x01,			# 		REPORT_ID (1)
+        0x05, 0x07,			# 		USAGE_PAGE (Keyboard)
+        0x19, 0xe0,			# 		USAGE_MINIMUM (Keyboard LeftControl)
+        0x29, 0xe7,			# 		USAGE_MAXIMUM (Keyboard Right GUI)
+        0x15, 0x00,			# 		LOGICAL_MINIMUM (0)
+        0x25, 0x01,			# 		LOGICAL_MAXIMUM (1)
+        0x95, 0x08,			# 		REPORT_COUNT (8)
+        0x75, 0x01,			# 		REPORT_SIZE (1)
+        0x81, 0x02,			# 		INPUT (Data,Var,Abs)
+        0x95, 0x01,			# 		REPORT_COUNT (1)
+        0x75, 0x08,			# 		REPORT_SIZE (8)
+        0x81, 0x01,			# 		INPUT (Cnst,Ary,Abs)
+        0x95, 0x05,			# 		REPORT_COUNT (6)
+        0x75, 0x08,			# 		REPORT_SIZE (8)
+        0x15, 0x00,			# 		LOGICAL_MINIMUM (0)
+        0x25, 0x65,			# 		LOGICAL_MAXIMUM (101)
+        0x05, 0x07,			# 		USAGE_PAGE (Keyboard)
+        0x19, 0x00,			# 		USAGE_MINIMUM (Reserved (no event indicated))
+        0x29, 0x65,			# 		USAGE_MAXIMUM (Keyboard Application)
+        0x81, 0x00,			# 		INPUT (Data,Ary,Abs)
+        0xc0,				# END_COLLECTION
+        0x05, 0x01,			# USAGE_PAGE (Generic Desktop)
+        0x09, 0x02,			# USAGE (Mouse)
+        0xa1, 0x01,			# COLLECTION (Application)
+        0x85, 0x02,			# 		REPORT_ID (2)
+        0x09, 0x01,			# 		USAGE (Pointer)
+        0xA1, 0x00,			# 		COLLECTION (Physical)
+        0x05, 0x09,			# 			USAGE_PAGE (Button)
+        0x19, 0x01,			# 			USAGE_MINIMUM
+        0x29, 0x03,			# 			USAGE_MAXIMUM
+        0x15, 0x00,			# 			LOGICAL_MINIMUM (0)
+        0x25, 0x01,			# 			LOGICAL_MAXIMUM (1)
+        0x95, 0x03,			# 			REPORT_COUNT (3)
+        0x75, 0x01,			# 			REPORT_SIZE (1)
+        0x81, 0x02,			# 			INPUT (Data,Var,Abs)
+        0x95, 0x01,			# 			REPORT_COUNT (1)
+        0x75, 0x05,			# 			REPORT_SIZE (5)
+        0x81, 0x03,			# 			INPUT (Const,Var,Abs)
+        0x05, 0x01,			# 			USAGE_PAGE (Generic Desktop)
+        0x09, 0x30,			# 			USAGE (X)
+        0x09, 0x31,			# 			USAGE (Y)
+        0x09, 0x38,			# 			USAGE (Wheel)
+        0x15, 0x81,			# 			LOGICAL_MINIMUM (-127)
+        0x25, 0x7F,			# 			LOGICAL_MAXIMUM (127)
+        0x75, 0x08,			# 			REPORT_SIZE (8)
+        0x95, 0x03,			# 			REPORT_COUNT (3)
+        0x81, 0x06,			# 			INPUT (Data,Var,Rel)
+        0xC0,				# 		END_COLLECTION
+        0xC0,				# END COLLECTION              
+    ])         
+    # fmt: on
+
     def __init__(self, name="Bluetooth GenericDevice"):
         super(GenericDevice, self).__init__(name)                                                                       # Set up the general HID services in super.
         self.device_appearance_mouse = 962                                                                                    # Device appearance ID, 962 = mouse.
@@ -16,87 +98,6 @@ class GenericDevice(HumanInterfaceDevice):
         self.device_name_mouse = "RGE AsyncMouse"                                                                                    # Device appearance ID, 962 = mouse.
         self.device_name_keyboard = "RGE AsyncKeyboard"                                                                                    # Device appearance ID, 961 = keyboard
 
-        self.HIDS = (                                                                                                   # Service description: describes the service and how we communicate.
-            UUID(0x1812),                                                                                               # Human Interface Device. -> Keyboard
-            (
-                (UUID(0x2A4A), Constants.F_READ),                                                                                 # 0x2A4A = HID information, to be read by client.
-                (UUID(0x2A4B), Constants.F_READ),                                                                                 # 0x2A4B = HID report map, to be read by client.
-                (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                                # 0x2A4C = HID control point, to be written by client.
-                (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                         # 0x2A4D = HID report, to be read by client after notification.
-                    (UUID(0x2908), Constants.DSC_F_READ),                                                                         # 0x2908 = HID reference, to be read by client.
-                )),
-                (UUID(0x2A4D), Constants.F_READ_WRITE, (                                                                          # 0x2A4D = HID report
-                    (UUID(0x2908), Constants.DSC_F_READ),                                                                         # 0x2908 = HID reference, to be read by client.
-                )),
-                (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                                # 0x2A4E = HID protocol mode, to be written & read by client.
-
-                (UUID(0x2A4A), Constants.F_READ),                                                                                 # 0x2A4A = HID information, to be read by client.
-                (UUID(0x2A4B), Constants.F_READ),                                                                                 # 0x2A4B = HID report map, to be read by client.
-                (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                                # 0x2A4C = HID control point, to be written by client.
-                (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                         # 0x2A4D = HID report, to be read by client after notification.
-                    (UUID(0x2908), Constants.DSC_F_READ),                                                                         # 0x2908 = HID reference, to be read by client.
-                )),
-                (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                                # 0x2A4E = HID protocol mode, to be written & read by client.
-            ),
-        )
-
-        # fmt: off
-        self.HID_INPUT_REPORT = [
-            0x05, 0x01,			# USAGE_PAGE (Generic Desktop)
-            0x09, 0x06,			# USAGE (Keyboard)
-            0xa1, 0x01,			# COLLECTION (Application)
-            0x85, 0x01,			# 		REPORT_ID (1)
-            0x05, 0x07,			# 		USAGE_PAGE (Keyboard)
-            0x19, 0xe0,			# 		USAGE_MINIMUM (Keyboard LeftControl)
-            0x29, 0xe7,			# 		USAGE_MAXIMUM (Keyboard Right GUI)
-            0x15, 0x00,			# 		LOGICAL_MINIMUM (0)
-            0x25, 0x01,			# 		LOGICAL_MAXIMUM (1)
-            0x95, 0x08,			# 		REPORT_COUNT (8)
-            0x75, 0x01,			# 		REPORT_SIZE (1)
-            0x81, 0x02,			# 		INPUT (Data,Var,Abs)
-            0x95, 0x01,			# 		REPORT_COUNT (1)
-            0x75, 0x08,			# 		REPORT_SIZE (8)
-            0x81, 0x01,			# 		INPUT (Cnst,Ary,Abs)
-            0x95, 0x05,			# 		REPORT_COUNT (6)
-            0x75, 0x08,			# 		REPORT_SIZE (8)
-            0x15, 0x00,			# 		LOGICAL_MINIMUM (0)
-            0x25, 0x65,			# 		LOGICAL_MAXIMUM (101)
-            0x05, 0x07,			# 		USAGE_PAGE (Keyboard)
-            0x19, 0x00,			# 		USAGE_MINIMUM (Reserved (no event indicated))
-            0x29, 0x65,			# 		USAGE_MAXIMUM (Keyboard Application)
-            0x81, 0x00,			# 		INPUT (Data,Ary,Abs)
-            0xc0,				# END_COLLECTION
-            0x05, 0x01,			# USAGE_PAGE (Generic Desktop)
-            0x09, 0x02,			# USAGE (Mouse)
-            0xa1, 0x01,			# COLLECTION (Application)
-            0x85, 0x02,			# 		REPORT_ID (2)
-            0x09, 0x01,			# 		USAGE (Pointer)
-            0xA1, 0x00,			# 		COLLECTION (Physical)
-            0x05, 0x09,			# 			USAGE_PAGE (Button)
-            0x19, 0x01,			# 			USAGE_MINIMUM
-            0x29, 0x03,			# 			USAGE_MAXIMUM
-            0x15, 0x00,			# 			LOGICAL_MINIMUM (0)
-            0x25, 0x01,			# 			LOGICAL_MAXIMUM (1)
-            0x95, 0x03,			# 			REPORT_COUNT (3)
-            0x75, 0x01,			# 			REPORT_SIZE (1)
-            0x81, 0x02,			# 			INPUT (Data,Var,Abs)
-            0x95, 0x01,			# 			REPORT_COUNT (1)
-            0x75, 0x05,			# 			REPORT_SIZE (5)
-            0x81, 0x03,			# 			INPUT (Const,Var,Abs)
-            0x05, 0x01,			# 			USAGE_PAGE (Generic Desktop)
-            0x09, 0x30,			# 			USAGE (X)
-            0x09, 0x31,			# 			USAGE (Y)
-            0x09, 0x38,			# 			USAGE (Wheel)
-            0x15, 0x81,			# 			LOGICAL_MINIMUM (-127)
-            0x25, 0x7F,			# 			LOGICAL_MAXIMUM (127)
-            0x75, 0x08,			# 			REPORT_SIZE (8)
-            0x95, 0x03,			# 			REPORT_COUNT (3)
-            0x81, 0x06,			# 			INPUT (Data,Var,Rel)
-            0xC0,				# 		END_COLLECTION
-            0xC0,				# END COLLECTION              
-        ]         
-        # fmt: on
-
         # Define the initial mouse state.
         self.x = 0
         self.y = 0
@@ -110,6 +111,12 @@ class GenericDevice(HumanInterfaceDevice):
         self.modifiers = 0                                                                                              # 8 bits signifying Right GUI(Win/Command), Right ALT/Option, Right Shift, Right Control, Left GUI, Left ALT, Left Shift, Left Control.
         self.keypresses = [0x00] * 6                                                                                    # 6 keys to hold.
 
+        self._mouse_state = ReportBuffer(4)                                                                             # Double-buffered mouse report: buttons, x, y, wheel.
+        self.acceleration = None                                                                                        # Pointer acceleration of set_axes(), None for raw deltas.
+        self._kb_state = ReportBuffer(8)                                                                                # Double-buffered keyboard report: modifiers, reserved, 6 keys.
+
+        self.kb_callback = None                                                                                         # Callback function for keyboard messages from client.
+
         self.k_h_rep = 0
         self.k_h_repout = 0
         self.m_h_rep = 0
@@ -122,14 +129,20 @@ class GenericDevice(HumanInterfaceDevice):
     # Interrupt request callback function
     # Overwrite super to catch keyboard report write events by the central.
     def ble_irq(self, event, data):
-        print(f"Event: {event} | Data: {data}")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print(f"Event: {event} | Data: {data}")
         
         if event == Constants.IRQ_GATTS_WRITE:                                                                                   # If a client has written to a characteristic or descriptor.
             conn_handle, attr_handle = data                                                                             # Get the handle to the characteristic that was written.
             if attr_handle == self.k_h_repout:
-                print("Generic changed by Central")
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print("Generic changed by Central")
                 report = self._ble.gatts_read(attr_handle)                                                              # Read the report.
-                print(report)
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print(report)
+                if self.dispatcher is not None:
+                    self.dispatcher.post(EVENT_LEDS, report[0])                                                         # Run the callback later, outside the IRQ.
+                    return Constants.GATTS_NO_ERROR
                 bytes = struct.unpack("B", report)                                                                      # Unpack the report.
                 if self.kb_callback is not None:                                                                        # Call the callback function.
                     self.kb_callback(bytes)
@@ -141,29 +154,34 @@ class GenericDevice(HumanInterfaceDevice):
     def start(self):
         super(GenericDevice, self).start()                                                                                      # Call super to register DIS and BAS services.
 
-        print("Registering services")
-        handles = self._ble.gatts_register_services(self.services)                                                      # Register services and get read/write handles for all services.
-        self.save_service_characteristics(handles)                                                                      # Save the values for the characteristics.
-        self.write_service_characteristics()
+        if self.log_level >= Constants.LOG_INFO:
+            print("Registering services")
+        self.register_services()                                                                                        # Register services, or reuse the registered ones, and write the characteristic values.
+        self.release_construction_data()                                                                                # Release what is only needed for registering in lean mode.
 
 #        self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance_mouse, self.device_name_mouse)                      # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
-        self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance_keyboard, self.device_name_keyboard)                      # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
+        if self.adv is None:                                                                                            # Restarts reuse the advertiser and its payload.
+            from lib.hidservices.advertiser import Advertiser                                                           # Imported on first start.
+            self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance_keyboard, self.device_name_keyboard, self.log_level)                  # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
 
-        print("Generic server started")
+        if self.log_level >= Constants.LOG_INFO:
+            print("Generic server started")
 
     # Overwrite super to save HID specific characteristics.
     def save_service_characteristics(self, handles):
         super(GenericDevice, self).save_service_characteristics(handles)                                                        # Call super to write DIS and BAS characteristics.
-        print(handles)
+        if self.log_level >= Constants.LOG_DEBUG:
+            print(handles)
         
         (keyb_h_info, keyb_h_hid, keyb_h_ctrl, self.k_h_rep, keyb_h_d1, self.k_h_repout, keyb_h_d2, keyb_h_proto,
-        mouse_h_info, mouse_h_hid, mouse_h_ctrl, self.m_h_rep, mouse_h_d1, mouse_h_proto) = handles[3]                                                 # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS. Position 3 because of the order of self.services.
+        mouse_h_info, mouse_h_hid, mouse_h_ctrl, self.m_h_rep, mouse_h_d1, mouse_h_proto) = handles[3][:14]                                            # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS, set_tunables() may add one more. Position 3 because of the order of self.services.
 
-        keyb_state = struct.pack("8B", self.modifiers, 0, self.keypresses[0], self.keypresses[1], self.keypresses[2], self.keypresses[3], self.keypresses[4], self.keypresses[5])
+        keyb_state = bytes(self._kb_state.front)                                                                        # The committed keyboard state as described by the input report.
 
-        print("Saving keyboard HID service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving keyboard HID service characteristics")
         self.characteristics[keyb_h_info] = ("HID information", b"\x01\x01\x00\x00")                                         # HID info: ver=1.1, country=0, flags=000000cw with c=normally connectable w=wake up signal
-        self.characteristics[keyb_h_hid] = ("HID input report map", bytes(self.HID_INPUT_REPORT))                            # HID input report map.
+        self.characteristics[keyb_h_hid] = ("HID input report map", self.HID_INPUT_REPORT)                                   # HID input report map.
         self.characteristics[keyb_h_ctrl] = ("HID control point", b"\x00")                                                   # HID control point.
         self.characteristics[self.k_h_rep] = ("HID input report", keyb_state)                                                  # HID report.
         self.characteristics[keyb_h_d1] = ("HID input reference", struct.pack("<BB", 1, 1))                                  # HID reference: id=1, type=input.
@@ -171,48 +189,97 @@ class GenericDevice(HumanInterfaceDevice):
         self.characteristics[keyb_h_d2] = ("HID output reference", struct.pack("<BB", 1, 2))                                 # HID reference: id=1, type=output.
         self.characteristics[keyb_h_proto] = ("HID protocol mode", b"\x01")                                                  # HID protocol mode: report.
 
-        b = self.button1 + self.button2 * 2 + self.button3 * 4
-        mouse_state = struct.pack("Bbbb", b, self.x, self.y, self.w)                                                          # Pack the initial mouse state as described by the input report.
+        mouse_state = bytes(self._mouse_state.front)                                                                    # The committed mouse state as described by the input report.
 
-        print("Saving mouse HID service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving mouse HID service characteristics")
         self.characteristics[mouse_h_info] = ("HID information", b"\x01\x01\x00\x00")                                         # HID info: ver=1.1, country=0, flags=000000cw with c=normally connectable w=wake up signal
-        self.characteristics[mouse_h_hid] = ("HID input report map", bytes(self.HID_INPUT_REPORT))                            # HID input report map.
+        self.characteristics[mouse_h_hid] = ("HID input report map", self.HID_INPUT_REPORT)                                   # HID input report map.
         self.characteristics[mouse_h_ctrl] = ("HID control point", b"\x00")                                                   # HID control point.
         self.characteristics[self.m_h_rep] = ("HID report", mouse_state)                                                        # HID report.
         self.characteristics[mouse_h_d1] = ("HID reference", struct.pack("<BB", 1, 1))                                        # HID reference: id=1, type=input.
         self.characteristics[mouse_h_proto] = ("HID protocol mode", b"\x01")                                                  # HID protocol mode: report.
 
-    # Overwrite super to notify central of a hid report
+    # Overwrite super to notify central of a hid report.
+    # Commits the mouse state set so far and notifies it.
     def notify_hid_report_mouse(self):
-        if self.is_connected():
-            b = self.button1 + self.button2 * 2 + self.button3
-            state = struct.pack("Bbbb", b, self.x, self.y, self.w)                                                      # Pack the mouse state as described by the input report.
-            self.characteristics[self.m_h_rep] = ("HID report", state)
-            self._ble.gatts_notify(self.conn_handle, self.m_h_rep, state)                                                 # Notify central by writing to the report handle.
-            print("Notify with report: ", struct.unpack("Bbbb", state))
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self._mouse_state.commit()
+        self.notify_committed_mouse()
 
+    # Commits the keyboard state set so far and notifies it.
     def notify_hid_report(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self._kb_state.commit()
+        self.notify_committed()
+
+    # Publish the keyboard and mouse state set so far as the next reports.
+    def commit(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        self._kb_state.commit()
+        self._mouse_state.commit()
+
+    # Notify central of the last committed mouse report. Safe to call from a
+    # timer or scheduled callback while other code is setting the next state.
+    def notify_committed_mouse(self):
+        if self.is_connected():
+            state = self._mouse_state.front                                                                             # A bytes snapshot, kept as the value while the next state is set.
+            self.characteristics[self.m_h_rep] = ("" if self.lean else "HID report", state)
+            self.notify_report(self.m_h_rep, state)                                                                     # Notify central by writing to the report handle.
+            if self.log_level >= Constants.LOG_VERBOSE:
+                print("Notify with report: ", struct.unpack("Bbbb", state))
+
+    # Notify central of the last committed keyboard report.
+    def notify_committed(self):
         if self.is_connected():
-            # Pack the Keyboard state as described by the input report.
-            state = struct.pack("8B", self.modifiers, 0, self.keypresses[0], self.keypresses[1], self.keypresses[2], self.keypresses[3], self.keypresses[4], self.keypresses[5])
-            self.characteristics[self.k_h_rep] = ("HID input report", state)
-            self._ble.gatts_notify(self.conn_handle, self.k_h_rep, state)                                                 # Notify central by writing to the report handle.
-            print("Notify with report: ", struct.unpack("8B", state))
+            state = self._kb_state.front                                                                                # A bytes snapshot, kept as the value while the next state is set.
+            self.characteristics[self.k_h_rep] = ("" if self.lean else "HID input report", state)
+            self.notify_report(self.k_h_rep, state)                                                                     # Notify central by writing to the report handle.
+            if self.log_level >= Constants.LOG_VERBOSE:
+                print("Notify with report: ", struct.unpack("8B", state))
+
+    # Send a stream of relative mouse moves, see Mouse.send_stream().
+    def send_stream_mouse(self, samples, stride=2):
+        if stride < 2 or stride > 3:
+            raise ValueError("Stride must be 2 or 3")
+        return self._send_stream(self.m_h_rep, bytearray(self._mouse_state.front), "bbb"[:stride], 1, samples, stride)
+
+    # Send a stream of key states, see Keyboard.send_stream().
+    def send_stream(self, samples, stride=2):
+        if stride < 1 or stride > 2:
+            raise ValueError("Stride must be 1 or 2")
+        return self._send_stream(self.k_h_rep, bytearray(self._kb_state.front), "BxB" if stride == 2 else "B", 0 if stride == 2 else 2, samples, stride)
+
+    # Set an acceleration curve and DPI scale factor for set_axes(), see
+    # hidservices/pointer.py. Pass curve=None to send raw deltas again.
+    def set_acceleration(self, curve=None, scale=1.0):
+        if curve is None:
+            self.acceleration = None
+        elif self.acceleration is None:
+            from lib.hidservices.pointer import PointerAcceleration                                                     # Imported on first use.
+            self.acceleration = PointerAcceleration(curve, scale)
+        else:
+            self.acceleration.set_curve(curve, scale)
 
     # Set the mouse axes values.
+    # With acceleration the deltas are scaled, and what does not fit in this
+    # report is carried over to the next one.
     def set_axes(self, x=0, y=0):
-        if x > 127:
-            x = 127
-        elif x < -127:
-            x = -127
+        accel = self.acceleration
+        if accel is not None:
+            accel.apply(x, y)
+            x = accel.x
+            y = accel.y
 
-        if y > 127:
-            y = 127
-        elif y < -127:
-            y = -127
+        x = clamp(x, -127, 127)
+        y = clamp(y, -127, 127)
 
         self.x = x
         self.y = y
+        put_s8x2(self._mouse_state.back, 1, x, y)
 
     # Set the mouse scroll wheel value.
     def set_wheel(self, w=0):
@@ -222,30 +289,47 @@ class GenericDevice(HumanInterfaceDevice):
             w = -127
 
         self.w = w
+        struct.pack_into("b", self._mouse_state.back, 3, w)
 
     # Set the mouse button values.
     def set_buttons(self, b1=0, b2=0, b3=0):
         self.button1 = b1
         self.button2 = b2
         self.button3 = b3
+        self._mouse_state.back[0] = bits8(b1, b2, b3, 0, 0, 0, 0, 0)
         
     # Set the modifier bits, notify to send the modifiers to central.
     def set_modifiers(self, right_gui=0, right_alt=0, right_shift=0, right_control=0, left_gui=0, left_alt=0, left_shift=0, left_control=0):
-        self.modifiers = (right_gui << 7) + (right_alt << 6) + (right_shift << 5) + (right_control << 4) + (left_gui << 3) + (left_alt << 2) + (left_shift << 1) + left_control
+        self.modifiers = bits8(left_control, left_shift, left_alt, left_gui, right_control, right_shift, right_alt, right_gui)
+        self._kb_state.back[0] = self.modifiers
 
     # Press keys, notify to send the keys to central.
     # This will hold down the keys, call set_keys() without arguments and notify again to release.
     def set_keys(self, k0=0x00, k1=0x00, k2=0x00, k3=0x00, k4=0x00, k5=0x00):
         self.keypresses = [k0, k1, k2, k3, k4, k5]
+        struct.pack_into("6B", self._kb_state.back, 2, k0, k1, k2, k3, k4, k5)
 
     # Set a callback function that gets notified on keyboard changes.
-    # Should take a tuple with the report bytes.
+    # Should take a tuple with the report bytes. When a dispatcher is set, it
+    # is called outside the IRQ with the decoded LED state instead, i.e.,
+    # (num_lock, caps_lock, scroll_lock, compose, kana).
     def set_kb_callback(self, kb_callback):
         self.kb_callback = kb_callback
+
+    # Overwrite super to also defer keyboard LED changes.
+    def set_dispatcher(self, dispatcher):
+        super(GenericDevice, self).set_dispatcher(dispatcher)
+        dispatcher.set_handler(EVENT_LEDS, self._dispatch_leds)
+
+    # Run the keyboard callback for a deferred LED event.
+    def _dispatch_leds(self, leds, _b, _c):
+        if self.kb_callback is not None:
+            self.kb_callback(decode_leds(leds))
             
     # Begin advertising the device services.
     def start_advertising_(self):
-        print("--------------> start_advertising <---------------")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("--------------> start_advertising <---------------")
         if self.device_state is not HumanInterfaceDevice.DEVICE_STOPPED and self.device_state is not HumanInterfaceDevice.DEVICE_ADVERTISING:
             self.adv_m.start_advertising()            
             self.adv_k.start_advertising()
@@ -253,7 +337,8 @@ class GenericDevice(HumanInterfaceDevice):
 
     # Stop advertising the device services.
     def stop_advertising_(self):
-        print("--------------> stop_advertising <---------------")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("--------------> stop_advertising <---------------")
         if self.device_state is not HumanInterfaceDevice.DEVICE_STOPPED:
             self.adv_m.stop_advertising()
             self.adv_k.stop_advertising()
@@ -1,72 +1,83 @@
+from micropython import const
 from bluetooth import UUID
-from lib.hid_services import HumanInterfaceDevice
-from lib.hidservices.advertiser import Advertiser
+from lib.hid_services import HumanInterfaceDevice, ReportBuffer
 from lib.hidservices.constants import Constants
+from lib.hidservices.fastpath import bits8
+from lib.hidservices.dispatch import EVENT_LEDS, decode_leds
 import struct
 
+_ERROR_ROLLOVER = const(0x01)                                                                                           # Key array usage of the phantom state when too many keys are held.
+
 # Class that represents the Keyboard service.
 class Keyboard(HumanInterfaceDevice):
+    HIDS = (                                                                                                       # Service description: describes the service and how we communicate.
+        UUID(0x1812),                                                                                                   # Human Interface Device.
+        (
+            (UUID(0x2A4A), Constants.F_READ),                                                                                     # 0x2A4A = HID information, to be read by client.
+            (UUID(0x2A4B), Constants.F_READ),                                                                                     # 0x2A4B = HID report map, to be read by client.
+            (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                                    # 0x2A4C = HID control point, to be written by client.
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                             # 0x2A4D = HID report, to be read by client after notification.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                             # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4D), Constants.F_READ_WRITE, (                                                                              # 0x2A4D = HID report
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                             # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                                    # 0x2A4E = HID protocol mode, to be written & read by client.
+        ),
+    )
+
+    # fmt: off
+    HID_INPUT_REPORT = bytes([                                                                                           # Report Description: describes what we communicate.
+        0x05, 0x01,                                                                                                     # USAGE_PAGE (Generic Desktop)
+        0x09, 0x06,                                                                                                     # USAGE (Keyboard)
+        0xa1, 0x01,                                                                                                     # COLLECTION (Application)
+        0x85, 0x01,                                                                                                     #     REPORT_ID (1)
+        0x75, 0x01,                                                                                                     #     Report Size (1)
+        0x95, 0x08,                                                                                                     #     Report Count (8)
+        0x05, 0x07,                                                                                                     #     Usage Page (Key Codes)
+        0x19, 0xE0,                                                                                                     #     Usage Minimum (224)
+        0x29, 0xE7,                                                                                                     #     Usage Maximum (231)
+        0x15, 0x00,                                                                                                     #     Logical Minimum (0)
+        0x25, 0x01,                                                                                                     #     Logical Maximum (1)
+        0x81, 0x02,                                                                                                     #     Input (Data, Variable, Absolute); Modifier byte
+        0x95, 0x01,                                                                                                     #     Report Count (1)
+        0x75, 0x08,                                                                                                     #     Report Size (8)
+        0x81, 0x01,                                                                                                     #     Input (Constant); Reserved byte
+        0x95, 0x05,                                                                                                     #     Report Count (5)
+        0x75, 0x01,                                                                                                     #     Report Size (1)
+        0x05, 0x08,                                                                                                     #     Usage Page (LEDs)
+        0x19, 0x01,                                                                                                     #     Usage Minimum (1)
+        0x29, 0x05,                                                                                                     #     Usage Maximum (5)
+        0x91, 0x02,                                                                                                     #     Output (Data, Variable, Absolute); LED report
+        0x95, 0x01,                                                                                                     #     Report Count (1)
+        0x75, 0x03,                                                                                                     #     Report Size (3)
+        0x91, 0x01,                                                                                                     #     Output (Constant); LED report padding
+        0x95, 0x06,                                                                                                     #     Report Count (6)
+        0x75, 0x08,                                                                                                     #     Report Size (8)
+        0x15, 0x00,                                                                                                     #     Logical Minimum (0)
+        0x25, 0x65,                                                                                                     #     Logical Maximum (101)
+        0x05, 0x07,                                                                                                     #     Usage Page (Key Codes)
+        0x19, 0x00,                                                                                                     #     Usage Minimum (0)
+        0x29, 0x65,                                                                                                     #     Usage Maximum (101)
+        0x81, 0x00,                                                                                                     #     Input (Data, Array); Key array (6 bytes)
+        0xc0                                                                                                            # END_COLLECTION
+    ])
+    # fmt: on
+
     def __init__(self, name="Bluetooth Keyboard"):
         super(Keyboard, self).__init__(name)                                                                            # Set up the general HID services in super.
         self.device_appearance = 961                                                                                    # Device appearance ID, 961 = keyboard.
 
-        self.HIDS = (                                                                                                   # Service description: describes the service and how we communicate.
-            UUID(0x1812),                                                                                               # Human Interface Device.
-            (
-                (UUID(0x2A4A), Constants.F_READ),                                                                                 # 0x2A4A = HID information, to be read by client.
-                (UUID(0x2A4B), Constants.F_READ),                                                                                 # 0x2A4B = HID report map, to be read by client.
-                (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                                # 0x2A4C = HID control point, to be written by client.
-                (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                         # 0x2A4D = HID report, to be read by client after notification.
-                    (UUID(0x2908), Constants.DSC_F_READ),                                                                         # 0x2908 = HID reference, to be read by client.
-                )),
-                (UUID(0x2A4D), Constants.F_READ_WRITE, (                                                                          # 0x2A4D = HID report
-                    (UUID(0x2908), Constants.DSC_F_READ),                                                                         # 0x2908 = HID reference, to be read by client.
-                )),
-                (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                                # 0x2A4E = HID protocol mode, to be written & read by client.
-            ),
-        )
-
-        # fmt: off
-        self.HID_INPUT_REPORT = [                                                                                       # Report Description: describes what we communicate.
-            0x05, 0x01,                                                                                                 # USAGE_PAGE (Generic Desktop)
-            0x09, 0x06,                                                                                                 # USAGE (Keyboard)
-            0xa1, 0x01,                                                                                                 # COLLECTION (Application)
-            0x85, 0x01,                                                                                                 #     REPORT_ID (1)
-            0x75, 0x01,                                                                                                 #     Report Size (1)
-            0x95, 0x08,                                                                                                 #     Report Count (8)
-            0x05, 0x07,                                                                                                 #     Usage Page (Key Codes)
-            0x19, 0xE0,                                                                                                 #     Usage Minimum (224)
-            0x29, 0xE7,                                                                                                 #     Usage Maximum (231)
-            0x15, 0x00,                                                                                                 #     Logical Minimum (0)
-            0x25, 0x01,                                                                                                 #     Logical Maximum (1)
-            0x81, 0x02,                                                                                                 #     Input (Data, Variable, Absolute); Modifier byte
-            0x95, 0x01,                                                                                                 #     Report Count (1)
-            0x75, 0x08,                                                                                                 #     Report Size (8)
-            0x81, 0x01,                                                                                                 #     Input (Constant); Reserved byte
-            0x95, 0x05,                                                                                                 #     Report Count (5)
-            0x75, 0x01,                                                                                                 #     Report Size (1)
-            0x05, 0x08,                                                                                                 #     Usage Page (LEDs)
-            0x19, 0x01,                                                                                                 #     Usage Minimum (1)
-            0x29, 0x05,                                                                                                 #     Usage Maximum (5)
-            0x91, 0x02,                                                                                                 #     Output (Data, Variable, Absolute); LED report
-            0x95, 0x01,                                                                                                 #     Report Count (1)
-            0x75, 0x03,                                                                                                 #     Report Size (3)
-            0x91, 0x01,                                                                                                 #     Output (Constant); LED report padding
-            0x95, 0x06,                                                                                                 #     Report Count (6)
-            0x75, 0x08,                                                                                                 #     Report Size (8)
-            0x15, 0x00,                                                                                                 #     Logical Minimum (0)
-            0x25, 0x65,                                                                                                 #     Logical Maximum (101)
-            0x05, 0x07,                                                                                                 #     Usage Page (Key Codes)
-            0x19, 0x00,                                                                                                 #     Usage Minimum (0)
-            0x29, 0x65,                                                                                                 #     Usage Maximum (101)
-            0x81, 0x00,                                                                                                 #     Input (Data, Array); Key array (6 bytes)
-            0xc0                                                                                                        # END_COLLECTION
-        ]
-        # fmt: on
-
         # Define the initial keyboard state.
         self.modifiers = 0                                                                                              # 8 bits signifying Right GUI(Win/Command), Right ALT/Option, Right Shift, Right Control, Left GUI, Left ALT, Left Shift, Left Control.
         self.keypresses = [0x00] * 6                                                                                    # 6 keys to hold.
+        self._state = ReportBuffer(8)                                                                                   # Double-buffered report: modifiers, reserved, 6 keys.
+
+        # Key state of press() and release().
+        self._slots = bytearray(6)                                                                                      # The reported keys, each stays in its slot until released.
+        self._held = bytearray(32)                                                                                      # Bitmap of all held keys, more than six on rollover.
+        self._held_count = 0                                                                                            # Number of held keys, not counting modifiers.
+        self._dirty = False                                                                                             # Do the slots need packing into the report?
 
         self.kb_callback = None                                                                                         # Callback function for keyboard messages from client.
 
@@ -78,8 +89,12 @@ class Keyboard(HumanInterfaceDevice):
         if event == Constants.IRQ_GATTS_WRITE:                                                                                   # If a client has written to a characteristic or descriptor.
             conn_handle, attr_handle = data                                                                             # Get the handle to the characteristic that was written.
             if attr_handle == self.h_repout:
-                print("Keyboard changed by Central")
+                if self.log_level >= Constants.LOG_DEBUG:
+                    print("Keyboard changed by Central")
                 report = self._ble.gatts_read(attr_handle)                                                              # Read the report.
+                if self.dispatcher is not None:
+                    self.dispatcher.post(EVENT_LEDS, report[0])                                                         # Run the callback later, outside the IRQ.
+                    return Constants.GATTS_NO_ERROR
                 bytes = struct.unpack("B", report)                                                                      # Unpack the report.
                 if self.kb_callback is not None:                                                                        # Call the callback function.
                     self.kb_callback(bytes)
@@ -91,25 +106,30 @@ class Keyboard(HumanInterfaceDevice):
     def start(self):
         super(Keyboard, self).start()                                                                                   # Call super to register DIS and BAS services.
 
-        print("Registering services")
-        handles = self._ble.gatts_register_services(self.services)                                                      # Register services and get read/write handles for all services.
-        self.save_service_characteristics(handles)                                                                      # Save the values for the characteristics.
-        self.write_service_characteristics()                                                                            # Write the values for the characteristics.
-        self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance, self.device_name)                      # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
-        print("Server started")
+        if self.log_level >= Constants.LOG_INFO:
+            print("Registering services")
+        self.register_services()                                                                                        # Register services, or reuse the registered ones, and write the characteristic values.
+        self.release_construction_data()                                                                                # Release what is only needed for registering in lean mode.
+        if self.adv is None:                                                                                            # Restarts reuse the advertiser and its payload.
+            from lib.hidservices.advertiser import Advertiser                                                           # Imported on first start.
+            self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance, self.device_name, self.log_level)                  # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
+        if self.log_level >= Constants.LOG_INFO:
+            print("Server started")
 
     # Overwrite super to save HID specific characteristics.
     def save_service_characteristics(self, handles):
         super(Keyboard, self).save_service_characteristics(handles)                                                     # Call super to write DIS and BAS characteristics.
-        print(handles)
+        if self.log_level >= Constants.LOG_DEBUG:
+            print(handles)
 
-        (h_info, h_hid, h_ctrl, self.h_rep, h_d1, self.h_repout, h_d2, h_proto) = handles[3]                            # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS. Position 3 because of the order of self.services.
+        (h_info, h_hid, h_ctrl, self.h_rep, h_d1, self.h_repout, h_d2, h_proto) = handles[3][:8]                        # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS, set_tunables() may add one more. Position 3 because of the order of self.services.
 
-        state = struct.pack("8B", self.modifiers, 0, self.keypresses[0], self.keypresses[1], self.keypresses[2], self.keypresses[3], self.keypresses[4], self.keypresses[5])
+        state = bytes(self._state.front)                                                                                # The committed keyboard state as described by the input report.
 
-        print("Saving HID service characteristics")
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving HID service characteristics")
         self.characteristics[h_info] = ("HID information", b"\x01\x01\x00\x00")                                         # HID info: ver=1.1, country=0, flags=000000cw with c=normally connectable w=wake up signal
-        self.characteristics[h_hid] = ("HID input report map", bytes(self.HID_INPUT_REPORT))                            # HID input report map.
+        self.characteristics[h_hid] = ("HID input report map", self.HID_INPUT_REPORT)                                   # HID input report map.
         self.characteristics[h_ctrl] = ("HID control point", b"\x00")                                                   # HID control point.
         self.characteristics[self.h_rep] = ("HID input report", state)                                                  # HID report.
         self.characteristics[h_d1] = ("HID input reference", struct.pack("<BB", 1, 1))                                  # HID reference: id=1, type=input.
@@ -118,24 +138,162 @@ class Keyboard(HumanInterfaceDevice):
         self.characteristics[h_proto] = ("HID protocol mode", b"\x01")                                                  # HID protocol mode: report.
 
     # Overwrite super to notify central of a hid report.
+    # Commits the state set so far and notifies it.
     def notify_hid_report(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        if self._dirty:
+            self._pack_keys()
+        self._state.commit()
+        self.notify_committed()
+
+    # Publish the state set so far as the next report.
+    def commit(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        if self._dirty:
+            self._pack_keys()
+        self._state.commit()
+
+    # Notify central of the last committed report. Safe to call from a timer
+    # or scheduled callback while other code is setting the next state.
+    def notify_committed(self):
         if self.is_connected():
-            # Pack the Keyboard state as described by the input report.
-            state = struct.pack("8B", self.modifiers, 0, self.keypresses[0], self.keypresses[1], self.keypresses[2], self.keypresses[3], self.keypresses[4], self.keypresses[5])
-            self.characteristics[self.h_rep] = ("HID input report", state)
-            self._ble.gatts_notify(self.conn_handle, self.h_rep, state)                                                 # Notify central by writing to the report handle.
-            print("Notify with report: ", struct.unpack("8B", state))
+            state = self._state.front                                                                                   # A bytes snapshot, kept as the value while the next state is set.
+            self.characteristics[self.h_rep] = ("" if self.lean else "HID input report", state)
+            self.notify_report(self.h_rep, state)                                                                       # Notify central by writing to the report handle.
+            if self.log_level >= Constants.LOG_VERBOSE:
+                print("Notify with report: ", struct.unpack("8B", state))
+
+    # Send a stream of key states as fast as the link allows, e.g., to type
+    # precomputed text. samples holds (modifiers, key) pairs, or single keys
+    # with stride=1, as tuples or flat in a bytes. A sample of 0 keys releases.
+    # A generator, see HumanInterfaceDevice._send_stream().
+    def send_stream(self, samples, stride=2):
+        if stride < 1 or stride > 2:
+            raise ValueError("Stride must be 1 or 2")
+        return self._send_stream(self.h_rep, bytearray(self._state.front), "BxB" if stride == 2 else "B", 0 if stride == 2 else 2, samples, stride)
 
     # Set the modifier bits, notify to send the modifiers to central.
     def set_modifiers(self, right_gui=0, right_alt=0, right_shift=0, right_control=0, left_gui=0, left_alt=0, left_shift=0, left_control=0):
-        self.modifiers = (right_gui << 7) + (right_alt << 6) + (right_shift << 5) + (right_control << 4) + (left_gui << 3) + (left_alt << 2) + (left_shift << 1) + left_control
+        self.modifiers = bits8(left_control, left_shift, left_alt, left_gui, right_control, right_shift, right_alt, right_gui)
+        self._state.back[0] = self.modifiers
 
     # Press keys, notify to send the keys to central.
     # This will hold down the keys, call set_keys() without arguments and notify again to release.
+    # Replaces the keys held by press().
     def set_keys(self, k0=0x00, k1=0x00, k2=0x00, k3=0x00, k4=0x00, k5=0x00):
         self.keypresses = [k0, k1, k2, k3, k4, k5]
+        struct.pack_into("6B", self._state.back, 2, k0, k1, k2, k3, k4, k5)
+
+        held = self._held
+        for i in range(32):
+            held[i] = 0
+        self._held_count = 0
+        for i in range(6):
+            usage = self.keypresses[i]
+            self._slots[i] = usage
+            if usage and not held[usage >> 3] & (1 << (usage & 7)):
+                held[usage >> 3] |= 1 << (usage & 7)
+                self._held_count += 1
+        self._dirty = False
+
+    # Press a key, given by its usage, and keep the others held. Notify to send
+    # the keys to central. Modifier usages 0xE0 to 0xE7 set the modifier bits,
+    # usages above are no keys of the report and ignored. A key keeps its slot
+    # in the report until released. With more than six keys held, the report
+    # shows the rollover error in all slots.
+    def press(self, usage):
+        if usage > 0xE7:
+            return
+        if usage >= 0xE0:
+            self.modifiers |= 1 << (usage & 0x07)
+            self._state.back[0] = self.modifiers
+            return
+        held = self._held
+        bit = 1 << (usage & 7)
+        if usage == 0 or held[usage >> 3] & bit:
+            return
+        held[usage >> 3] |= bit
+        self._held_count += 1
+        if self._held_count <= 6:
+            slots = self._slots
+            for i in range(6):
+                if slots[i] == 0:
+                    slots[i] = usage
+                    break
+        self._dirty = True
+
+    # Release a key, given by its usage. The other keys keep their slots.
+    def release(self, usage):
+        if usage > 0xE7:
+            return
+        if usage >= 0xE0:
+            self.modifiers &= ~(1 << (usage & 0x07))
+            self._state.back[0] = self.modifiers
+            return
+        held = self._held
+        bit = 1 << (usage & 7)
+        if usage == 0 or not held[usage >> 3] & bit:
+            return
+        held[usage >> 3] &= ~bit
+        self._held_count -= 1
+        slots = self._slots
+        for i in range(6):
+            if slots[i] == usage:
+                slots[i] = 0
+                if self._held_count >= 6:                                                                               # A key held beyond the six slots takes the free one.
+                    self._refill_slot(i)
+                break
+        self._dirty = True
+
+    # Release all keys and modifiers.
+    def release_all(self):
+        held = self._held
+        for i in range(32):
+            held[i] = 0
+        for i in range(6):
+            self._slots[i] = 0
+        self._held_count = 0
+        self.modifiers = 0
+        self._state.back[0] = 0
+        self._dirty = True
+
+    # Put a held key that has no slot into free slot i.
+    def _refill_slot(self, i):
+        held = self._held
+        slots = self._slots
+        for byte in range(32):
+            if held[byte]:
+                for b in range(8):
+                    usage = (byte << 3) | b
+                    if held[byte] & (1 << b) and usage not in slots:
+                        slots[i] = usage
+                        return
+
+    # Pack the keys held by press() into the report.
+    def _pack_keys(self):
+        back = self._state.back
+        rollover = self._held_count > 6
+        for i in range(6):
+            usage = _ERROR_ROLLOVER if rollover else self._slots[i]
+            back[2 + i] = usage
+            self.keypresses[i] = usage
+        self._dirty = False
 
     # Set a callback function that gets notified on keyboard changes.
-    # Should take a tuple with the report bytes.
+    # Should take a tuple with the report bytes. When a dispatcher is set, it
+    # is called outside the IRQ with the decoded LED state instead, i.e.,
+    # (num_lock, caps_lock, scroll_lock, compose, kana).
     def set_kb_callback(self, kb_callback):
         self.kb_callback = kb_callback
+
+    # Overwrite super to also defer keyboard LED changes.
+    def set_dispatcher(self, dispatcher):
+        super(Keyboard, self).set_dispatcher(dispatcher)
+        dispatcher.set_handler(EVENT_LEDS, self._dispatch_leds)
+
+    # Run the keyboard callback for a deferred LED event.
+    def _dispatch_leds(self, leds, _b, _c):
+        if self.kb_callback is not None:
+            self.kb_callback(decode_leds(leds))
@@ -0,0 +1,115 @@
+from micropython import const
+import struct
+
+# Layout pack format, all little endian. Packs are built from a text source
+# by tools/mklayout.py.
+#   Header: magic "KL", version, flags, first direct codepoint, number of
+#           direct entries, number of extra entries, number of dead entries.
+#   Direct: one (modifiers, usage) byte pair per codepoint from the first
+#           direct codepoint on, usage 0 if the character has no key.
+#   Extra:  (codepoint, modifiers, usage) entries sorted by codepoint, for
+#           characters above the direct range, e.g., the euro sign.
+#   Dead:   (codepoint, dead key modifiers, dead key usage, modifiers, usage)
+#           entries sorted by codepoint, for characters typed as a dead key
+#           followed by a second key.
+LAYOUT_MAGIC = b"KL"
+LAYOUT_VERSION = const(1)
+LAYOUT_HEADER = "<2sBBHHHH"
+LAYOUT_HEADER_SIZE = const(12)
+EXTRA_ENTRY_SIZE = const(4)
+DEAD_ENTRY_SIZE = const(6)
+
+# Modifier bits as used in the keyboard report.
+MOD_SHIFT = const(0x02)                                                                                                 # Left shift.
+MOD_ALTGR = const(0x40)                                                                                                 # Right alt, AltGr on international layouts.
+
+# Class that maps characters to key strokes for a host keyboard layout.
+# The pack is kept as a single bytes object and read in place, so a layout
+# costs its file size in RAM and a lookup does not allocate.
+class KeyboardLayout:
+    def __init__(self, data):
+        magic, version, _flags, start, count, extras, deads = struct.unpack_from(LAYOUT_HEADER, data, 0)
+        if magic != LAYOUT_MAGIC or version != LAYOUT_VERSION:
+            raise ValueError("Not a keyboard layout pack")
+        self._data = data
+        self._start = start                                                                                             # First codepoint of the direct table.
+        self._count = count                                                                                             # Number of direct entries.
+        self._extra = LAYOUT_HEADER_SIZE + 2 * count                                                                    # Offset of the extra table.
+        self._extras = extras
+        self._dead = self._extra + EXTRA_ENTRY_SIZE * extras                                                            # Offset of the dead key table.
+        self._deads = deads
+
+    # Binary search a table of entries starting with a 16-bit codepoint.
+    # Returns the offset of the entry, or -1 if not found.
+    def _search(self, offset, n, size, codepoint):
+        data = self._data
+        lo = 0
+        hi = n
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            p = offset + mid * size
+            value = data[p] | (data[p + 1] << 8)
+            if value < codepoint:
+                lo = mid + 1
+            elif value > codepoint:
+                hi = mid
+            else:
+                return p
+        return -1
+
+    # Write the key strokes for character c into buf as (modifiers, usage)
+    # pairs and return the number of strokes: 1 for a plain key, 2 for a dead
+    # key sequence, or 0 if the layout cannot type c. buf must hold 4 bytes.
+    def strokes(self, c, buf):
+        data = self._data
+        codepoint = ord(c)
+        i = codepoint - self._start
+        if 0 <= i < self._count:
+            p = LAYOUT_HEADER_SIZE + 2 * i
+            if data[p + 1]:
+                buf[0] = data[p]
+                buf[1] = data[p + 1]
+                return 1
+
+        p = self._search(self._extra, self._extras, EXTRA_ENTRY_SIZE, codepoint)
+        if p >= 0:
+            buf[0] = data[p + 2]
+            buf[1] = data[p + 3]
+            return 1
+
+        p = self._search(self._dead, self._deads, DEAD_ENTRY_SIZE, codepoint)
+        if p >= 0:
+            buf[0] = data[p + 2]
+            buf[1] = data[p + 3]
+            buf[2] = data[p + 4]
+            buf[3] = data[p + 5]
+            return 2
+        return 0
+
+    # Returns whether the layout can type character c.
+    def has(self, c):
+        return self.strokes(c, bytearray(4)) > 0
+
+
+# Class that loads layout packs from flash on first use.
+# Packs are named after the layout, e.g., "us", "de", "es" and "fr".
+class LayoutStore:
+    def __init__(self, path="lib/hidservices/layouts"):
+        self.path = path                                                                                                # Directory holding one <name>.bin file per layout.
+        self._cache = {}                                                                                                # Layouts loaded so far, by name.
+
+    # Return a layout, reading it from flash on first use.
+    def load(self, name):
+        layout = self._cache.get(name)
+        if layout is None:
+            with open(self.path + "/" + name + ".bin", "rb") as file:
+                layout = KeyboardLayout(file.read())
+            self._cache[name] = layout
+        return layout
+
+    # Drop layouts from the cache to free memory.
+    def unload(self, name=None):
+        if name is None:
+            self._cache = {}
+        elif name in self._cache:
+            del self._cache[name]
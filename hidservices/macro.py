@@ -0,0 +1,370 @@
+from micropython import const
+import errno
+import struct
+import time
+
+# Macro op codes. A compiled macro is a flat byte stream of ops, each op
+# being one op code byte followed by a fixed number of argument bytes.
+OP_END = const(0x00)                                                                                                    # End of macro, no arguments.
+OP_PRESS = const(0x01)                                                                                                  # Press key, 1 byte usage. Usages 0xE0-0xE7 set modifier bits.
+OP_RELEASE = const(0x02)                                                                                                # Release key, 1 byte usage.
+OP_RELEASE_ALL = const(0x03)                                                                                            # Release all keys and modifiers, no arguments.
+OP_MOVE = const(0x04)                                                                                                   # Relative mouse move, 2 signed bytes dx, dy.
+OP_WHEEL = const(0x05)                                                                                                  # Mouse wheel, 1 signed byte.
+OP_BUTTONS = const(0x06)                                                                                                # Mouse buttons, 1 byte button mask.
+OP_WAIT = const(0x07)                                                                                                   # Wait, 2 bytes little endian milliseconds.
+
+# Number of argument bytes following each op code, indexed by op code.
+OP_ARGS = b"\x00\x01\x01\x00\x02\x01\x01\x02"
+
+# US ASCII layout for printable characters 0x20-0x7E used by type().
+# Each byte is the key usage, with the high bit set if shift is needed.
+_US_ASCII = bytes((
+    0x2C, 0x9E, 0xB4, 0xA0, 0xA1, 0xA2, 0xA4, 0x34, 0xA6, 0xA7, 0xA5, 0xAE, 0x36, 0x2D, 0x37, 0x38,                     #  !"#$%&'()*+,-./
+    0x27, 0x1E, 0x1F, 0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26, 0xB3, 0x33, 0xB6, 0x2E, 0xB7, 0xB8,                     # 0123456789:;<=>?
+    0x9F, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89, 0x8A, 0x8B, 0x8C, 0x8D, 0x8E, 0x8F, 0x90, 0x91, 0x92,                     # @ABCDEFGHIJKLMNO
+    0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9A, 0x9B, 0x9C, 0x9D, 0x2F, 0x31, 0x30, 0xA3, 0xAD,                     # PQRSTUVWXYZ[\]^_
+    0x35, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E, 0x0F, 0x10, 0x11, 0x12,                     # `abcdefghijklmno
+    0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1A, 0x1B, 0x1C, 0x1D, 0xAF, 0xB1, 0xB0, 0xB5,                           # pqrstuvwxyz{|}~
+))
+
+_KEY_LEFT_SHIFT = const(0xE1)
+_KEY_ENTER = const(0x28)
+_KEY_TAB = const(0x2B)
+
+# Class that compiles a high-level macro sequence into a flat op stream.
+# A sequence is an iterable of tuples, e.g.
+#   (("press", 0xE0), ("press", 0x06), ("wait", 20), ("release_all",), ("type", "hello\n"), ("move", 400, -20))
+# Supported steps are press, release, release_all, tap, type, move, wheel, buttons, click and wait.
+# Pass a KeyboardLayout, see hidservices/layout.py, to type text for non US hosts.
+class MacroCompiler:
+    def __init__(self, key_delay=10, layout=None):
+        self.key_delay = key_delay                                                                                      # Milliseconds between press and release when typing or tapping.
+        self.layout = layout                                                                                            # Host KeyboardLayout used by type(), US ASCII if None.
+        self._strokes = bytearray(4)                                                                                    # Key strokes of one character, see KeyboardLayout.strokes().
+        self._code = bytearray()                                                                                        # The op stream being built.
+
+    # Compile a sequence of steps and return the op stream.
+    # An ("end",) step may only come last.
+    def compile(self, sequence):
+        self._code = bytearray()
+        ended = False
+        for step in sequence:
+            if ended:
+                raise ValueError("Macro step after end: " + str(step[0]))
+            if step[0] == "end":
+                ended = True                                                                                            # end() below terminates the stream.
+                continue
+            op = getattr(self, step[0], None)
+            if op is None or step[0].startswith("_") or step[0] == "compile":
+                raise ValueError("Unknown macro step: " + str(step[0]))
+            op(*step[1:])
+        return self.end()
+
+    # Terminate and return the op stream.
+    def end(self):
+        self._code.append(OP_END)
+        code = bytes(self._code)
+        self._code = bytearray()
+        return code
+
+    def press(self, usage):
+        self._code += bytes((OP_PRESS, usage))
+        return self
+
+    def release(self, usage):
+        self._code += bytes((OP_RELEASE, usage))
+        return self
+
+    def release_all(self):
+        self._code.append(OP_RELEASE_ALL)
+        return self
+
+    # Wait in steps of at most 65535 milliseconds.
+    def wait(self, ms):
+        while ms > 0:
+            step = ms if ms < 0xFFFF else 0xFFFF
+            self._code += struct.pack("<BH", OP_WAIT, step)
+            ms -= step
+        return self
+
+    # Press and release a key.
+    def tap(self, usage):
+        self.press(usage)
+        self.wait(self.key_delay)
+        self.release(usage)
+        return self.wait(self.key_delay)
+
+    # Tap a key with the given modifier bits held.
+    def _stroke(self, modifiers, usage):
+        for bit in range(8):
+            if modifiers & (1 << bit):
+                self.press(0xE0 + bit)
+        self.tap(usage)
+        for bit in range(8):
+            if modifiers & (1 << bit):
+                self.release(0xE0 + bit)
+
+    # Type a string of printable US ASCII characters, newlines and tabs,
+    # or any character of the layout if one is set.
+    def type(self, text):
+        if self.layout is not None:
+            strokes = self._strokes
+            for c in text:
+                n = self.layout.strokes(c, strokes)
+                if not n:
+                    raise ValueError("Character not in layout: " + c)
+                self._stroke(strokes[0], strokes[1])
+                if n == 2:                                                                                              # Dead key followed by the base key.
+                    self._stroke(strokes[2], strokes[3])
+            return self
+
+        for c in text:
+            if c == "\n":
+                self.tap(_KEY_ENTER)
+                continue
+            elif c == "\t":
+                self.tap(_KEY_TAB)
+                continue
+
+            o = ord(c)
+            if o < 0x20 or o > 0x7E:
+                raise ValueError("Character not in layout: " + c)
+            usage = _US_ASCII[o - 0x20]
+            if usage & 0x80:
+                self.press(_KEY_LEFT_SHIFT)
+                self.tap(usage & 0x7F)
+                self.release(_KEY_LEFT_SHIFT)
+            else:
+                self.tap(usage)
+        return self
+
+    # Move the mouse, split into steps of at most 127 in each direction.
+    def move(self, dx, dy):
+        while dx or dy:
+            sx = max(-127, min(127, dx))
+            sy = max(-127, min(127, dy))
+            self._code += struct.pack("<Bbb", OP_MOVE, sx, sy)
+            dx -= sx
+            dy -= sy
+        return self
+
+    def wheel(self, w):
+        while w:
+            s = max(-127, min(127, w))
+            self._code += struct.pack("<Bb", OP_WHEEL, s)
+            w -= s
+        return self
+
+    def buttons(self, mask):
+        self._code += bytes((OP_BUTTONS, mask))
+        return self
+
+    # Press and release mouse buttons.
+    def click(self, mask=1):
+        self.buttons(mask)
+        self.wait(self.key_delay)
+        self.buttons(0)
+        return self.wait(self.key_delay)
+
+
+# Class that stores compiled macros in flash and loads them lazily by name.
+class MacroStore:
+    def __init__(self, path="macros"):
+        self.path = path                                                                                                # Directory holding one <name>.mcr file per macro.
+        self._cache = {}                                                                                                # Macros loaded so far, by name.
+
+    def _file(self, name):
+        return self.path + "/" + name + ".mcr"
+
+    # Write a compiled macro to flash.
+    def save(self, name, code):
+        import os
+        try:
+            os.mkdir(self.path)
+        except OSError:
+            pass
+        with open(self._file(name), "wb") as file:
+            file.write(code)
+        self._cache[name] = code
+
+    # Return a compiled macro, reading it from flash on first use.
+    def load(self, name):
+        code = self._cache.get(name)
+        if code is None:
+            with open(self._file(name), "rb") as file:
+                code = file.read()
+            self._cache[name] = code
+        return code
+
+    # Drop macros from the cache to free memory.
+    def unload(self, name=None):
+        if name is None:
+            self._cache = {}
+        elif name in self._cache:
+            del self._cache[name]
+
+
+# Class that executes compiled macros on a periodic timer.
+# Keyboard and mouse reports are packed directly into preallocated buffers
+# and notified to the central, bypassing the device state and its prints.
+class MacroPlayer:
+    def __init__(self, device, timer=None, period=5, kb_handle=None, mouse_handle=None):
+        self._device = device                                                                                           # The Keyboard, Mouse or GenericDevice to send reports from.
+        self._timer = timer                                                                                             # A machine.Timer, created on first play() if None.
+        self.period = period                                                                                            # Timer period in milliseconds.
+        self._kb_handle = kb_handle                                                                                     # Report handles, resolved from the device on play() if None.
+        self._mouse_handle = mouse_handle
+
+        self._kb_report = bytearray(8)                                                                                  # Keyboard report: modifiers, reserved, 6 keys.
+        self._mouse_report = bytearray(4)                                                                               # Mouse report: buttons, x, y, wheel.
+
+        self._code = None                                                                                               # The macro being played.
+        self._pc = 0                                                                                                    # Offset of the next op.
+        self._wait_until = 0                                                                                            # Tick at which the current wait ends.
+        self._waiting = False
+        self._sent = []                                                                                                 # Connection handles that took the report of the current op.
+        self._done_callback = None                                                                                      # Called when a macro finishes.
+
+    # Find the report handles of the device if not given. The reports are
+    # packed in the boot layouts of Keyboard and Mouse, other devices, e.g.,
+    # AbsoluteMouse, Joystick, Gamepad or Touchpad, need explicit handles of
+    # reports with those layouts.
+    def _resolve_handles(self):
+        device = self._device
+        if self._kb_handle is None and self._mouse_handle is None:
+            if hasattr(device, "k_h_rep"):                                                                             # GenericDevice has a keyboard and a mouse report.
+                self._kb_handle = device.k_h_rep
+                self._mouse_handle = device.m_h_rep
+            elif hasattr(device, "keypresses"):                                                                         # Keyboard.
+                self._kb_handle = device.h_rep
+            elif hasattr(device, "set_axes") and hasattr(device, "set_wheel"):                                          # Mouse: relative x, y and wheel.
+                self._mouse_handle = device.h_rep
+            else:
+                raise ValueError("Macros need a Keyboard, Mouse or GenericDevice")
+
+    # Start playing a compiled macro. Stops any macro being played.
+    def play(self, code, done_callback=None):
+        self.stop()
+        self._resolve_handles()
+        self._code = code
+        self._pc = 0
+        self._waiting = False
+        del self._sent[:]
+        self._done_callback = done_callback
+        for i in range(8):
+            self._kb_report[i] = 0
+        for i in range(4):
+            self._mouse_report[i] = 0
+
+        if self._timer is None:
+            from machine import Timer
+            self._timer = Timer(-1)
+        self._timer.init(period=self.period, mode=self._timer.PERIODIC, callback=self._tick)
+
+    # Stop playing.
+    def stop(self):
+        if self._code is not None:
+            if self._timer is not None:
+                self._timer.deinit()
+            self._code = None
+
+    # Returns whether a macro is being played.
+    def is_playing(self):
+        return self._code is not None
+
+    # Notify a report to the connections that did not take it yet. Returns
+    # False if the stack is out of buffers, to retry the op on the next tick.
+    def _notify(self, handle, report):
+        device = self._device
+        if handle is None or not device.is_connected():
+            return True
+        sent = self._sent
+        try:
+            for conn_handle, connection in tuple(device.connections.items()):
+                if conn_handle not in sent and device._wants_report(connection, handle):
+                    device.transport.notify(conn_handle, handle, report)
+                    sent.append(conn_handle)
+        except OSError as e:
+            if e.args[0] != errno.ENOMEM:
+                raise
+            return False
+        del sent[:]
+        return True
+
+    # Timer callback: run ops until a wait or the end of the macro.
+    def _tick(self, _timer):
+        if self._code is None:
+            return
+        if self._waiting:
+            if time.ticks_diff(self._wait_until, time.ticks_ms()) > 0:
+                return
+            self._waiting = False
+        self.run()
+
+    # Execute ops until a wait or the end of the macro.
+    # Can be called directly instead of using the timer.
+    def run(self):
+        code = self._code
+        kb = self._kb_report
+        mouse = self._mouse_report
+        pc = self._pc
+
+        while code is not None:
+            op = code[pc]
+            if op == OP_PRESS:
+                usage = code[pc + 1]
+                if usage >= 0xE0:
+                    kb[0] |= 1 << (usage - 0xE0)
+                else:
+                    for i in range(2, 8):
+                        if kb[i] == usage:
+                            break
+                        if kb[i] == 0:
+                            kb[i] = usage
+                            break
+                if not self._notify(self._kb_handle, kb):
+                    break
+            elif op == OP_RELEASE:
+                usage = code[pc + 1]
+                if usage >= 0xE0:
+                    kb[0] &= ~(1 << (usage - 0xE0))
+                else:
+                    for i in range(2, 8):
+                        if kb[i] == usage:
+                            kb[i] = 0
+                if not self._notify(self._kb_handle, kb):
+                    break
+            elif op == OP_RELEASE_ALL:
+                for i in range(8):
+                    kb[i] = 0
+                if not self._notify(self._kb_handle, kb):
+                    break
+            elif op == OP_MOVE:
+                mouse[1] = code[pc + 1]
+                mouse[2] = code[pc + 2]
+                if not self._notify(self._mouse_handle, mouse):
+                    break
+                mouse[1] = 0
+                mouse[2] = 0
+            elif op == OP_WHEEL:
+                mouse[3] = code[pc + 1]
+                if not self._notify(self._mouse_handle, mouse):
+                    break
+                mouse[3] = 0
+            elif op == OP_BUTTONS:
+                mouse[0] = code[pc + 1]
+                if not self._notify(self._mouse_handle, mouse):
+                    break
+            elif op == OP_WAIT:
+                self._wait_until = time.ticks_add(time.ticks_ms(), code[pc + 1] | (code[pc + 2] << 8))
+                self._waiting = True
+                self._pc = pc + 3
+                return
+            else:                                                                                                       # OP_END or unknown op.
+                self.stop()
+                if self._done_callback is not None:
+                    self._done_callback()
+                return
+            pc += 1 + OP_ARGS[op]
+        self._pc = pc                                                                                                   # Stalled on ENOMEM, retry this op on the next tick.
@@ -0,0 +1,53 @@
+# Native and viper versions of the hot paths in hidservices/fastpath.py.
+# Only imported through fastpath, which falls back to the pure Python
+# versions when this module does not compile, e.g., on CPython or on a port
+# built without the native emitter. Keep both versions equivalent, see
+# fastpath.check().
+import micropython
+
+
+# Clamp v to lo..hi.
+@micropython.viper
+def clamp(v: int, lo: int, hi: int) -> int:
+    if v < lo:
+        return lo
+    if v > hi:
+        return hi
+    return v
+
+
+# Store two signed bytes, e.g., the x and y axes of a report.
+@micropython.viper
+def put_s8x2(buf, offset: int, a: int, b: int):
+    p = ptr8(buf)
+    p[offset] = a
+    p[offset + 1] = b
+
+
+# Assemble eight button or modifier values, 0 or 1, into a byte. b0 is bit 0.
+@micropython.native
+def bits8(b0, b1, b2, b3, b4, b5, b6, b7):
+    return b0 | (b1 << 1) | (b2 << 2) | (b3 << 3) | (b4 << 4) | (b5 << 5) | (b6 << 6) | (b7 << 7)
+
+
+# Store an event in slot i of a Dispatcher ring.
+@micropython.native
+def store_event(kinds, args, i, kind, a, b, c):
+    kinds[i] = kind
+    i3 = i * 3
+    args[i3] = a
+    args[i3 + 1] = b
+    args[i3 + 2] = c
+
+
+# Return the fields of an advertising type in an advertising payload.
+@micropython.native
+def decode_field(payload, adv_type):
+    i = 0
+    n = len(payload)
+    result = []
+    while i + 1 < n:
+        if payload[i + 1] == adv_type:
+            result.append(payload[i + 2 : i + payload[i] + 1])
+        i += 1 + payload[i]
+    return result
@@ -0,0 +1,235 @@
+from micropython import const
+from array import array
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:                                                                                                     # CPython, for benchmarks on the host.
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+_FRAC = const(4)                                                                                                        # Fraction bits of the smoothing state.
+_HALF = const(8)                                                                                                        # Half of an output step, 1 << (_FRAC - 1).
+
+# Analog source reading ADC pins as 16-bit values.
+class ADCSource:
+    def __init__(self, pins):
+        from machine import ADC, Pin
+        self._adcs = [ADC(Pin(pin)) for pin in pins]
+        self.channels = len(pins)
+
+    # Fill buf with one raw 0..65535 sample per channel.
+    def read(self, buf):
+        adcs = self._adcs
+        for i in range(self.channels):
+            buf[i] = adcs[i].read_u16()
+
+
+# Button source reading GPIO pins into a bitmask, bit 0 = first pin.
+class PinSource:
+    def __init__(self, pins, active_low=True):
+        from machine import Pin
+        self._pins = [Pin(pin, Pin.IN, Pin.PULL_UP if active_low else Pin.PULL_DOWN) for pin in pins]
+        self._invert = active_low
+        self.channels = len(pins)
+
+    def read(self):
+        mask = 0
+        pins = self._pins
+        for i in range(self.channels):
+            if pins[i].value() != self._invert:
+                mask |= 1 << i
+        return mask
+
+
+# Source returning preset values, for testing without hardware.
+# Set values[] and buttons directly between samples.
+class FakeSource:
+    def __init__(self, channels=2, value=32768, buttons=0):
+        self.channels = channels
+        self.values = array("H", [value] * channels)
+        self.buttons = buttons
+
+    def read(self, buf=None):
+        if buf is None:
+            return self.buttons
+        values = self.values
+        for i in range(self.channels):
+            buf[i] = values[i]
+
+
+# Build a calibration table mapping the top 8 bits of a raw 16-bit sample to
+# an output value in -out_max..out_max, with raw_center mapping to 0 and a
+# deadzone (in raw units) around the center mapping to 0 as well.
+# The table has 257 entries so the low 8 bits can be interpolated.
+# The deadzone must leave some range on both sides of it.
+def calibration_table(raw_min=0, raw_center=32768, raw_max=65535, deadzone=0, out_max=127):
+    low = raw_center - deadzone
+    high = raw_center + deadzone
+    if deadzone < 0 or low <= raw_min or high >= raw_max:
+        raise ValueError("Deadzone must lie within raw_min and raw_max")
+    table = array("h", [0] * 257)
+    for i in range(257):
+        raw = i << 8
+        if raw <= raw_min:
+            value = -out_max
+        elif raw >= raw_max:
+            value = out_max
+        elif raw < low:
+            value = -((low - raw) * out_max // (low - raw_min))
+        elif raw > high:
+            value = (raw - high) * out_max // (raw_max - high)
+        else:
+            value = 0
+        table[i] = value
+    return table
+
+
+# Class that samples input sources, calibrates, smooths and debounces them
+# with integer maths only, and feeds the result into a device.
+# All state lives in preallocated arrays so sampling does not allocate.
+#
+# Axes are calibrated through lookup tables (see calibration_table()),
+# smoothed with an exponential moving average of weight 1/2^smoothing, and
+# buttons must read the same for debounce consecutive samples to change.
+# The smoothing steps and the output round the same for both signs, so an
+# axis returning to its center settles at 0 instead of -1.
+class InputPipeline:
+    def __init__(self, device, axis_source=None, button_source=None, tables=None, smoothing=2, debounce=3, rate=100, timer=None):
+        self._device = device                                                                                           # The Mouse, Joystick or Gamepad to feed.
+        self._notify = getattr(device, "notify_hid_report_mouse", device.notify_hid_report)                             # GenericDevice sends its axes in the mouse report.
+        self._axis_source = axis_source
+        self._button_source = button_source
+        self.rate = rate                                                                                                # Samples per second.
+        self._timer = timer                                                                                             # A machine.Timer, created on start() if None.
+        self._running = False                                                                                           # Is the timer sampling?
+
+        n = axis_source.channels if axis_source is not None else 0
+        self.axis_count = n
+        if tables is None:
+            tables = [calibration_table(out_max=getattr(device, "AXIS_MAX", 127))] * n                                  # The full range of the device, e.g., 32767 for a Gamepad.
+        self._tables = tables                                                                                           # Calibration table per axis.
+        self.smoothing = smoothing                                                                                      # EMA weight shift, 0 = no smoothing.
+        self._raw = array("H", [0] * n)                                                                                 # Last raw samples.
+        self._ema = array("i", [0] * n)                                                                                 # Smoothing state with _FRAC fraction bits.
+        self.axes = array("h", [0] * n)                                                                                 # Calibrated, smoothed axes.
+        self._primed = False                                                                                            # Is the smoothing state initialised?
+
+        b = button_source.channels if button_source is not None else 0
+        self.debounce = debounce                                                                                        # Samples a button must be stable to change.
+        self._counts = bytearray(b)                                                                                     # Consecutive differing samples per button.
+        self.buttons = 0                                                                                                # Debounced button mask.
+
+        self.samples = 0                                                                                                # Number of samples taken.
+
+    # Set the calibration table of axis i.
+    def set_calibration(self, i, table):
+        self._tables[i] = table
+
+    # Calibrate a raw sample of axis i through its table, interpolating the low 8 bits.
+    def _calibrate(self, i, raw):
+        table = self._tables[i]
+        index = raw >> 8
+        low = table[index]
+        return low + (((table[index + 1] - low) * (raw & 0xFF)) >> 8)
+
+    # Take one sample of all sources. Returns whether the axes or buttons changed.
+    def sample(self):
+        changed = False
+        n = self.axis_count
+        if n:
+            self._axis_source.read(self._raw)
+            ema = self._ema
+            axes = self.axes
+            shift = self.smoothing
+            for i in range(n):
+                value = self._calibrate(i, self._raw[i]) << _FRAC
+                if self._primed:
+                    d = value - ema[i]
+                    value = ema[i] + (d >> shift) if d >= 0 else ema[i] - ((-d) >> shift)                               # Shift the magnitude, an arithmetic shift of d would floor toward -1.
+                ema[i] = value
+                value = (value + _HALF) >> _FRAC if value >= 0 else -((_HALF - value) >> _FRAC)                         # Round to nearest, symmetric around 0.
+                if value != axes[i]:
+                    axes[i] = value
+                    changed = True
+            self._primed = True
+
+        if self._button_source is not None:
+            raw = self._button_source.read()
+            stable = self.buttons
+            counts = self._counts
+            for i in range(len(counts)):
+                bit = 1 << i
+                if (raw ^ stable) & bit:
+                    counts[i] += 1
+                    if counts[i] >= self.debounce:
+                        stable ^= bit
+                        counts[i] = 0
+                        changed = True
+                else:
+                    counts[i] = 0
+            self.buttons = stable
+
+        self.samples += 1
+        return changed
+
+    # Copy the axes and buttons into the device.
+    def feed(self):
+        device = self._device
+        axes = self.axes
+        b = self.buttons
+        if hasattr(device, "set_mask"):                                                                                 # Gamepad.
+            for i in range(self.axis_count):
+                device.set_axis(i, axes[i])
+            device.set_mask(b)
+        else:                                                                                                           # Mouse or Joystick.
+            if self.axis_count >= 2:
+                device.set_axes(axes[0], axes[1])
+            if self._button_source is not None:
+                if hasattr(device, "button8"):
+                    device.set_buttons(b & 1, (b >> 1) & 1, (b >> 2) & 1, (b >> 3) & 1, (b >> 4) & 1, (b >> 5) & 1, (b >> 6) & 1, (b >> 7) & 1)
+                else:
+                    device.set_buttons(b & 1, (b >> 1) & 1, (b >> 2) & 1)
+
+    # Sample, feed the device and notify the central if anything changed.
+    # Mice are notified on every sample while moving, since their axes are relative.
+    def step(self, _timer=None):
+        changed = self.sample()
+        moving = hasattr(self._device, "w") and (self.axes[0] or self.axes[1]) if self.axis_count >= 2 else False
+        if changed or moving:
+            self.feed()
+            self._notify()
+
+    # Set the samples per second, also while sampling.
+    def set_rate(self, rate):
+        if rate != self.rate:
+            self.rate = rate
+            if self._running:
+                self.start()
+
+    # Sample periodically at the configured rate.
+    def start(self):
+        if self._timer is None:
+            from machine import Timer
+            self._timer = Timer(-1)
+        self._timer.init(freq=self.rate, mode=self._timer.PERIODIC, callback=self.step)
+        self._running = True
+
+    # Stop sampling.
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+        self._running = False
+
+    # Measure the sampling cost. Returns samples per second per channel.
+    def benchmark(self, n=1000):
+        start = ticks_us()
+        for _ in range(n):
+            self.sample()
+        elapsed = ticks_diff(ticks_us(), start)
+        channels = self.axis_count + len(self._counts)
+        return n * 1000000 // (elapsed if elapsed > 0 else 1) // (channels if channels else 1)
@@ -0,0 +1,148 @@
+from micropython import const
+from array import array
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:                                                                                                     # CPython, for benchmarks on the host.
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+_FRAC = const(8)                                                                                                        # Fraction bits of the gains and remainders.
+_MAX_SPEED = const(127)                                                                                                 # Largest delta of a mouse report.
+_FRAC_MASK = const(0xFF)                                                                                                # The fraction bits, (1 << _FRAC) - 1.
+
+# Acceleration curves as (speed, gain) points, ascending. Speed is the larger
+# of |dx| and |dy| of a sample, gain the factor applied to both. The gain is
+# interpolated linearly between points and constant beyond the last one.
+FLAT = ((0, 1.0),)
+SOFT = ((0, 1.0), (4, 1.0), (16, 1.5), (40, 2.0))
+STEEP = ((0, 0.5), (2, 1.0), (8, 2.0), (24, 3.0), (64, 4.0))
+
+
+# Gain of a curve at a speed, by linear interpolation.
+def curve_gain(curve, speed):
+    if speed <= curve[0][0]:
+        return curve[0][1]
+    for i in range(1, len(curve)):
+        s1, g1 = curve[i]
+        if speed <= s1:
+            s0, g0 = curve[i - 1]
+            return g0 + (g1 - g0) * (speed - s0) / (s1 - s0)
+    return curve[-1][1]
+
+
+# Class that applies pointer acceleration and DPI scaling with integer maths.
+# The curve and scale are compiled once into a table of fixed point gains
+# indexed by speed, so a sample costs a lookup and two multiplications.
+# The fractions that do not fit in a report carry over to the next sample,
+# so slow motion is not lost. Motion beyond the report range is dropped,
+# so the pointer stops with the hand after a fast flick.
+class PointerAcceleration:
+    def __init__(self, curve=FLAT, scale=1.0):
+        self.x = 0                                                                                                      # The last output deltas.
+        self.y = 0
+        self._rx = 0                                                                                                    # Remainders with _FRAC fraction bits.
+        self._ry = 0
+        self.set_curve(curve, scale)
+
+    # Compile a curve and DPI scale factor into the gain table.
+    def set_curve(self, curve=FLAT, scale=1.0):
+        table = array("h", [0] * (_MAX_SPEED + 1))
+        for speed in range(_MAX_SPEED + 1):
+            gain = int(curve_gain(curve, speed) * scale * (1 << _FRAC) + 0.5)
+            table[speed] = gain if gain < 32767 else 32767
+        self._table = table
+        self.curve = curve
+        self.scale = scale
+
+    # Drop the carried remainders, e.g., when the pointer stops.
+    def reset(self):
+        self._rx = 0
+        self._ry = 0
+
+    # Apply the acceleration to a sample. The results are left in x and y.
+    def apply(self, dx, dy):
+        speed = dx if dx >= 0 else -dx
+        s = dy if dy >= 0 else -dy
+        if s > speed:
+            speed = s
+        gain = self._table[speed if speed <= _MAX_SPEED else _MAX_SPEED]
+
+        v = self._rx + dx * gain
+        x = v >> _FRAC                                                                                                  # Floor, the remainder is always positive.
+        if x > 127:
+            x = 127
+        elif x < -127:
+            x = -127
+        self._rx = v & _FRAC_MASK                                                                                       # Only the fraction, also when clamped.
+
+        v = self._ry + dy * gain
+        y = v >> _FRAC
+        if y > 127:
+            y = 127
+        elif y < -127:
+            y = -127
+        self._ry = v & _FRAC_MASK
+
+        self.x = x
+        self.y = y
+
+    # Apply the acceleration to a sample and return the deltas (dx, dy)
+    # without clamping them to a report, e.g., to merge several samples and
+    # split the sum into reports, see ThreadedInput.
+    def accelerate(self, dx, dy):
+        speed = dx if dx >= 0 else -dx
+        s = dy if dy >= 0 else -dy
+        if s > speed:
+            speed = s
+        gain = self._table[speed if speed <= _MAX_SPEED else _MAX_SPEED]
+
+        v = self._rx + dx * gain
+        x = v >> _FRAC
+        self._rx = v - (x << _FRAC)
+
+        v = self._ry + dy * gain
+        y = v >> _FRAC
+        self._ry = v - (y << _FRAC)
+        return x, y
+
+
+# Float reference of PointerAcceleration, for comparison in benchmark().
+class FloatPointerAcceleration:
+    def __init__(self, curve=FLAT, scale=1.0):
+        self.curve = curve
+        self.scale = scale
+        self.x = 0
+        self.y = 0
+        self._rx = 0.0
+        self._ry = 0.0
+
+    def apply(self, dx, dy):
+        gain = curve_gain(self.curve, max(abs(dx), abs(dy))) * self.scale
+        v = self._rx + dx * gain
+        x = max(-127, min(127, int(v // 1)))
+        self._rx = v % 1.0
+        v = self._ry + dy * gain
+        y = max(-127, min(127, int(v // 1)))
+        self._ry = v % 1.0
+        self.x = x
+        self.y = y
+
+
+# Measure the per-sample cost of the table and the float version on the same
+# deltas. Returns (table_us, float_us), microseconds per sample.
+def benchmark(curve=SOFT, scale=1.0, n=1000):
+    deltas = array("b", [((i * 37) % 61) - 30 for i in range(64)])
+    result = []
+    for accel in (PointerAcceleration(curve, scale), FloatPointerAcceleration(curve, scale)):
+        start = ticks_us()
+        for i in range(n):
+            accel.apply(deltas[i & 63], deltas[(i + 7) & 63])
+        elapsed = ticks_diff(ticks_us(), start)
+        result.append(elapsed / n)
+    return tuple(result)
@@ -0,0 +1,124 @@
+from micropython import const
+import time
+
+# Power states.
+POWER_ACTIVE = const(0)                                                                                                 # Input seen recently, report at the fast rate.
+POWER_SLOW = const(1)                                                                                                   # Input is sparse, report at the slow rate.
+POWER_SLEEP = const(2)                                                                                                  # Idle, the connection or advertising was dropped.
+
+
+# Clock for PowerPolicy that only moves when advanced, for testing
+# without hardware. Any object with ticks_ms() and ticks_diff() can be
+# used, by default the time module.
+class FakeClock:
+    def __init__(self, ms=0):
+        self.ms = ms
+
+    def ticks_ms(self):
+        return self.ms
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def advance(self, ms):
+        self.ms += ms
+
+
+# Class that adapts a device to its input activity, see
+# HumanInterfaceDevice.set_power_policy().
+# The device reports every notify to activity(). After slow_after ms without
+# input the policy goes to POWER_SLOW, and an attached InputPipeline samples
+# at the slow rate. After disconnect_after ms the connected hosts are
+# dropped, and after stop_advertising_after ms advertising stops. Both leave
+# the policy in POWER_SLEEP. The first new input restores the fast rate and
+# advertises again if needed, so the host reconnects. A timeout of None
+# disables that step. Call step() periodically, or start() a timer for it.
+class PowerPolicy:
+    def __init__(self, device, slow_after=2000, disconnect_after=600000, stop_advertising_after=60000, fast_rate=100, slow_rate=20, clock=time, timer=None):
+        self._device = device                                                                                           # The device to watch.
+        self._clock = clock                                                                                             # Source of ticks_ms() and ticks_diff().
+        self._timer = timer                                                                                             # A machine.Timer, created on start() if None.
+        self.slow_after = slow_after                                                                                    # Milliseconds without input before reporting slowly.
+        self.disconnect_after = disconnect_after                                                                        # Milliseconds without input before dropping the hosts.
+        self.stop_advertising_after = stop_advertising_after                                                            # Milliseconds without input or host before stopping advertising.
+        self.fast_rate = fast_rate                                                                                      # Samples per second of the pipeline when active.
+        self.slow_rate = slow_rate                                                                                      # Samples per second of the pipeline when slow.
+        self.pipeline = None                                                                                            # The InputPipeline to slow down, see set_pipeline().
+        self.callback = None                                                                                            # Called with the new state on every change.
+
+        self.state = POWER_ACTIVE
+        self._last = clock.ticks_ms()                                                                                   # Tick of the last input.
+        self._advertised = self._last                                                                                   # Tick at which the device started advertising.
+        self._was_advertising = False
+
+    # Set an InputPipeline that samples at the fast rate when active and at
+    # the slow rate otherwise.
+    def set_pipeline(self, pipeline):
+        self.pipeline = pipeline
+        pipeline.set_rate(self.fast_rate if self.state is POWER_ACTIVE else self.slow_rate)
+
+    # Set a callback function that gets the new state on every change.
+    def set_callback(self, callback):
+        self.callback = callback
+
+    # Note input. Called by the device on every notify, cheap on the fast path.
+    def activity(self):
+        self._last = self._clock.ticks_ms()
+        if self.state is not POWER_ACTIVE:
+            self._wake()
+
+    # Returns the milliseconds since the last input.
+    def idle_ms(self):
+        return self._clock.ticks_diff(self._clock.ticks_ms(), self._last)
+
+    def _set_state(self, state):
+        self.state = state
+        if self.pipeline is not None:
+            self.pipeline.set_rate(self.fast_rate if state is POWER_ACTIVE else self.slow_rate)
+        if self.callback is not None:
+            self.callback(state)
+
+    def _wake(self):
+        sleeping = self.state is POWER_SLEEP
+        self._set_state(POWER_ACTIVE)
+        if sleeping and not self._device.is_connected():
+            self._device.start_advertising()                                                                            # Let the host reconnect.
+
+    # Apply the timeouts. Call periodically, e.g., from a timer or main loop.
+    def step(self, _timer=None):
+        device = self._device
+        clock = self._clock
+        now = clock.ticks_ms()
+        idle = clock.ticks_diff(now, self._last)
+
+        advertising = device.is_advertising()
+        if advertising and not self._was_advertising:
+            self._advertised = now                                                                                      # Count the advertising timeout from its start.
+        self._was_advertising = advertising
+
+        if self.state is POWER_ACTIVE and self.slow_after is not None and idle >= self.slow_after:
+            self._set_state(POWER_SLOW)
+
+        if device.is_connected():
+            if self.state is not POWER_SLEEP and self.disconnect_after is not None and idle >= self.disconnect_after:
+                device.stop_advertising()                                                                               # Advertising for more hosts, see set_max_connections().
+                for conn_handle in list(device.connections):
+                    device._ble.gap_disconnect(conn_handle)                                                             # The device goes idle without advertising.
+                self._set_state(POWER_SLEEP)
+        elif advertising:
+            if self.stop_advertising_after is not None and clock.ticks_diff(now, self._advertised) >= self.stop_advertising_after and idle >= self.stop_advertising_after:
+                device.stop_advertising()
+                self._was_advertising = False
+                self._set_state(POWER_SLEEP)
+
+    # Apply the timeouts periodically.
+    def start(self, period_ms=1000):
+        if self._timer is None:
+            from machine import Timer
+            self._timer = Timer(-1)
+        self._timer.init(period=period_ms, mode=self._timer.PERIODIC, callback=self.step)
+
+    # Stop applying the timeouts.
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
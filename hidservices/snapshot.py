@@ -0,0 +1,263 @@
+from lib.hid_services import HumanInterfaceDevice
+from lib.hidservices.constants import Constants
+import os
+import struct
+
+_MAGIC = b"HSN1"                                                                                                        # Marks a snapshot blob, and its format version.
+
+
+# Store for snapshots in RTC memory, which survives deep sleep but not a
+# power cycle. Holds up to size bytes, 2 KB on the ESP32.
+class RTCStore:
+    def __init__(self, rtc=None, size=2048):
+        if rtc is None:
+            from machine import RTC
+            rtc = RTC()
+        self._rtc = rtc
+        self.size = size                                                                                                # Largest blob that fits, see Snapshot.capture().
+
+    def read(self):
+        return self._rtc.memory()
+
+    def write(self, blob):
+        self._rtc.memory(blob)
+
+    def clear(self):
+        self._rtc.memory(b"")
+
+
+# Store for snapshots in a file, e.g., on boards without RTC memory or with
+# the unix port.
+class FileStore:
+    def __init__(self, path="snapshot.bin"):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path, "rb") as file:
+                return file.read()
+        except OSError:
+            return b""
+
+    def write(self, blob):
+        with open(self.path, "wb") as file:
+            file.write(blob)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:                                                                                                 # No snapshot file.
+            pass
+
+
+def _pack_bytes(out, value):
+    out += struct.pack("<H", len(value))
+    out += value
+
+
+def _unpack_bytes(blob, offset):
+    n = struct.unpack_from("<H", blob, offset)[0]
+    offset += 2
+    return bytes(blob[offset:offset + n]), offset + n
+
+
+# Class that lets a device resume from deep sleep with its hosts and values.
+# capture() serializes the minimal runtime state of a started device into a
+# compact blob in a store: the host slots with their bonding keys and last
+# peers, the registered handles, the handle attributes of the device and the
+# characteristic values, which include the protocol mode and the reports.
+# On wake, resume() loads the blob for the next device constructed:
+#   snapshot = Snapshot(RTCStore())
+#   snapshot.resume()
+#   mouse = Mouse()                                                                                                     # Takes the keys from the snapshot, keys.json is not read.
+#   mouse.start()                                                                                                       # Registers and writes the saved values.
+#   mouse.start_advertising()
+#   ...
+#   snapshot.capture(mouse)                                                                                             # When idle, right before machine.deepsleep().
+# The radio holds nothing after deep sleep, so the device still turns it on,
+# registers and writes every value, the same radio work as a cold start,
+# and wake-to-advertise stays the same. What shortens wake-to-first-report
+# is that a device resumed with a last peer advertises fast, see
+# HumanInterfaceDevice.start_advertising(), so the host that scans to
+# reconnect finds it sooner. Reading keys.json from flash is also saved,
+# and the values keep what the hosts last saw, e.g., the protocol mode.
+# See tools/emulate_wake.py. A blob larger than the store, e.g.,
+# with many bonded hosts in RTC memory, goes to the fallback file store.
+# A device of another class, or whose registration gives other handles or
+# whose report map changed, e.g., after a firmware update, ignores the
+# snapshot and sets up as usual. Capture when no keys or buttons are held,
+# the saved reports are what the host reads after the wake.
+class Snapshot:
+    def __init__(self, store, fallback=None):
+        self.store = store
+        self.fallback = fallback if fallback is not None else FileStore()                                               # For blobs larger than store.size.
+        self.name = None                                                                                                # Class name of the captured device.
+        self.active_slot = None
+        self.host_slots = None                                                                                          # Slot name -> [key store, last peer (addr_type, addr) or None].
+        self.handles = None                                                                                             # The handles returned by the registration.
+        self.attributes = None                                                                                          # Handle attribute name -> handle, e.g., "h_rep".
+        self.values = None                                                                                              # Handle -> characteristic value.
+
+    # Serialize the state of a started device into the store.
+    # Returns the size of the blob in bytes.
+    def capture(self, device):
+        if device._handles is None:
+            raise ValueError("Device not started")
+        out = bytearray(_MAGIC)
+        _pack_bytes(out, type(device).__name__.encode())
+        _pack_bytes(out, device.active_slot.encode())
+
+        out += struct.pack("<B", len(device.host_slots))
+        for name, (secrets, peer) in device.host_slots.items():
+            _pack_bytes(out, name.encode())
+            if peer is None:
+                out += b"\xff"
+            else:
+                out += struct.pack("<B", peer[0])
+                _pack_bytes(out, peer[1])
+            out += struct.pack("<H", len(secrets))
+            for (sec_type, key), value in secrets.items():
+                out += struct.pack("<B", sec_type)
+                _pack_bytes(out, key)
+                _pack_bytes(out, value)
+
+        out += struct.pack("<B", len(device._handles))
+        for service in device._handles:
+            out += struct.pack("<B", len(service))
+            for handle in service:
+                out += struct.pack("<H", handle)
+
+        attributes = [(name, value) for name, value in device.__dict__.items() if (name.startswith("h_") or "_h_" in name) and isinstance(value, int)]
+        out += struct.pack("<B", len(attributes))
+        for name, handle in attributes:
+            _pack_bytes(out, name.encode())
+            out += struct.pack("<H", handle)
+
+        out += struct.pack("<H", len(device.characteristics))
+        for handle, (_description, value) in device.characteristics.items():
+            out += struct.pack("<H", handle)
+            _pack_bytes(out, value)
+
+        if len(out) > getattr(self.store, "size", len(out)):
+            if device.log_level >= Constants.LOG_INFO:
+                print("Snapshot of", len(out), "bytes too large for the store, saving to", self.fallback.path)
+            self.store.clear()
+            self.fallback.write(out)
+        else:
+            self.store.write(out)
+            self.fallback.clear()                                                                                       # Do not resume an older snapshot after the store is lost.
+        return len(out)
+
+    # Load the blob from the store, or from the fallback store. Returns
+    # whether either holds a snapshot.
+    def load(self):
+        blob = self.store.read()
+        if not blob or blob[:4] != _MAGIC:
+            blob = self.fallback.read()
+        if not blob or blob[:4] != _MAGIC:
+            return False
+        try:
+            name, o = _unpack_bytes(blob, 4)
+            active_slot, o = _unpack_bytes(blob, o)
+
+            host_slots = {}
+            n = blob[o]
+            o += 1
+            for _ in range(n):
+                slot, o = _unpack_bytes(blob, o)
+                addr_type = blob[o]
+                o += 1
+                peer = None
+                if addr_type != 0xFF:
+                    addr, o = _unpack_bytes(blob, o)
+                    peer = (addr_type, addr)
+                secrets = {}
+                count = struct.unpack_from("<H", blob, o)[0]
+                o += 2
+                for _i in range(count):
+                    sec_type = blob[o]
+                    key, o = _unpack_bytes(blob, o + 1)
+                    secrets[sec_type, key], o = _unpack_bytes(blob, o)
+                host_slots[slot.decode()] = [secrets, peer]
+
+            handles = []
+            n = blob[o]
+            o += 1
+            for _ in range(n):
+                count = blob[o]
+                handles.append(struct.unpack_from("<" + "H" * count, blob, o + 1))
+                o += 1 + 2 * count
+
+            attributes = {}
+            n = blob[o]
+            o += 1
+            for _ in range(n):
+                attribute, o = _unpack_bytes(blob, o)
+                attributes[attribute.decode()] = struct.unpack_from("<H", blob, o)[0]
+                o += 2
+
+            values = {}
+            n = struct.unpack_from("<H", blob, o)[0]
+            o += 2
+            for _ in range(n):
+                handle = struct.unpack_from("<H", blob, o)[0]
+                values[handle], o = _unpack_bytes(blob, o + 2)
+        except Exception:                                                                                               # Truncated or corrupt, e.g., RTC memory after a brown-out.
+            return False
+
+        self.name = name.decode()
+        self.active_slot = active_slot.decode()
+        self.host_slots = host_slots
+        self.handles = handles
+        self.attributes = attributes
+        self.values = values
+        return True
+
+    # Load the blob and let the next device constructed resume from it.
+    # Returns whether there was a snapshot to resume from.
+    def resume(self):
+        if not self.load():
+            return False
+        HumanInterfaceDevice._resume = self
+        return True
+
+    # Forget the snapshot, e.g., to set up as usual on the next wake.
+    def clear(self):
+        self.store.clear()
+        self.fallback.clear()
+        if HumanInterfaceDevice._resume is self:
+            HumanInterfaceDevice._resume = None
+
+    # Give a device under construction the host slots and bonding keys.
+    # Called by HumanInterfaceDevice instead of load_secrets(). Returns
+    # whether the snapshot is of the same class.
+    def restore_secrets(self, device):
+        if type(device).__name__ != self.name:
+            HumanInterfaceDevice._resume = None
+            return False
+        device.host_slots = self.host_slots
+        device.active_slot = self.active_slot if self.active_slot in self.host_slots else next(iter(self.host_slots))
+        device.secrets = self.host_slots[device.active_slot][0]
+        device.fast_advertising = self.host_slots[device.active_slot][1] is not None                                    # The last host likely scans to reconnect.
+        return True
+
+    # Give a device its handle attributes and characteristic values after
+    # registering with the same handles, instead of computing them.
+    # Called by HumanInterfaceDevice.register_services(). Returns whether
+    # the snapshot applies. It is used once.
+    def restore_characteristics(self, device, handles):
+        HumanInterfaceDevice._resume = None
+        if [tuple(service) for service in handles] != self.handles:
+            return False
+        report_map = bytes(device.HID_INPUT_REPORT)
+        for value in self.values.values():
+            if value == report_map:
+                break
+        else:
+            return False
+        for name, handle in self.attributes.items():
+            setattr(device, name, handle)
+        characteristics = device.characteristics
+        for handle, value in self.values.items():
+            characteristics[handle] = ("", value)                                                                       # No descriptions, as in lean mode.
+        return True
@@ -0,0 +1,299 @@
+from micropython import const
+import struct
+import time
+
+# Event kinds.
+EVENT_MOVE = const(0)                                                                                                   # Relative move: a = dx, b = dy, c = wheel.
+EVENT_BUTTONS = const(1)                                                                                                # Button mask: p = buttons, bit 0 is button 1.
+EVENT_KEY_DOWN = const(2)                                                                                               # Key pressed: p = usage.
+EVENT_KEY_UP = const(3)                                                                                                 # Key released: p = usage.
+EVENT_AXIS = const(4)                                                                                                   # Absolute axis: p = axis index, a = value.
+
+_EVENT = "<BBhhh"                                                                                                       # Kind, p, a, b, c.
+_EVENT_SIZE = const(8)
+
+
+# Single-producer, single-consumer ring of fixed-size input events.
+# The events live in one preallocated bytearray. Only put() moves the head
+# and only get() moves the tail, each after its slot is written or read, so
+# one thread may put while another gets without a lock. One slot is kept
+# free to tell full from empty. Events put while the ring is full are
+# dropped and counted in overflows.
+class EventRing:
+    def __init__(self, size=64):
+        self._size = size + 1                                                                                           # Number of event slots.
+        self._buf = bytearray(self._size * _EVENT_SIZE)
+        self._head = 0                                                                                                  # Next slot to write, only moved by put().
+        self._tail = 0                                                                                                  # Next slot to read, only moved by get().
+        self.overflows = 0                                                                                              # Number of events dropped because the ring was full.
+
+    # Returns the number of pending events.
+    def pending(self):
+        n = self._head - self._tail
+        return n if n >= 0 else n + self._size
+
+    # Queue an event. Producer side. Returns False on overflow.
+    def put(self, kind, p=0, a=0, b=0, c=0):
+        i = self._head
+        head = i + 1 if i + 1 < self._size else 0
+        if head == self._tail:
+            self.overflows += 1
+            return False
+        struct.pack_into(_EVENT, self._buf, i * _EVENT_SIZE, kind, p, a, b, c)
+        self._head = head                                                                                               # Publish the event.
+        return True
+
+    # Take the oldest event as (kind, p, a, b, c), or None if empty. Consumer side.
+    def get(self):
+        i = self._tail
+        if i == self._head:
+            return None
+        event = struct.unpack_from(_EVENT, self._buf, i * _EVENT_SIZE)
+        self._tail = i + 1 if i + 1 < self._size else 0                                                                 # Free the slot.
+        return event
+
+
+# Class for an opt-in threaded mode: input is sampled on a producer thread,
+# e.g., on the second core of an ESP32, and reported on the BLE side.
+# The producer only calls move(), buttons(), press(), release() and axis(),
+# which put events into an EventRing. The BLE side calls pump(), e.g., from
+# its main loop, which takes the events, merges them and notifies the device.
+# Moves are summed, after pointer acceleration if the device has it, and
+# axes keep their last value, while button and key changes are sent in
+# order, so no click or keystroke is merged away.
+# With a coalescing window, merged moves and axes are held until window_ms
+# passed since the last report, so fast producers send fewer reports.
+# A report the stack refuses for lack of buffers (ENOMEM) is kept and sent
+# by the next pump() to the connections that missed it, see
+# HumanInterfaceDevice._push_report(), before any further event is taken.
+class ThreadedInput:
+    def __init__(self, device, size=64):
+        self._device = device                                                                                           # The Mouse, Keyboard, Joystick or Gamepad to feed.
+        self.ring = EventRing(size)
+        self.running = False                                                                                            # Is the producer thread running? Cleared by stop().
+        self.window_ms = 0                                                                                              # Milliseconds to merge moves and axes over, 0 to send them on every pump().
+
+        self._has_xy = hasattr(device, "set_axes") and not hasattr(device, "AXIS_MAX") and not hasattr(device, "button8")# Relative x and y: Mouse, GenericDevice.
+        self._has_wheel = hasattr(device, "set_wheel")                                                                  # Relative wheel: also AbsoluteMouse.
+        self._has_axes = hasattr(device, "set_axis") or hasattr(device, "button8")                                      # Absolute axes: Gamepad, Joystick.
+        self._generic = hasattr(device, "m_h_rep")                                                                      # GenericDevice sends keys and moves in separate reports.
+
+        self._dx = 0                                                                                                    # Merged moves not sent yet.
+        self._dy = 0
+        self._dw = 0
+        self._axes_changed = False                                                                                      # Axis events since the last notify?
+        self._event = None                                                                                              # A button or key event taken but not applied yet.
+        self._push = None                                                                                               # The _push_report() of a report the stack refused.
+        self._sent = time.ticks_ms()                                                                                    # Tick of the last report.
+        self.events = 0                                                                                                 # Number of events consumed.
+        self.reports = 0                                                                                                # Number of reports sent.
+
+    # Producer side. Moves need a device with relative axes, Joystick and
+    # Gamepad take axis() instead.
+    def move(self, dx, dy, wheel=0):
+        if ((dx or dy) and not self._has_xy) or (wheel and not self._has_wheel):
+            raise ValueError("Device has no relative axes")
+        return self.ring.put(EVENT_MOVE, 0, dx, dy, wheel)
+
+    def buttons(self, mask):
+        return self.ring.put(EVENT_BUTTONS, mask)
+
+    def press(self, usage):
+        return self.ring.put(EVENT_KEY_DOWN, usage)
+
+    def release(self, usage):
+        return self.ring.put(EVENT_KEY_UP, usage)
+
+    # Producer side. Axes need a Joystick or Gamepad.
+    def axis(self, i, value):
+        if not self._has_axes:
+            raise ValueError("Device has no absolute axes")
+        return self.ring.put(EVENT_AXIS, i, value)
+
+    # Run producer(self) on a new thread. It should return once running is
+    # cleared, see stop().
+    def start(self, producer, stack_size=None):
+        import _thread
+        if stack_size is not None:
+            _thread.stack_size(stack_size)
+        self.running = True
+        _thread.start_new_thread(producer, (self,))
+
+    # Ask the producer thread to return.
+    def stop(self):
+        self.running = False
+
+    # BLE side. Take all pending events, apply them to the device and notify
+    # it, the merged moves and axes once the coalescing window passed.
+    # Returns the number of events taken. While the stack is out of buffers,
+    # the events wait in the ring.
+    def pump(self):
+        if self._push is not None and not self._retry():
+            return 0
+        ring = self.ring
+        device = self._device
+        n = 0
+        while True:
+            event = self._event
+            if event is None:
+                event = ring.get()
+                if event is None:
+                    break
+                n += 1
+            kind, p, a, b, c = event
+            if kind == EVENT_MOVE:
+                accel = device.acceleration if self._has_xy else None
+                if accel is not None:                                                                                   # Accelerate each sample, by its own speed.
+                    a, b = accel.accelerate(a, b)
+                self._dx += a
+                self._dy += b
+                self._dw += c
+            elif kind == EVENT_AXIS:
+                if hasattr(device, "set_axis"):                                                                         # Gamepad.
+                    device.set_axis(p, a)
+                elif p == 0:                                                                                            # Joystick.
+                    device.set_axes(a, device.y)
+                else:
+                    device.set_axes(device.x, a)
+                self._axes_changed = True
+            else:                                                                                                       # Send the state so far, then the change.
+                self._event = event
+                if not self._flush():
+                    break                                                                                               # The change is applied on the next pump().
+                self._event = None
+                if kind == EVENT_BUTTONS:
+                    self._set_buttons(p)
+                elif kind == EVENT_KEY_DOWN:
+                    device.press(p)
+                else:
+                    device.release(p)
+                if not self._notify(kind != EVENT_BUTTONS):
+                    break
+        if self._push is None and (not self.window_ms or time.ticks_diff(time.ticks_ms(), self._sent) >= self.window_ms):
+            self._flush()
+        self.events += n
+        return n
+
+    def _set_buttons(self, b):
+        device = self._device
+        if hasattr(device, "set_mask"):                                                                                 # Gamepad.
+            device.set_mask(b)
+        elif hasattr(device, "button8"):                                                                                # Joystick.
+            device.set_buttons(b & 1, (b >> 1) & 1, (b >> 2) & 1, (b >> 3) & 1, (b >> 4) & 1, (b >> 5) & 1, (b >> 6) & 1, (b >> 7) & 1)
+        else:                                                                                                           # Mouse.
+            device.set_buttons(b & 1, (b >> 1) & 1, (b >> 2) & 1)
+
+    # Commit the device state and notify it, the keyboard report for key
+    # events, else the pointer report. Returns False if the stack is out of
+    # buffers, the report is then retried by the next pump().
+    def _notify(self, keys=False):
+        device = self._device
+        device.commit()
+        self._axes_changed = False
+        self._sent = time.ticks_ms()
+        self.reports += 1
+        if not device.is_connected():
+            return True
+        if not self._generic:
+            handle, state = device.h_rep, device._state
+        elif keys:
+            handle, state = device.k_h_rep, device._kb_state
+        else:
+            handle, state = device.m_h_rep, device._mouse_state
+        report = state.front                                                                                            # A bytes snapshot, kept while the next state is set.
+        device.characteristics[handle] = (device.characteristics[handle][0], report)
+        self._push = device._push_report(handle, report)
+        return self._retry()
+
+    # Go on with the refused report. Returns whether every connection has it.
+    def _retry(self):
+        try:
+            next(self._push)
+        except StopIteration:
+            self._push = None
+            return True
+        return False
+
+    # Send the merged moves, in as many reports as their size needs, and
+    # the axes if they changed. With pointer acceleration, the moves were
+    # accelerated when merged, see pump(), and the reports carry them as is.
+    # Returns False if the stack is out of buffers.
+    def _flush(self):
+        device = self._device
+        accel = device.acceleration if self._has_xy else None
+        if accel is not None:
+            device.acceleration = None                                                                                  # Do not accelerate the parts again in set_axes().
+        try:
+            if not self._send_moves():
+                return False
+        finally:
+            if accel is not None:
+                device.acceleration = accel
+        if self._axes_changed:
+            return self._notify()
+        return True
+
+    # Send the merged moves in reports of at most 127 per axis. Returns
+    # False if the stack is out of buffers.
+    def _send_moves(self):
+        device = self._device
+        while self._dx or self._dy or self._dw:
+            x = max(-127, min(127, self._dx))
+            y = max(-127, min(127, self._dy))
+            w = max(-127, min(127, self._dw))
+            if self._has_xy:
+                device.set_axes(x, y)
+            if self._has_wheel:
+                device.set_wheel(w)
+            self._dx -= x
+            self._dy -= y
+            self._dw -= w
+            sent = self._notify()
+            if self._has_xy:                                                                                            # Relative axes, do not repeat the move.
+                device.set_axes(0, 0)
+            if self._has_wheel:
+                device.set_wheel(0)
+            if not sent:
+                return False
+        return True
+
+
+# Measure the throughput of an EventRing between a producer thread and this
+# thread, e.g., with the MicroPython unix port. The producer retries while
+# the ring is full. Returns (events per second, times the ring was full).
+def benchmark(n=100000, size=64):
+    import _thread
+
+    try:
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+        pause = lambda: time.sleep_us(0)
+    except AttributeError:                                                                                              # CPython.
+        ticks_us = lambda: time.perf_counter_ns() // 1000
+        ticks_diff = lambda a, b: a - b
+        pause = lambda: time.sleep(0)
+
+    ring = EventRing(size)
+    done = []
+
+    def producer():
+        i = 0
+        while i < n:
+            if ring.put(EVENT_MOVE, 0, 1, -1, 0):
+                i += 1
+            else:                                                                                                       # Full, let the consumer run.
+                pause()
+        done.append(True)
+
+    start = ticks_us()
+    _thread.start_new_thread(producer, ())
+    received = 0
+    while received < n:
+        if ring.get() is not None:
+            received += 1
+        else:                                                                                                           # Empty, let the producer run.
+            pause()
+    elapsed = ticks_diff(ticks_us(), start)
+    while not done:
+        pass
+    return received * 1000000 // max(1, elapsed), ring.overflows
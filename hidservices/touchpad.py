@@ -0,0 +1,390 @@
+from micropython import const
+from bluetooth import UUID
+from lib.hid_services import HumanInterfaceDevice
+from lib.hidservices.constants import Constants
+from array import array
+import errno
+import struct
+import time
+
+_FREE = const(0xFF)                                                                                                     # Contact identifier of an unused slot.
+_CONTACT_SIZE = const(4)                                                                                                # Flags and identifier, 12-bit X and Y.
+_TRAILER_SIZE = const(4)                                                                                                # Scan time, contact count, button.
+_ATT_HEADER = const(3)                                                                                                  # Bytes of a notification that are not payload.
+_DEFAULT_MTU = const(23)                                                                                                # MTU of a link until exchanged.
+_MAP_MAX = const(512)                                                                                                   # Largest attribute value, limits the report map.
+_FINGER_SIZE = const(48)                                                                                                # Bytes of the report description of one contact.
+_MAP_FIXED = const(79)                                                                                                  # Bytes of the report map without contacts and hybrid report.
+_HYBRID_FIXED = const(52)                                                                                               # Bytes the hybrid report adds, besides its contacts.
+
+
+# Report description of the start of a contact report: its report ID and
+# the unit of the contact coordinates.
+def _header(report_id):
+    # fmt: off
+    return [
+        0x85, report_id,                                                                                                #   REPORT_ID (report_id)
+        0x55, 0x0e,                                                                                                     #   UNIT_EXPONENT (-2)
+        0x65, 0x11,                                                                                                     #   UNIT (SI Lin:Distance, cm)
+    ]
+    # fmt: on
+
+
+# Report description of one contact: tip switch, confidence, identifier and
+# 12-bit X and Y with their physical size in 0.1 mm. Logical minimum,
+# physical minimum and report count are set once, in the report map.
+def _finger(width, height):
+    # fmt: off
+    return [
+        0x09, 0x22,                                                                                                     #   USAGE (Finger)
+        0xa1, 0x02,                                                                                                     #   COLLECTION (Logical)
+        0x25, 0x01,                                                                                                     #     LOGICAL_MAXIMUM (1)
+        0x75, 0x01,                                                                                                     #     REPORT_SIZE (1)
+        0x09, 0x42,                                                                                                     #     USAGE (Tip Switch)
+        0x81, 0x02,                                                                                                     #     INPUT (Data,Var,Abs); tip switch bit
+        0x09, 0x47,                                                                                                     #     USAGE (Confidence)
+        0x81, 0x02,                                                                                                     #     INPUT (Data,Var,Abs); confidence bit
+        0x25, 0x3f,                                                                                                     #     LOGICAL_MAXIMUM (63)
+        0x75, 0x06,                                                                                                     #     REPORT_SIZE (6)
+        0x09, 0x51,                                                                                                     #     USAGE (Contact Identifier)
+        0x81, 0x02,                                                                                                     #     INPUT (Data,Var,Abs); contact identifier
+        0x05, 0x01,                                                                                                     #     USAGE_PAGE (Generic Desktop)
+        0x26, 0xff, 0x0f,                                                                                               #     LOGICAL_MAXIMUM (4095)
+        0x75, 0x0c,                                                                                                     #     REPORT_SIZE (12)
+        0x46, width & 0xFF, width >> 8,                                                                                 #     PHYSICAL_MAXIMUM (width)
+        0x09, 0x30,                                                                                                     #     USAGE (X)
+        0x81, 0x02,                                                                                                     #     INPUT (Data,Var,Abs); X
+        0x46, height & 0xFF, height >> 8,                                                                               #     PHYSICAL_MAXIMUM (height)
+        0x09, 0x31,                                                                                                     #     USAGE (Y)
+        0x81, 0x02,                                                                                                     #     INPUT (Data,Var,Abs); Y
+        0x05, 0x0d,                                                                                                     #     USAGE_PAGE (Digitizer)
+        0xc0,                                                                                                           #   END_COLLECTION
+    ]
+    # fmt: on
+
+
+# Report description of the end of a contact report: scan time, contact
+# count and the button of a clickpad.
+def _trailer(contacts):
+    # fmt: off
+    return [
+        0x55, 0x0c,                                                                                                     #   UNIT_EXPONENT (-4)
+        0x66, 0x01, 0x10,                                                                                               #   UNIT (SI Lin:Time, s)
+        0x45, 0x00,                                                                                                     #   PHYSICAL_MAXIMUM (0); same as logical
+        0x27, 0xff, 0xff, 0x00, 0x00,                                                                                   #   LOGICAL_MAXIMUM (65535)
+        0x75, 0x10,                                                                                                     #   REPORT_SIZE (16)
+        0x09, 0x56,                                                                                                     #   USAGE (Scan Time)
+        0x81, 0x02,                                                                                                     #   INPUT (Data,Var,Abs); scan time in 100 us
+        0x55, 0x00,                                                                                                     #   UNIT_EXPONENT (0)
+        0x65, 0x00,                                                                                                     #   UNIT (None)
+        0x09, 0x54,                                                                                                     #   USAGE (Contact Count)
+        0x25, contacts,                                                                                                 #   LOGICAL_MAXIMUM (contacts)
+        0x75, 0x08,                                                                                                     #   REPORT_SIZE (8)
+        0x81, 0x02,                                                                                                     #   INPUT (Data,Var,Abs); contact count
+        0x05, 0x09,                                                                                                     #   USAGE_PAGE (Button)
+        0x09, 0x01,                                                                                                     #   USAGE (Button 1)
+        0x25, 0x01,                                                                                                     #   LOGICAL_MAXIMUM (1)
+        0x75, 0x01,                                                                                                     #   REPORT_SIZE (1)
+        0x81, 0x02,                                                                                                     #   INPUT (Data,Var,Abs); button bit
+        0x75, 0x07,                                                                                                     #   REPORT_SIZE (7)
+        0x81, 0x03,                                                                                                     #   INPUT (Constant); 7 bit padding
+        0x05, 0x0d,                                                                                                     #   USAGE_PAGE (Digitizer)
+    ]
+    # fmt: on
+
+
+# Class that represents a multi-touch touchpad (clickpad), e.g., for gestures
+# the host recognizes itself, such as two finger scrolling and pinching.
+# Every contact has an identifier (0 to 63) that stays the same while it
+# touches, and 12-bit X and Y (0 to 4095) over the physical size of the pad.
+# The contacts live in preallocated slots: set_contact() places or moves a
+# contact, lift() reports it once more without its tip and frees the slot.
+# Report 1 holds all contacts and is sent to hosts whose exchanged MTU fits
+# it, the device asks for that MTU. If it does not fit the default MTU of
+# 23, i.e., for more than 4 contacts, report 2 holds as many contacts as fit
+# both that MTU and the 512 bytes of the report map. It is sent to the other
+# hosts in hybrid mode: the contacts are split over several reports, of
+# which the first carries the contact count and the rest a count of 0.
+class Touchpad(HumanInterfaceDevice):
+    CONTACT_MAX = const(4095)
+
+    HIDS = (                                                                                                       # Service description: describes the service and how we communicate.
+        UUID(0x1812),                                                                                                   # 0x1812 = Human Interface Device.
+        (
+            (UUID(0x2A4A), Constants.F_READ),                                                                           # 0x2A4A = HID information, to be read by client.
+            (UUID(0x2A4B), Constants.F_READ),                                                                           # 0x2A4B = HID report map, to be read by client.
+            (UUID(0x2A4C), Constants.F_READ_WRITE_NORESPONSE),                                                          # 0x2A4C = HID control point, to be written by client.
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                   # 0x2A4D = HID report with all contacts, to be read by client after notification.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                   # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4D), Constants.F_READ_NOTIFY, (                                                                   # 0x2A4D = HID report for hybrid mode, to be read by client after notification. Dropped if not needed.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                   # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4D), Constants.F_READ, (                                                                          # 0x2A4D = HID feature report with the capabilities, to be read by client.
+                (UUID(0x2908), Constants.DSC_F_READ),                                                                   # 0x2908 = HID reference, to be read by client.
+            )),
+            (UUID(0x2A4E), Constants.F_READ_WRITE_NORESPONSE),                                                          # 0x2A4E = HID protocol mode, to be written & read by client.
+        ),
+    )
+
+    def __init__(self, name="Bluetooth Touchpad", contacts=5, width_mm=100, height_mm=60):
+        super(Touchpad, self).__init__(name)                                                                            # Set up the general HID services in super.
+        self.device_appearance = 965                                                                                    # Device appearance ID, 965 = digitizer tablet.
+
+        hybrid = 0                                                                                                      # Contacts per report in hybrid mode, 0 if all fit the default MTU.
+        if contacts * _CONTACT_SIZE + _TRAILER_SIZE > _DEFAULT_MTU - _ATT_HEADER:
+            hybrid = min((_DEFAULT_MTU - _ATT_HEADER - _TRAILER_SIZE) // _CONTACT_SIZE, (_MAP_MAX - _MAP_FIXED - _HYBRID_FIXED - contacts * _FINGER_SIZE) // _FINGER_SIZE)
+        if contacts < 1 or hybrid < 0 or (hybrid == 0 and contacts > 4):
+            raise ValueError("Touchpad supports 1 to 6 contacts")
+        self.contacts = contacts                                                                                        # Number of contact slots.
+        self.hybrid_contacts = hybrid
+
+        finger = _finger(width_mm * 10, height_mm * 10)                                                                 # Physical size in 0.1 mm.
+        contact_reports = _header(1) + finger * contacts + _trailer(contacts)
+        if hybrid:
+            contact_reports += _header(2) + finger * hybrid + _trailer(contacts)
+        else:
+            self.HIDS = (self.HIDS[0], self.HIDS[1][:4] + self.HIDS[1][5:])                                             # Without the hybrid report.
+
+        # fmt: off
+        self.HID_INPUT_REPORT = bytes([                                                                                   # Report Description: describes what we communicate.
+            0x05, 0x0d,                                                                                                 # USAGE_PAGE (Digitizer)
+            0x09, 0x05,                                                                                                 # USAGE (Touch Pad)
+            0xa1, 0x01,                                                                                                 # COLLECTION (Application)
+            0x15, 0x00,                                                                                                 #   LOGICAL_MINIMUM (0)
+            0x35, 0x00,                                                                                                 #   PHYSICAL_MINIMUM (0)
+            0x95, 0x01,                                                                                                 #   REPORT_COUNT (1)
+        ] + contact_reports + [
+            0x85, 0x03,                                                                                                 #   REPORT_ID (3)
+            0x09, 0x55,                                                                                                 #   USAGE (Contact Count Maximum)
+            0x09, 0x59,                                                                                                 #   USAGE (Pad Type)
+            0x25, 0x0f,                                                                                                 #   LOGICAL_MAXIMUM (15)
+            0x75, 0x04,                                                                                                 #   REPORT_SIZE (4)
+            0x95, 0x02,                                                                                                 #   REPORT_COUNT (2)
+            0xb1, 0x02,                                                                                                 #   FEATURE (Data,Var,Abs)
+            0xc0                                                                                                        # END_COLLECTION
+        ])
+        # fmt: on
+
+        # Define the initial contact state, one entry per slot.
+        self._ids = bytearray([_FREE] * contacts)                                                                       # Contact identifier, _FREE if the slot is unused.
+        self._tips = bytearray(contacts)                                                                                # 1 while touching, 0 to report the lift once.
+        self._confidence = bytearray(contacts)                                                                          # 0 for contacts the host should ignore, e.g., a palm.
+        self._xs = array("H", [0] * contacts)
+        self._ys = array("H", [0] * contacts)
+        self._used = bytearray(contacts)                                                                                # Slots of the contacts to report, filled by notify_hid_report().
+        self._lifted = bytearray(contacts)                                                                              # 1 for the slots to free once the frame being sent is complete.
+        self._frame = None                                                                                              # The frame being sent, see _send_frame().
+        self._changed = False                                                                                           # Did a contact or the button change since the last frame started?
+        self.button = 0                                                                                                 # The clickpad button.
+
+        self._report = bytearray(contacts * _CONTACT_SIZE + _TRAILER_SIZE)                                              # Preallocated report buffer with all contacts.
+        self._hybrid = [bytearray(hybrid * _CONTACT_SIZE + _TRAILER_SIZE) for _ in range((contacts + hybrid - 1) // hybrid)] if hybrid else None  # Preallocated report buffers of a frame in hybrid mode.
+        self.h_rep_hybrid = None
+
+        self.services.append(self.HIDS)                                                                                 # Append to list of service descriptions.
+
+    # Overwrite super to register HID specific service.
+    def start(self):
+        super(Touchpad, self).start()                                                                                   # Call super to register DIS and BAS services.
+        if self.hybrid_contacts:
+            self.configure(mtu=len(self._report) + _ATT_HEADER)                                                         # Ask for an MTU that fits all contacts in one report.
+
+        if self.log_level >= Constants.LOG_INFO:
+            print("Registering services")
+        self.register_services()                                                                                        # Register services, or reuse the registered ones, and write the characteristic values.
+        self.release_construction_data()                                                                                # Release what is only needed for registering in lean mode.
+        if self.adv is None:                                                                                            # Restarts reuse the advertiser and its payload.
+            from lib.hidservices.advertiser import Advertiser                                                           # Imported on first start.
+            self.adv = Advertiser(self._ble, [UUID(0x1812)], self.device_appearance, self.device_name, self.log_level)                  # Create an Advertiser. Only advertise the top level service, i.e., the HIDS.
+
+        if self.log_level >= Constants.LOG_INFO:
+            print("Server started")
+
+    # Overwrite super to save HID specific characteristics.
+    def save_service_characteristics(self, handles):
+        super(Touchpad, self).save_service_characteristics(handles)                                                     # Call super to write DIS and BAS characteristics.
+        h = handles[3]                                                                                                  # Get the handles for the HIDS characteristics. These correspond directly to self.HIDS, set_tunables() may add one more. Position 3 because of the order of self.services.
+        (h_info, h_hid, h_ctrl, self.h_rep, h_d1) = h[:5]
+        if self.hybrid_contacts:
+            (self.h_rep_hybrid, h_d2) = h[5:7]
+            h = h[2:]
+        (h_caps, h_d3, h_proto) = h[5:8]
+
+        if self.log_level >= Constants.LOG_DEBUG:
+            print("Saving HID service characteristics")
+        self.characteristics[h_info] = ("HID information", b"\x01\x01\x00\x00")                                         # HID info: ver=1.1, country=0, flags=000000cw with c=normally connectable w=wake up signal
+        self.characteristics[h_hid] = ("HID input report map", self.HID_INPUT_REPORT)                                   # HID input report map.
+        self.characteristics[h_ctrl] = ("HID control point", b"\x00")                                                   # HID control point.
+        self.characteristics[self.h_rep] = ("HID report", bytes(self._report))                                          # HID report with all contacts.
+        self.characteristics[h_d1] = ("HID reference", struct.pack("<BB", 1, 1))                                        # HID reference: id=1, type=input.
+        if self.hybrid_contacts:
+            self.characteristics[self.h_rep_hybrid] = ("HID hybrid report", bytes(self._hybrid[0]))                     # HID report for hybrid mode.
+            self.characteristics[h_d2] = ("HID hybrid reference", struct.pack("<BB", 2, 1))                             # HID reference: id=2, type=input.
+        self.characteristics[h_caps] = ("HID capabilities", struct.pack("<B", self.contacts))                           # Contact count maximum, pad type 0 = clickpad.
+        self.characteristics[h_d3] = ("HID capabilities reference", struct.pack("<BB", 3, 3))                           # HID reference: id=3, type=feature.
+        self.characteristics[h_proto] = ("HID protocol mode", b"\x01")                                                  # HID protocol mode: report.
+
+    # Pack count contacts, from slot index start of the used slots, and the
+    # trailer into a report buffer. Unused contact fields are cleared.
+    def _pack(self, report, slots, start, count, contact_count, scan_time):
+        used = self._used
+        ids = self._ids
+        tips = self._tips
+        confidence = self._confidence
+        xs = self._xs
+        ys = self._ys
+        o = 0
+        for i in range(slots):
+            if i < count:
+                s = used[start + i]
+                x = xs[s]
+                y = ys[s]
+                report[o] = tips[s] | (confidence[s] << 1) | (ids[s] << 2)
+                report[o + 1] = x & 0xFF
+                report[o + 2] = (x >> 8) | ((y & 0x0F) << 4)
+                report[o + 3] = y >> 4
+            else:
+                report[o] = report[o + 1] = report[o + 2] = report[o + 3] = 0
+            o += _CONTACT_SIZE
+        struct.pack_into("<HBB", report, o, scan_time, contact_count, self.button)
+
+    # Overwrite super to notify central of a hid report.
+    # Hosts whose MTU fits all contacts get a single report, the others get
+    # the contacts split over hybrid reports. Lifted contacts are reported
+    # once with their tip cleared, then their slots are freed. Returns False
+    # if the stack is out of buffers: the frame is kept and the next call
+    # sends the rest of it first, then a new frame if a contact or the
+    # button changed meanwhile.
+    def notify_hid_report(self):
+        if self.power is not None:
+            self.power.activity()                                                                                       # Input, see set_power_policy().
+        if self._frame is not None:
+            if not self._resume():
+                return False
+            if not self._changed:                                                                                       # The frame that went out is the current state.
+                return True
+        if not self.is_connected():
+            return True
+        self._changed = False
+
+        used = self._used
+        ids = self._ids
+        tips = self._tips
+        lifted = self._lifted
+        n = 0
+        for s in range(self.contacts):
+            if ids[s] != _FREE:
+                used[n] = s
+                n += 1
+            lifted[s] = 1 if ids[s] != _FREE and not tips[s] else 0                                                     # Lifted before this frame, a contact lifted while it is sent is freed after the next one.
+        self._frame = self._send_frame(n, (time.ticks_us() // 100) & 0xFFFF)                                            # Scan time in units of 100 us, wraps.
+        return self._resume()
+
+    # Go on with the frame being sent. Returns whether every connection has it.
+    def _resume(self):
+        try:
+            next(self._frame)
+        except StopIteration:
+            self._frame = None
+            return True
+        return False
+
+    # Send a frame of n contacts, like HumanInterfaceDevice._push_report():
+    # the reports are packed first, so every connection gets the same frame.
+    # While the stack is out of buffers it yields False, and a connection
+    # goes on with the first report it did not take, so none gets a report
+    # twice. The slots lifted before the frame are freed once it is complete.
+    def _send_frame(self, n, scan_time):
+        report = self._report
+        self._pack(report, self.contacts, 0, n, n, scan_time)
+        hybrid = self._hybrid
+        parts = 0                                                                                                       # Hybrid reports of the frame, at least one, also without contacts.
+        if hybrid is not None:
+            per_report = self.hybrid_contacts
+            start = 0
+            while parts == 0 or start < n:
+                count = min(per_report, n - start)
+                self._pack(hybrid[parts], per_report, start, count, n if start == 0 else 0, scan_time)
+                start += count
+                parts += 1
+        sent = {}                                                                                                       # Reports of the frame each connection took.
+        while True:
+            try:
+                for conn_handle, connection in tuple(self.connections.items()):                                         # A copy, the IRQ handler may add or remove connections meanwhile.
+                    if not self._wants_report(connection, self.h_rep):
+                        continue
+                    i = sent.get(conn_handle, 0)
+                    if hybrid is None or connection.mtu - _ATT_HEADER >= len(report):
+                        if i == 0:
+                            self.transport.notify(conn_handle, self.h_rep, report)
+                            sent[conn_handle] = 1
+                    else:
+                        while i < parts:
+                            self.transport.notify(conn_handle, self.h_rep_hybrid, hybrid[i])
+                            i += 1
+                            sent[conn_handle] = i
+                break
+            except OSError as e:
+                if e.args[0] != errno.ENOMEM:
+                    raise
+                yield False
+
+        ids = self._ids
+        tips = self._tips
+        lifted = self._lifted
+        for s in range(self.contacts):                                                                                  # Free the slots of lifted contacts.
+            if lifted[s] and not tips[s]:
+                ids[s] = _FREE
+
+    # Place contact contact_id (0 to 63) at (x, y), both 0 to 4095, or move
+    # it there. A contact with confidence=False is reported for the host to
+    # ignore, e.g., a palm. Returns False if all slots are in use.
+    def set_contact(self, contact_id, x, y, confidence=True):
+        contact_id &= 0x3F
+        ids = self._ids
+        slot = -1
+        for s in range(self.contacts):
+            if ids[s] == contact_id:
+                slot = s
+                break
+            if slot < 0 and ids[s] == _FREE:
+                slot = s
+        if slot < 0:
+            return False
+        ids[slot] = contact_id
+        self._changed = True
+        self._tips[slot] = 1
+        self._confidence[slot] = 1 if confidence else 0
+        self._xs[slot] = 0 if x < 0 else (Touchpad.CONTACT_MAX if x > Touchpad.CONTACT_MAX else x)
+        self._ys[slot] = 0 if y < 0 else (Touchpad.CONTACT_MAX if y > Touchpad.CONTACT_MAX else y)
+        return True
+
+    # Lift contact contact_id. It is reported once more, without its tip.
+    def lift(self, contact_id):
+        contact_id &= 0x3F
+        ids = self._ids
+        for s in range(self.contacts):
+            if ids[s] == contact_id:
+                self._tips[s] = 0
+                self._changed = True
+                return
+
+    # Lift all contacts.
+    def lift_all(self):
+        for s in range(self.contacts):
+            self._tips[s] = 0
+        self._changed = True
+
+    # Returns the number of contacts touching.
+    def get_contact_count(self):
+        n = 0
+        for s in range(self.contacts):
+            if self._ids[s] != _FREE and self._tips[s]:
+                n += 1
+        return n
+
+    # Set the clickpad button value.
+    def set_button(self, b=0):
+        self.button = 1 if b else 0
+        self._changed = True
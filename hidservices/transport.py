@@ -0,0 +1,106 @@
+from micropython import const
+import struct
+
+# Frame layout of the stream transport: sync byte, connection handle,
+# characteristic value handle and payload length, followed by the payload.
+FRAME_SYNC = const(0xA5)
+FRAME_HEADER = "<BHHH"
+FRAME_HEADER_SIZE = const(7)
+
+LOCAL_CONN_HANDLE = const(0xFFFF)                                                                                       # Connection handle of a local, non radio consumer.
+
+# Transport sending reports over the BLE radio. This is the default transport
+# of every HumanInterfaceDevice.
+class BLETransport:
+    def __init__(self, ble):
+        self._ble = ble
+
+    # Send a value of a characteristic to a connection.
+    def notify(self, conn_handle, value_handle, data):
+        self._ble.gatts_notify(conn_handle, value_handle, data)
+
+    def close(self):
+        pass
+
+
+# Transport writing framed reports to a stream, e.g., a pipe, a file or a
+# UNIX socket, so a host process can consume them at full speed. Used for
+# load-testing the report path and running devices without a radio.
+class StreamTransport:
+    def __init__(self, stream, max_payload=512):
+        self._stream = stream                                                                                           # Any object with write(), e.g., an open FIFO or a socket.
+        self._frame = bytearray(FRAME_HEADER_SIZE + max_payload)                                                        # Preallocated frame buffer.
+        self._view = memoryview(self._frame)
+        self.frames = 0                                                                                                 # Number of frames written.
+
+    # Open a named pipe (FIFO) for writing.
+    @staticmethod
+    def open_pipe(path, max_payload=512):
+        return StreamTransport(open(path, "wb"), max_payload)
+
+    # Connect to a listening UNIX stream socket.
+    @staticmethod
+    def connect_unix(path, max_payload=512):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return StreamTransport(sock.makefile("wb", 0), max_payload)
+
+    # Write a value of a characteristic as one frame.
+    def notify(self, conn_handle, value_handle, data):
+        n = len(data)
+        struct.pack_into(FRAME_HEADER, self._frame, 0, FRAME_SYNC, conn_handle, value_handle, n)
+        self._view[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + n] = data
+        self._stream.write(self._view[:FRAME_HEADER_SIZE + n])
+        self.frames += 1
+
+    def close(self):
+        self._stream.close()
+
+    # Make the device send its reports through this transport, as if a
+    # secured central with LOCAL_CONN_HANDLE were connected.
+    def attach(self, device, conn_handle=LOCAL_CONN_HANDLE):
+        from lib.hid_services import Connection, HumanInterfaceDevice
+        connection = Connection(conn_handle, 0, b"local")
+        connection.encrypted = True
+        connection.authenticated = True
+        connection.bonded = True
+        connection.key_size = 16
+        device.set_transport(self)
+        device.connections[conn_handle] = connection
+        device.conn_handle = conn_handle
+        device.set_state(HumanInterfaceDevice.DEVICE_CONNECTED)
+
+    # Remove the local connection again.
+    def detach(self, device, conn_handle=LOCAL_CONN_HANDLE):
+        from lib.hid_services import HumanInterfaceDevice
+        if conn_handle in device.connections:
+            del device.connections[conn_handle]
+        if not device.connections:
+            device.conn_handle = None
+            device.set_state(HumanInterfaceDevice.DEVICE_IDLE)
+
+
+# Read exactly n bytes from a stream, or fewer if it ends.
+def _read_exact(stream, n):
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+# Read frames written by a StreamTransport, e.g., on the Linux host side.
+# The stream must be file-like, use sock.makefile("rb") for sockets.
+# Yields (conn_handle, value_handle, payload) tuples until the stream ends.
+def read_frames(stream):
+    while True:
+        header = _read_exact(stream, FRAME_HEADER_SIZE)
+        if len(header) < FRAME_HEADER_SIZE:
+            return
+        sync, conn_handle, value_handle, n = struct.unpack(FRAME_HEADER, header)
+        if sync != FRAME_SYNC:
+            raise ValueError("Lost frame sync")
+        yield conn_handle, value_handle, _read_exact(stream, n)
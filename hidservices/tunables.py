@@ -0,0 +1,154 @@
+from micropython import const
+from bluetooth import UUID
+from lib.hidservices.constants import Constants
+import struct
+
+TUNABLES_REPORT_ID = const(0xF0)                                                                                        # Report ID of the vendor feature report.
+TUNABLES_VERSION = const(1)
+
+_FORMAT = "<BHBHBB"                                                                                                     # Version, report rate, coalescing window, DPI scale, debounce time, log level.
+_SIZE = const(8)
+
+# Characteristic of the feature report, appended to the HIDS of a device, see
+# HumanInterfaceDevice.set_tunables().
+CHARACTERISTIC = (
+    UUID(0x2A4D), Constants.F_READ_WRITE, (                                                                             # 0x2A4D = HID report, to be read and written by client.
+        (UUID(0x2908), Constants.DSC_F_READ),                                                                           # 0x2908 = HID reference, to be read by client.
+    ),
+)
+
+# fmt: off
+REPORT_MAP = bytes([                                                                                                    # Report description of the feature report, appended to the report map.
+    0x06, 0x00, 0xFF,                                                                                                   # USAGE_PAGE (Vendor Defined 0xFF00)
+    0x09, 0x01,                                                                                                         # USAGE (Vendor Usage 1)
+    0xa1, 0x01,                                                                                                         # COLLECTION (Application)
+    0x85, TUNABLES_REPORT_ID,                                                                                           #   REPORT_ID (240)
+    0x09, 0x02,                                                                                                         #   USAGE (Vendor Usage 2)
+    0x15, 0x00,                                                                                                         #   LOGICAL_MINIMUM (0)
+    0x26, 0xFF, 0x00,                                                                                                   #   LOGICAL_MAXIMUM (255)
+    0x75, 0x08,                                                                                                         #   REPORT_SIZE (8)
+    0x95, _SIZE,                                                                                                        #   REPORT_COUNT (8)
+    0xb1, 0x02,                                                                                                         #   FEATURE (Data, Variable, Absolute)
+    0xc0                                                                                                                # END_COLLECTION
+])
+# fmt: on
+
+
+# Class that holds the performance knobs a host can read and write through a
+# vendor defined HID feature report, see HumanInterfaceDevice.set_tunables().
+# The report is 8 bytes: version, report rate (samples per second, 16 bit),
+# coalescing window (ms), mouse DPI scale (percent, 16 bit), debounce time
+# (ms) and log level. Written values are validated, and applied outside the
+# BLE IRQ to the attached targets: the device's mouse acceleration, its power
+# policy, an InputPipeline and a ThreadedInput. The report rate is the fast
+# rate of a power policy, which keeps choosing the rate of its pipeline.
+# The log level is the level up to which the device prints, see
+# HumanInterfaceDevice.set_log_level(). A callback gets all values. With a
+# path, the values are loaded on creation and saved after every accepted
+# write, as the packed report.
+class Tunables:
+    # (minimum, maximum) per value after the version.
+    RANGES = ((1, 1000), (0, 250), (10, 1000), (0, 250), (0, 4))
+
+    def __init__(self, report_rate=100, coalesce_ms=0, dpi_scale=100, debounce_ms=30, log_level=1, path=None):
+        self.report_rate = report_rate                                                                                  # Samples per second of the pipeline, fast rate of the power policy.
+        self.coalesce_ms = coalesce_ms                                                                                  # Window in which threaded input moves are merged.
+        self.dpi_scale = dpi_scale                                                                                      # Mouse motion scale in percent.
+        self.debounce_ms = debounce_ms                                                                                  # Time a button must be stable to change.
+        self.log_level = log_level                                                                                      # Constants.LOG_QUIET (0) to LOG_VERBOSE (4), the device's log level.
+        self.path = path                                                                                                # Config file, None to not persist.
+
+        self.device = None                                                                                              # Set by HumanInterfaceDevice.set_tunables().
+        self.pipeline = None                                                                                            # Optional InputPipeline to tune.
+        self.threaded = None                                                                                            # Optional ThreadedInput to tune.
+        self.callback = None                                                                                            # Called with this object after every change.
+        self.writes = 0                                                                                                 # Number of accepted writes.
+        self.rejected = 0                                                                                               # Number of refused writes.
+
+        if path is not None:
+            self.load()
+
+    # Set an InputPipeline whose rate and debounce follow the values.
+    def set_pipeline(self, pipeline):
+        self.pipeline = pipeline
+
+    # Set a ThreadedInput whose coalescing window follows the values.
+    def set_threaded(self, threaded):
+        self.threaded = threaded
+
+    # Set a callback function that gets this object after every change.
+    def set_callback(self, callback):
+        self.callback = callback
+
+    # Returns the values as the feature report.
+    def pack(self):
+        return struct.pack(_FORMAT, TUNABLES_VERSION, self.report_rate, self.coalesce_ms, self.dpi_scale, self.debounce_ms, self.log_level)
+
+    # Returns the values of a feature report, or None if it is not valid.
+    def validate(self, report):
+        if len(report) != _SIZE:
+            return None
+        values = struct.unpack(_FORMAT, report)
+        if values[0] != TUNABLES_VERSION:
+            return None
+        for value, (low, high) in zip(values[1:], self.RANGES):
+            if value < low or value > high:
+                return None
+        return values[1:]
+
+    # Take the values of a feature report. Returns whether it was valid.
+    def write(self, report):
+        values = self.validate(report)
+        if values is None:
+            self.rejected += 1
+            return False
+        (self.report_rate, self.coalesce_ms, self.dpi_scale, self.debounce_ms, self.log_level) = values
+        self.writes += 1
+        return True
+
+    # Apply the values to the attached targets, without restarting anything.
+    def apply(self):
+        device = self.device
+        if device is not None:
+            device.set_log_level(self.log_level)
+            if hasattr(device, "set_acceleration"):                                                                     # Mouse.
+                accel = device.acceleration
+                if accel is not None:
+                    device.set_acceleration(accel.curve, self.dpi_scale / 100)
+                elif self.dpi_scale != 100:
+                    from lib.hidservices.pointer import FLAT
+                    device.set_acceleration(FLAT, self.dpi_scale / 100)
+            if device.power is not None:
+                device.power.fast_rate = self.report_rate
+                if device.power.pipeline is not None:
+                    device.power.set_pipeline(device.power.pipeline)                                                    # The rate for the current state, the new fast rate when active.
+        if self.pipeline is not None:
+            power = device.power if device is not None else None
+            if power is None or power.pipeline is not self.pipeline:
+                self.pipeline.set_rate(self.report_rate)                                                                # Else the power policy picks the fast or slow rate.
+            self.pipeline.debounce = max(1, self.debounce_ms * self.report_rate // 1000)                                # In samples.
+        if self.threaded is not None:
+            self.threaded.window_ms = self.coalesce_ms
+        if self.callback is not None:
+            self.callback(self)
+
+    # Load the values from the config file, keeping the defaults if it is missing or invalid.
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                values = self.validate(file.read())
+            if values is not None:
+                (self.report_rate, self.coalesce_ms, self.dpi_scale, self.debounce_ms, self.log_level) = values
+        except OSError:
+            pass
+
+    # Save the values to the config file.
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "wb") as file:
+                file.write(self.pack())
+        except OSError:
+            if self.device is None or self.device.log_level >= Constants.LOG_ERROR:
+                print("Failed to save tunables")
@@ -0,0 +1,192 @@
+from micropython import const
+from array import array
+import errno
+import time
+
+_SLOTS = const(6)                                                                                                       # Keys in a keyboard report.
+_FIRST_KEY = const(0x04)                                                                                                # Usages below are no key or error codes, e.g., the rollover error, and never repeat.
+_JITTER_SAMPLES = const(32)                                                                                             # Repeat latenesses kept for jitter().
+
+
+# Milliseconds between repeats, from a rate of 1 to 1000 repeats per second.
+def _interval(rate):
+    if rate < 1 or rate > 1000:
+        raise ValueError("Rate must be 1 to 1000 repeats per second")
+    return 1000 // rate
+
+
+# Class that auto-repeats held keys of a Keyboard on the device.
+# The keys are held by the Keyboard itself, see Keyboard.press(), and the
+# repeats follow its committed report: a key repeats from the slot it has
+# there, and while more than six keys are held the report shows the
+# rollover error and nothing repeats. Keys pressed on the Keyboard directly
+# repeat too, from the next tick after their report is committed.
+# A single periodic timer checks every held key against its own repeat time.
+# A repeat is sent as a report without the key, packed into a preallocated
+# buffer, followed by the report with the keys. Modifiers never repeat
+# unless repeat_modifiers is set.
+# When the stack is out of buffers (ENOMEM), the report is retried on the
+# next tick to the connections that did not take it yet, a repeat first,
+# then the report with the held keys.
+class Typematic:
+    def __init__(self, keyboard, delay=500, rate=30, period=5, timer=None, repeat_modifiers=False, clock=None):
+        self._keyboard = keyboard                                                                                       # The Keyboard to send reports from.
+        self.delay = delay                                                                                              # Milliseconds before a held key starts repeating.
+        self.interval = _interval(rate)                                                                                 # Milliseconds between repeats, from the rate in repeats per second.
+        self.period = period                                                                                            # Timer period in milliseconds.
+        self._timer = timer                                                                                             # A machine.Timer, created on start() if None.
+        self.repeat_modifiers = repeat_modifiers                                                                        # Repeat modifier keys (0xE0-0xE7) too?
+        self._clock = clock if clock is not None else time.ticks_ms                                                     # Millisecond tick source.
+
+        self._up = bytearray(8)                                                                                         # Report with the repeating key released.
+        self._keys = bytearray(_SLOTS)                                                                                  # The key of each slot of the keyboard report when last seen.
+        self._modifiers = 0                                                                                             # The modifiers of the keyboard report when last seen.
+        self._due = array("i", [0] * (_SLOTS + 1))                                                                      # Tick of the next repeat per key slot, the last one for the modifiers.
+        self._sent = []                                                                                                 # Connection handles that took the report being sent.
+
+        self._late = array("H", [0] * _JITTER_SAMPLES)                                                                  # Ring of repeat latenesses in milliseconds.
+        self._late_index = 0
+        self._pending = False                                                                                           # Is the report with the held keys still to be sent?
+        self.repeats = 0                                                                                                # Number of repeats sent.
+
+    # Start the repeat timer.
+    def start(self):
+        if self._timer is None:
+            from machine import Timer
+            self._timer = Timer(-1)
+        self._timer.init(period=self.period, mode=self._timer.PERIODIC, callback=self._tick)
+
+    # Stop the repeat timer.
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+
+    # Set the repeat delay in milliseconds and rate in repeats per second,
+    # 1 to 1000.
+    def set_typematic(self, delay=500, rate=30):
+        self.interval = _interval(rate)
+        self.delay = delay
+
+    # Notify a report to the connections that did not take it yet, like
+    # HumanInterfaceDevice._push_report(). Returns False if the stack is out
+    # of buffers, to retry the same report on the next tick.
+    def _notify(self, report):
+        keyboard = self._keyboard
+        sent = self._sent
+        if keyboard.is_connected():
+            try:
+                for conn_handle, connection in tuple(keyboard.connections.items()):
+                    if conn_handle not in sent and keyboard._wants_report(connection, keyboard.h_rep):
+                        keyboard.transport.notify(conn_handle, keyboard.h_rep, report)
+                        sent.append(conn_handle)
+            except OSError as e:
+                if e.args[0] != errno.ENOMEM:
+                    raise
+                return False
+        del sent[:]
+        return True
+
+    # Send the report with the held keys, or leave it pending for the next
+    # tick if the stack is out of buffers. Returns whether it was sent.
+    def _notify_down(self):
+        self._pending = not self._notify(self._keyboard._state.front)
+        return not self._pending
+
+    # Follow the committed keyboard report: a key new in its slot, or a
+    # modifier newly pressed, starts its repeat delay.
+    def _sync(self, now):
+        front = self._keyboard._state.front
+        keys = self._keys
+        for i in range(_SLOTS):
+            usage = front[2 + i]
+            if usage != keys[i]:
+                keys[i] = usage
+                self._due[i] = time.ticks_add(now, self.delay)
+        modifiers = front[0]
+        if modifiers & ~self._modifiers:
+            self._due[_SLOTS] = time.ticks_add(now, self.delay)
+        self._modifiers = modifiers
+
+    # Commit the keyboard state and send it to every connection.
+    def _send_state(self):
+        self._keyboard.commit()
+        self._sync(self._clock())
+        del self._sent[:]                                                                                               # A new report, a partly sent one is replaced.
+        self._notify_down()
+
+    # Press a key and notify the central. The key starts repeating after the delay.
+    def press(self, usage):
+        self._keyboard.press(usage)
+        self._send_state()
+
+    # Release a key and notify the central.
+    def release(self, usage):
+        self._keyboard.release(usage)
+        self._send_state()
+
+    # Release all keys and notify the central.
+    def release_all(self):
+        self._keyboard.release_all()
+        self._send_state()
+
+    # Send a repeat of the key in slot i. Returns False if the stack is out
+    # of buffers before the repeat went to every connection, to retry on
+    # the next tick.
+    def _repeat(self, i, now):
+        front = self._keyboard._state.front
+        up = self._up
+        for j in range(8):
+            up[j] = front[j]
+        if i == _SLOTS:                                                                                                 # Repeat modifiers by releasing them all.
+            up[0] = 0
+        else:
+            up[2 + i] = 0
+        if not self._notify(up):
+            return False
+        self._notify_down()                                                                                             # If out of buffers, the next tick sends it.
+
+        late = time.ticks_diff(now, self._due[i])
+        self._late[self._late_index] = late if late < 0xFFFF else 0xFFFF
+        self._late_index = (self._late_index + 1) % _JITTER_SAMPLES
+        self.repeats += 1
+        return True
+
+    # Timer callback: repeat every held key whose repeat time has passed.
+    # Can be called directly instead of using the timer.
+    def _tick(self, _timer=None):
+        if self._pending and not self._notify_down():
+            return
+        now = self._clock()
+        self._sync(now)
+        keys = self._keys
+        due = self._due
+        for i in range(_SLOTS + 1):
+            if i < _SLOTS:
+                held = keys[i] >= _FIRST_KEY
+            else:
+                held = self._modifiers and self.repeat_modifiers
+            if held and time.ticks_diff(now, due[i]) >= 0:
+                if not self._repeat(i, now):
+                    return                                                                                              # Out of buffers, retry on the next tick.
+                due[i] = time.ticks_add(due[i], self.interval)
+                if time.ticks_diff(now, due[i]) >= 0:                                                                   # Skip missed repeats instead of bursting.
+                    due[i] = time.ticks_add(now, self.interval)
+                if self._pending:
+                    return                                                                                              # The held keys go out first on the next tick.
+
+    poll = _tick
+
+    # Returns the (maximum, mean) lateness in milliseconds of the last repeats,
+    # i.e., the repeat timing jitter.
+    def jitter(self):
+        n = self.repeats if self.repeats < _JITTER_SAMPLES else _JITTER_SAMPLES
+        if n == 0:
+            return (0, 0)
+        worst = 0
+        total = 0
+        for i in range(n):
+            late = self._late[i]
+            total += late
+            if late > worst:
+                worst = late
+        return (worst, total // n)
@@ -0,0 +1,96 @@
+# Measure switch_host() against the emulated radio: a Keyboard bonds with
+# two hosts in their own host slots, then switches back and forth between
+# them. Every switch disconnects the current host, advertises, and the
+# other host reconnects bonded, scanning 30 ms every 150 ms (see
+# Central.scan()), and gets a report. Prints switch-to-advertise, the
+# device's own switch_latency (switch-to-connected) and switch-to-first-
+# report, averaged over the phases of the host's scan. Checks that every
+# host reconnects with the bond of its own slot, and that the last peers
+# are saved to keys.json outside the IRQ. Runs on the host with CPython:
+#   python tools/emulate_host_switch.py [device]
+# e.g., python tools/emulate_host_switch.py Mouse
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+import lib.hidservices
+
+_SLOTS = ("desk", "laptop")
+_SCAN_WINDOW_MS = 30                                                                                                    # Background scan of the hosts.
+_SCAN_INTERVAL_MS = 150
+_PHASE_STEP_MS = 5
+
+
+# Switch the device to slot, let its host reconnect with its scan at
+# phase_ms, and send a report. Returns the microseconds from switch_host()
+# to advertising, the device's switch_latency in milliseconds, and the
+# microseconds to the delivery of the report.
+def switch(device, hosts, slot, phase_ms):
+    ble = bluetooth.BLE()
+    central = hosts[slot]
+    central.clear()
+    start = clock.now_us
+    device.switch_host(slot)
+    assert central.scan(_SCAN_WINDOW_MS, _SCAN_INTERVAL_MS, phase_ms) is not None, "host did not reconnect"
+    advertise_us = ble.advertising_since_us - start                                                                     # The last advertising start, the one the host heard.
+    assert device.get_host_slot() == slot and device.get_connection().bonded, "host did not reconnect bonded"
+    assert len(ble.links) == 1, "old host still connected"
+    central.subscribe(device.h_rep)
+    device.notify_hid_report()
+    while not central.received:
+        clock.run_for_ms(1)
+    return advertise_us, device.switch_latency, central.received[0][3] - start
+
+
+def run(name="Keyboard"):
+    global clock
+    clock = host.reset()
+    device = getattr(lib.hidservices, name)()
+    device.start()
+
+    hosts = {}
+    for n, slot in enumerate(_SLOTS):                                                                                   # Bond each host in its own slot.
+        device.switch_host(slot)
+        clock.run_for_ms(10)
+        hosts[slot] = Central(addr=bytes([0xC0, 0xFF, 0xEE, 0x00, 0x00, n + 1]))
+        hosts[slot].connect()
+        hosts[slot].pair()
+    assert all(device.get_host_peer(slot) is not None for slot in _SLOTS), "host slots without a peer"
+    clock.run_for_ms(10)                                                                                                # The peers are saved from micropython.schedule.
+    with open("keys.json") as file:
+        slots = json.load(file)["slots"]
+    assert all(slots[slot]["peer"] is not None for slot in _SLOTS), "last peers not saved"
+
+    advertise = []
+    connected = []
+    first_report = []
+    n = 0
+    for phase in range(0, _SCAN_INTERVAL_MS, _PHASE_STEP_MS):
+        for _ in _SLOTS:
+            n += 1
+            advertise_us, latency_ms, report_us = switch(device, hosts, _SLOTS[n % len(_SLOTS)], phase)
+            advertise.append(advertise_us)
+            connected.append(latency_ms)
+            first_report.append(report_us)
+    device.stop()
+
+    _print("%s, %d switches between %d hosts" % (name, len(connected), len(_SLOTS)))
+    _print("switch-to-advertise     avg %8.2f ms max %8.2f ms" % (sum(advertise) / len(advertise) / 1000.0, max(advertise) / 1000.0))
+    _print("switch-to-connected     avg %8.2f ms max %8d ms   (switch_latency)" % (sum(connected) / len(connected), max(connected)))
+    _print("switch-to-first-report  avg %8.2f ms max %8.2f ms" % (sum(first_report) / len(first_report) / 1000.0, max(first_report) / 1000.0))
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else "Keyboard")
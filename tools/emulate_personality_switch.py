@@ -0,0 +1,92 @@
+# Measure cold start, restart and personality switch latency against the
+# emulated radio, see tools/emulator and BLE.cost_us there. Also checks
+# that a stop, also while connected and advertising for more centrals,
+# leaves the radio silent, that after a switch the radio advertises the
+# new personality only, and that a switch with hosts connected registers
+# the services only once the radio dropped the links, the emulated radio
+# refuses it before (EBUSY) like the stack. Runs on the host with CPython:
+#   python tools/emulate_personality_switch.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+from lib.hidservices.mouse import Mouse
+from lib.hidservices.gamepad import Gamepad
+from lib.hidservices.keyboard import Keyboard
+
+_CALLS = ("active", "config", "register", "write", "advertise")
+
+
+def measure(name, action):
+    ble = bluetooth.BLE()
+    before = dict(ble.stats)
+    start = clock.now_us
+    action()
+    calls = ", ".join("%s %d" % (call, ble.stats[call] - before[call]) for call in _CALLS)
+    _print("%-26s %8.2f ms   %s" % (name, (clock.now_us - start) / 1000.0, calls))
+
+
+def run():
+    global clock
+    clock = host.reset()
+    ble = bluetooth.BLE()
+    mouse = Mouse("Emulated Mouse")
+    gamepad = Gamepad("Emulated Gamepad")
+    keyboard = Keyboard("Emulated Keyboard")
+
+    def start(device):
+        device.start()
+        device.start_advertising()
+
+    def restart(device, power_off):
+        device.stop(power_off)
+        assert bluetooth.BLE().advertising is None, "radio still advertising after stop()"
+        start(device)
+
+    def switch(device, other):                                                                                          # Until the other device advertises, it may wait for the links to go.
+        device.switch_personality(other)
+        for _ in range(100):
+            if other.is_advertising():
+                return
+            clock.run_for_ms(1)
+        raise AssertionError("switch did not complete")
+
+    def check_advertising(device):
+        advertising = bluetooth.BLE().advertising
+        assert advertising is not None and advertising[1] == device.adv._payload, "radio not advertising the new personality"
+
+    measure("cold start", lambda: start(mouse))
+    measure("restart", lambda: restart(mouse, True))
+    measure("warm restart", lambda: restart(mouse, False))
+    measure("mouse -> gamepad", lambda: mouse.switch_personality(gamepad))                                              # Same layout, only the values that differ are written.
+    check_advertising(gamepad)
+    measure("gamepad -> keyboard", lambda: gamepad.switch_personality(keyboard))                                        # Other layout, the services are registered again.
+    check_advertising(keyboard)
+    measure("keyboard -> mouse", lambda: keyboard.switch_personality(mouse))
+    check_advertising(mouse)
+
+    mouse.set_max_connections(2)                                                                                        # Connected, still advertising for a second host.
+    Central().connect()
+    measure("connected warm restart", lambda: restart(mouse, False))
+    Central(addr=b"\xc0\xff\xee\x00\x00\x02").connect()
+    measure("connected mouse -> gamepad", lambda: switch(mouse, gamepad))                                               # Same layout, nothing registered.
+    check_advertising(gamepad)
+    Central(addr=b"\xc0\xff\xee\x00\x00\x03").connect()
+    measure("connected gamepad -> kb", lambda: switch(gamepad, keyboard))                                               # Other layout, registered once the host is gone.
+    check_advertising(keyboard)
+    assert keyboard.personality_latency is not None and not ble.links, "hosts still connected"
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,86 @@
+# Check the activity-based power policy (hidservices/power.py) against the
+# emulated radio: a Mouse serving two hosts goes slow, drops its hosts and
+# stops advertising while idle, then wakes up on input. Checks that the
+# radio itself stopped advertising in POWER_SLEEP, not only the device
+# state, and that it advertises again on the first new input. Runs on the
+# host with CPython:
+#   python tools/emulate_power.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+from lib.hid_services import HumanInterfaceDevice
+from lib.hidservices.mouse import Mouse
+from lib.hidservices.power import PowerPolicy, POWER_ACTIVE, POWER_SLOW, POWER_SLEEP
+
+_STATES = {POWER_ACTIVE: "active", POWER_SLOW: "slow", POWER_SLEEP: "sleep"}
+
+
+def report(name, mouse, policy):
+    ble = bluetooth.BLE()
+    _print("%-28s policy %-6s device state %d, radio %s, %d hosts"
+           % (name, _STATES[policy.state], mouse.get_state(), "advertising" if ble.advertising else "silent", len(ble.links)))
+
+
+def run(slow_after=2000, disconnect_after=10000, stop_advertising_after=5000):
+    clock = host.reset()
+    ble = bluetooth.BLE()
+    mouse = Mouse("Emulated Mouse")
+    mouse.set_max_connections(2)
+    policy = PowerPolicy(mouse, slow_after=slow_after, disconnect_after=disconnect_after, stop_advertising_after=stop_advertising_after)
+    mouse.set_power_policy(policy)
+    mouse.start()
+    mouse.start_advertising()
+    policy.start(period_ms=100)
+
+    Central(addr=b"\xc0\xff\xee\x00\x00\x01").connect()                                                                 # The mouse keeps advertising for the second host.
+    mouse.set_axes(1, 1)
+    mouse.notify_hid_report()
+    report("one of two hosts", mouse, policy)
+    assert ble.advertising is not None, "not advertising for the second host"
+
+    clock.run_for_ms(slow_after + 200)
+    report("idle", mouse, policy)
+    assert policy.state is POWER_SLOW, "not slowed down"
+
+    clock.run_for_ms(disconnect_after - slow_after)
+    report("hosts dropped", mouse, policy)
+    assert policy.state is POWER_SLEEP, "not asleep"
+    assert not ble.links, "hosts still connected"
+    assert mouse.get_state() is HumanInterfaceDevice.DEVICE_IDLE, "device not idle"
+    assert ble.advertising is None, "radio still advertising after dropping the hosts"
+
+    mouse.set_axes(1, 1)
+    mouse.notify_hid_report()                                                                                           # Input wakes the device, it advertises for the host.
+    report("woken by input", mouse, policy)
+    assert policy.state is POWER_ACTIVE and mouse.is_advertising(), "not advertising after input"
+    assert ble.advertising is not None, "radio not advertising after input"
+
+    clock.run_for_ms(stop_advertising_after + 200)
+    report("no host came back", mouse, policy)
+    assert policy.state is POWER_SLEEP, "not asleep"
+    assert mouse.get_state() is HumanInterfaceDevice.DEVICE_IDLE, "device not idle"
+    assert ble.advertising is None, "radio still advertising in POWER_SLEEP"
+
+    mouse.set_axes(1, 1)
+    mouse.notify_hid_report()
+    Central(addr=b"\xc0\xff\xee\x00\x00\x02").connect()
+    report("host reconnected", mouse, policy)
+    assert mouse.is_connected(), "host could not reconnect"
+    policy.stop()
+    return policy
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,57 @@
+# Measure the delivered mouse report rate and latency against the emulated
+# radio, see tools/emulator. Runs on the host with CPython:
+#   python tools/emulate_report_rate.py [interval_ms] [reports_per_second]
+
+import errno
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+from central import Central
+from lib.hidservices.mouse import Mouse
+
+
+def run(interval_ms=7.5, rate=500, seconds=2):
+    clock = host.reset()
+    mouse = Mouse("Emulated Mouse")
+    mouse.start()
+    mouse.start_advertising()
+
+    central = Central(interval_ms=interval_ms)
+    central.connect()
+    central.exchange_mtu()
+    central.pair()
+    central.subscribe(mouse.h_rep)
+
+    period_us = 1000000 // rate
+    sent = 0
+    refused = 0
+    end = clock.now_us + seconds * 1000000
+    while clock.now_us < end:
+        mouse.set_axes(1, -1)
+        try:
+            mouse.notify_hid_report()
+            sent += 1
+        except OSError as e:                                                                                            # Stack buffers exhausted, the report is lost.
+            if e.args[0] != errno.ENOMEM:
+                raise
+            refused += 1
+        clock.run_for(period_us)
+    clock.run_for_ms(100)                                                                                               # Drain the queue.
+
+    stats = central.stats(mouse.h_rep)
+    _print("interval %.2f ms, offered %d/s: sent %d, refused %d, delivered %d, %.0f reports/s, latency avg %.2f ms max %.2f ms"
+           % (interval_ms, rate, sent, refused, stats["delivered"], stats["rate"], stats["latency_avg_ms"], stats["latency_max_ms"]))
+    return stats
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 7.5, int(sys.argv[2]) if len(sys.argv) > 2 else 500)
@@ -0,0 +1,115 @@
+# Check ThreadedInput (hidservices/threaded.py) against the emulated radio
+# with few stack buffers, i.e., ENOMEM on many notifies: a Keyboard types
+# keys and a Mouse moves while pump() runs every millisecond. Checks that
+# no key or move is lost, that the host ends with every key released, and
+# that no host gets a report twice. Runs on the host with CPython:
+#   python tools/emulate_threaded.py [tx_buffers]
+
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+from lib.hidservices.keyboard import Keyboard
+from lib.hidservices.mouse import Mouse
+from lib.hidservices.threaded import ThreadedInput
+
+_KEYS = 20
+_MOVES = 200
+
+
+# Start a device with two bonded hosts and the given stack buffers.
+def connect(device, tx_buffers):
+    device.set_max_connections(2)
+    device.start()
+    device.start_advertising()
+    centrals = []
+    for n in range(2):
+        central = Central(addr=bytes([0xC0, 0xFF, 0xEE, 0x00, 0x00, n + 1]))
+        central.connect()
+        central.pair()
+        central.subscribe(device.h_rep)
+        centrals.append(central)
+    ble = bluetooth.BLE()
+    ble.tx_buffers = ble.free_buffers = tx_buffers
+    clock.run_for_ms(20)
+    for central in centrals:
+        central.clear()
+    return centrals
+
+
+# Pump until the ring is empty and nothing is pending, then deliver.
+def drain(threaded):
+    for _ in range(10000):
+        threaded.pump()
+        clock.run_for_ms(1)
+        if not threaded.ring.pending() and threaded._push is None and threaded._event is None:
+            clock.run_for_ms(50)                                                                                        # Let the hosts take the queued reports.
+            return
+    raise AssertionError("pump() did not catch up")
+
+
+def run_keyboard(tx_buffers):
+    global clock
+    clock = host.reset()
+    keyboard = Keyboard("Emulated Keyboard")
+    centrals = connect(keyboard, tx_buffers)
+    threaded = ThreadedInput(keyboard)
+    for i in range(_KEYS):                                                                                              # Faster than the hosts take them.
+        threaded.press(0x04 + i)
+        threaded.release(0x04 + i)
+    drain(threaded)
+
+    for central in centrals:
+        reports = [data for _handle, data, _queued, _delivered in central.received]
+        pressed = [report[2] for report in reports if report[2]]
+        assert pressed == [0x04 + i for i in range(_KEYS)], "keys lost or out of order"
+        assert reports[-1][2] == 0, "host still holds a key"
+        assert all(reports[i] != reports[i - 1] for i in range(1, len(reports))), "report sent twice"
+    _print("keyboard, %d buffers: %d keys typed, %d reports per host, %d refused (ENOMEM)"
+           % (tx_buffers, _KEYS, len(centrals[0].received), bluetooth.BLE().stats["enomem"]))
+
+
+def run_mouse(tx_buffers):
+    global clock
+    clock = host.reset()
+    mouse = Mouse("Emulated Mouse")
+    centrals = connect(mouse, tx_buffers)
+    threaded = ThreadedInput(mouse, size=_MOVES * 2)                                                                    # Events wait in the ring while the stack is out of buffers.
+    for i in range(_MOVES):
+        threaded.move(100, -50)
+        if i % 50 == 0:
+            threaded.buttons(1)
+            threaded.buttons(0)
+        if i % 10 == 0:
+            threaded.pump()                                                                                             # Sends merged moves of up to 127 in parts.
+            clock.run_for_ms(1)
+    drain(threaded)
+    assert not threaded.ring.overflows, "ring too small for the test"
+
+    for central in centrals:
+        dx = dy = 0
+        for _handle, data, _queued, _delivered in central.received:
+            _buttons, x, y, _wheel = struct.unpack("Bbbb", data)
+            dx += x
+            dy += y
+        assert (dx, dy) == (100 * _MOVES, -50 * _MOVES), "moves lost: %d, %d" % (dx, dy)
+        assert struct.unpack("Bbbb", central.received[-1][1])[0] == 0, "host still holds a button"
+    _print("mouse, %d buffers: %d moves, %d reports per host, %d refused (ENOMEM)"
+           % (tx_buffers, _MOVES, len(centrals[0].received), bluetooth.BLE().stats["enomem"]))
+
+
+if __name__ == "__main__":
+    tx_buffers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    run_keyboard(tx_buffers)
+    run_mouse(tx_buffers)
@@ -0,0 +1,108 @@
+# Check the frames of a Touchpad (hidservices/touchpad.py) against the
+# emulated radio with few stack buffers, i.e., ENOMEM on many notifies:
+# two fingers and a palm move and lift on a touchpad with 6 contacts, while
+# notify_hid_report() runs every millisecond. One host exchanged an MTU
+# that fits all contacts and gets single reports, the other keeps the
+# default MTU and gets hybrid reports. A frame waits while the last one
+# is being sent. Checks that every host gets the same frames, each complete
+# and once, and that lifted contacts are reported once more without their
+# tip and then freed. Runs on the host with CPython:
+#   python tools/emulate_touchpad.py [tx_buffers]
+
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+from lib.hidservices.touchpad import Touchpad
+
+_FRAMES = 60                                                                                                            # Samples, one per millisecond.
+_LIFT = 40                                                                                                              # Sample in which the fingers lift.
+
+
+# Split the reports a host received into frames of (scan time, {contact: tip}).
+# A hybrid frame starts with the report that carries the contact count, a
+# frame without contacts is a single report.
+def frames(central, touchpad):
+    out = []
+    missing = 0                                                                                                         # Contacts of the frame still to come in hybrid reports.
+    for handle, data, _queued, _delivered in central.received:
+        contacts = (len(data) - 4) // 4
+        scan_time, count, _button = struct.unpack_from("<HBB", data, contacts * 4)
+        if handle == touchpad.h_rep or missing == 0:
+            assert missing == 0, "frame cut short"
+            out.append((scan_time, {}))
+            missing = count
+        else:
+            assert count == 0 and scan_time == out[-1][0], "hybrid report of another frame"
+        for i in range(min(contacts, missing)):
+            flags = data[i * 4]
+            out[-1][1][flags >> 2] = flags & 1
+        missing -= min(contacts, missing)
+    assert missing == 0, "last frame cut short"
+    return out
+
+
+def run(tx_buffers):
+    global clock
+    clock = host.reset()
+    touchpad = Touchpad("Emulated Touchpad", contacts=6)
+    touchpad.set_max_connections(2)
+    touchpad.start()
+    touchpad.start_advertising()
+    centrals = []
+    for n, mtu in enumerate((247, 23)):
+        central = Central(addr=bytes([0xC0, 0xFF, 0xEE, 0x00, 0x00, n + 1]), mtu=mtu)
+        central.connect()
+        central.exchange_mtu()
+        central.pair()
+        central.subscribe(touchpad.h_rep)
+        if touchpad.h_rep_hybrid is not None:
+            central.subscribe(touchpad.h_rep_hybrid)
+        centrals.append(central)
+    ble = bluetooth.BLE()
+    ble.tx_buffers = ble.free_buffers = tx_buffers
+    clock.run_for_ms(20)
+    for central in centrals:
+        central.clear()
+
+    refused = 0
+    for frame in range(_FRAMES):                                                                                        # One sample per millisecond, faster than the hosts take them.
+        if frame < _LIFT:
+            for contact in range(5):
+                touchpad.set_contact(contact, 100 + frame * 10, 200 + contact * 300, confidence=contact < 4)
+        elif frame == _LIFT:
+            touchpad.lift_all()
+        if not touchpad.notify_hid_report():                                                                            # Sends the rest of the last frame first, then this one.
+            refused += 1
+        clock.run_for_ms(1)
+    while not touchpad.notify_hid_report():
+        clock.run_for_ms(1)
+    clock.run_for_ms(50)                                                                                                # Let the hosts take the queued reports.
+    assert touchpad.get_contact_count() == 0 and all(id == 0xFF for id in touchpad._ids), "lifted slots not freed"
+
+    sent = [frames(central, touchpad) for central in centrals]
+    for got in sent:
+        scans = [scan for scan, _contacts in got]
+        assert scans == [scan for scan, _contacts in sent[0]], "hosts got different frames"
+        assert all(scans[i] != scans[i - 1] for i in range(1, len(scans))), "frame sent twice"
+        lifts = [i for i, (_scan, contacts) in enumerate(got) if contacts and not any(contacts.values())]
+        assert len(lifts) == 1 and got[lifts[0]][1] == {c: 0 for c in range(5)}, "lift not reported once"
+        assert all(contacts == {c: 1 for c in range(5)} for _scan, contacts in got[:lifts[0]]), "contacts lost"
+        assert all(not contacts for _scan, contacts in got[lifts[0] + 1:]), "lifted contacts reported again"
+    _print("touchpad, %d buffers: %d samples, %d frames, %d and %d reports per host (MTU 31, 23), %d samples waited (ENOMEM)"
+           % (tx_buffers, _FRAMES, len(sent[0]), len(centrals[0].received), len(centrals[1].received), refused))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -0,0 +1,125 @@
+# Check the key repeat of Typematic (hidservices/typematic.py) against the
+# emulated radio: a key is held on a bonded Keyboard while the emulated
+# machine.Timer drives the repeats. Checks the number of repeats, the repeat
+# timing jitter() against the timer period, and that the host ends up with
+# the key released, also with a single stack buffer, i.e., ENOMEM on many
+# notifies, where refused repeats are retried on the next tick to the hosts
+# that missed them only, and that nothing repeats while more than six keys
+# are held (rollover). Runs on the host with CPython:
+#   python tools/emulate_typematic.py [delay_ms] [rate] [hold_ms]
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+from lib.hidservices.keyboard import Keyboard
+from lib.hidservices.typematic import Typematic
+
+_KEY_A = 0x04
+
+
+# Returns whether a host got the same report twice in a row, i.e., a retry
+# resent a report it already had.
+def resent(central):
+    for i in range(1, len(central.received)):
+        if central.received[i][1] == central.received[i - 1][1]:
+            return True
+    return False
+
+
+def run(delay=500, rate=30, hold_ms=3000, tx_buffers=12, period=5, hosts=1):
+    clock = host.reset()
+    keyboard = Keyboard("Emulated Keyboard")
+    keyboard.set_max_connections(hosts)
+    keyboard.start()
+    keyboard.start_advertising()
+
+    centrals = []
+    for n in range(hosts):
+        central = Central(addr=bytes([0xC0, 0xFF, 0xEE, 0x00, 0x00, n + 1]))
+        central.connect()
+        central.pair()
+        central.subscribe(keyboard.h_rep)
+        centrals.append(central)
+    ble = bluetooth.BLE()
+    ble.tx_buffers = ble.free_buffers = tx_buffers
+    clock.run_for_ms(20)
+    for central in centrals:
+        central.clear()
+
+    typematic = Typematic(keyboard, delay=delay, rate=rate, period=period)
+    typematic.start()
+    typematic.press(_KEY_A)
+    clock.run_for_ms(hold_ms)
+    typematic.release(_KEY_A)
+    clock.run_for_ms(100)                                                                                               # Send what is pending and drain the queue.
+    typematic.stop()
+
+    expected = (hold_ms - delay) // typematic.interval + 1
+    worst, mean = typematic.jitter()
+    _print("delay %d ms, rate %d/s, %d buffers, %d hosts: %d repeats (%d expected), jitter max %d ms mean %d ms, %d reports delivered, %d refused (ENOMEM)"
+           % (delay, rate, tx_buffers, hosts, typematic.repeats, expected, worst, mean, sum(len(c.received) for c in centrals), ble.stats["enomem"]))
+
+    assert not typematic._pending, "report with the held keys not sent"
+    for central in centrals:
+        last = central.received[-1][1] if central.received else None
+        assert last is not None and last[2] == 0, "host still holds the key"
+        assert not resent(central), "report resent to a host that had it"
+    assert keyboard._held_count == 0 and not any(keyboard._slots), "keyboard state out of sync"
+    assert abs(typematic.repeats - expected) <= 1, "wrong number of repeats"
+    if hosts == 1:                                                                                                      # More hosts share the buffers, a repeat waits for the others.
+        assert worst < period, "repeat later than one timer period"
+    return typematic
+
+
+# Hold seven keys: the keyboard reports the rollover error and nothing
+# repeats, until a key is released and the six left repeat again.
+def run_rollover(delay=500, rate=30, period=5):
+    clock = host.reset()
+    keyboard = Keyboard("Emulated Keyboard")
+    keyboard.start()
+    keyboard.start_advertising()
+    central = Central()
+    central.connect()
+    central.pair()
+    central.subscribe(keyboard.h_rep)
+    clock.run_for_ms(20)
+
+    typematic = Typematic(keyboard, delay=delay, rate=rate, period=period)
+    typematic.start()
+    for usage in range(_KEY_A, _KEY_A + 7):
+        typematic.press(usage)
+    clock.run_for_ms(delay * 3)
+    rollover_repeats = typematic.repeats
+    typematic.release(_KEY_A)
+    clock.run_for_ms(delay + typematic.interval * 2)
+    resumed = typematic.repeats
+    typematic.release_all()
+    clock.run_for_ms(100)
+    typematic.stop()
+
+    _print("rollover of 7 keys: %d repeats while rolled over, %d after releasing one" % (rollover_repeats, resumed))
+    assert rollover_repeats == 0, "repeated while rolled over"
+    assert resumed >= 6, "held keys do not repeat after the rollover"
+    assert central.received[-1][1][2] == 0, "host still holds keys"
+    return typematic
+
+
+if __name__ == "__main__":
+    delay = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rate = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    hold_ms = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+    run(delay, rate, hold_ms)
+    run(delay, rate, hold_ms, tx_buffers=1)
+    run(delay, rate, hold_ms, tx_buffers=1, hosts=2)
+    run_rollover(delay, rate)
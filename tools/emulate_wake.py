@@ -0,0 +1,107 @@
+# Measure wake-to-advertise and wake-to-first-report latency after deep
+# sleep, with and without a snapshot (see hidservices/snapshot.py), against
+# the emulated radio. A bonded device captures a snapshot into the emulated
+# RTC memory, then every wake starts over with a new radio, as after deep
+# sleep, and constructs, starts and advertises the device. The CPU time is
+# measured on the host, the radio time on the virtual clock, see
+# BLE.cost_us in tools/emulator. Both wakes register and write every value,
+# the radio holds nothing after deep sleep, so the radio calls and the
+# wake-to-advertise time are the same. The bonded host then reconnects,
+# scanning 30 ms every 150 ms (see Central.scan()), and the device sends a
+# report. The resumed device advertises fast, so the host hears it sooner.
+# Wake-to-first-report is averaged over the phases of the host's scan.
+# Runs on the host with CPython:
+#   python tools/emulate_wake.py [device] [runs]
+# e.g., python tools/emulate_wake.py Keyboard 50
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+clock = host.install()
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import bluetooth
+from central import Central
+from lib.hid_services import HumanInterfaceDevice
+from lib.hidservices.snapshot import Snapshot, RTCStore
+import lib.hidservices
+
+_CALLS = ("active", "config", "register", "write", "advertise")
+_SCAN_WINDOW_MS = 30                                                                                                    # Background scan of the host.
+_SCAN_INTERVAL_MS = 150
+_PHASE_STEP_MS = 5
+
+
+# Construct, start and advertise a device on a new radio, as after deep
+# sleep. Returns (device, CPU us, radio us, radio calls).
+def wake(cls, snapshot=None):
+    global clock
+    clock = host.reset()
+    HumanInterfaceDevice._owner = None                                                                                  # The radio was off.
+    HumanInterfaceDevice._radio_config = {}
+    start = time.perf_counter()
+    radio_start = clock.now_us
+    if snapshot is not None:
+        snapshot.resume()
+    device = cls()
+    device.start()
+    device.start_advertising()
+    cpu_us = (time.perf_counter() - start) * 1000000                                                                    # The virtual clock does not take host time.
+    stats = bluetooth.BLE().stats
+    return device, cpu_us, clock.now_us - radio_start, ", ".join("%s %d" % (call, stats[call]) for call in _CALLS)
+
+
+def run(name="Keyboard", runs=20):
+    cls = getattr(lib.hidservices, name)
+
+    device = wake(cls)[0]                                                                                               # First boot: bond with a host.
+    central = Central()
+    central.connect()
+    central.pair()
+    snapshot = Snapshot(RTCStore())
+    size = snapshot.capture(device)
+    values = dict((handle, value) for handle, (_description, value) in device.characteristics.items())
+    _print("%s, snapshot of %d bytes, %d runs" % (name, size, runs))
+
+    results = []
+    for label, use in (("cold wake", None), ("snapshot wake", snapshot)):
+        best = None
+        for _ in range(runs):
+            device, cpu_us, radio_us, calls = wake(cls, use)
+            if best is None or cpu_us < best[0]:
+                best = (cpu_us, radio_us, calls)
+        restored = dict((handle, value) for handle, (_description, value) in device.characteristics.items())
+        _print("%-14s %8.2f ms cpu %8.2f ms radio   %s%s" % (label, best[0] / 1000.0, best[1] / 1000.0, best[2], "" if restored == values else "   values differ"))
+
+        latencies = []
+        for phase in range(0, _SCAN_INTERVAL_MS, _PHASE_STEP_MS):
+            latencies.append(first_report(cls, use, central.ltk, phase))
+        results.append(sum(latencies) / len(latencies))
+        _print("%-14s wake-to-first-report avg %8.2f ms max %8.2f ms" % ("", results[-1] / 1000.0, max(latencies) / 1000.0))
+    _print("snapshot saves %.2f ms to the first report" % ((results[0] - results[1]) / 1000.0))
+
+
+# Wake, let the bonded host with key ltk reconnect with its scan at phase_ms,
+# and send a report. Returns the microseconds from the wake to its delivery.
+def first_report(cls, snapshot, ltk, phase_ms):
+    device = wake(cls, snapshot)[0]
+    host_central = Central()
+    host_central.ltk = ltk
+    assert host_central.scan(_SCAN_WINDOW_MS, _SCAN_INTERVAL_MS, phase_ms) is not None, "host did not reconnect"
+    assert device.get_connection().bonded, "host did not reconnect bonded"
+    host_central.subscribe(device.h_rep)
+    device.notify_hid_report()
+    while not host_central.received:
+        clock.run_for_ms(1)
+    return host_central.received[0][3]                                                                                  # The wake started at 0 on the new clock.
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else "Keyboard", int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,409 @@
+# Emulated MicroPython bluetooth module for running this library on a host
+# with CPython, see tools/emulator/host.py. Implements the peripheral subset
+# used by hid_services.py on a deterministic virtual clock:
+#   - gatts_register_services handle allocation, gatts_read/write/notify/indicate
+#   - gap_advertise, gap_disconnect, gap_passkey, irq and config
+#   - secrets and pairing IRQs, driven by scripted centrals (see central.py)
+# Notifications are queued per connection and delivered on connection events
+# every connection interval, at most notify_per_event per event. The queued
+# notifications share a pool of tx_buffers stack buffers, gatts_notify raises
+# OSError(ENOMEM) when the pool is exhausted, like NimBLE does.
+# Calls that are slow on the device, e.g., active(), config() and
+# gatts_register_services(), let virtual time pass, see BLE.cost_us.
+
+import errno
+import heapq
+import struct
+import time
+
+FLAG_BROADCAST = 0x0001
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+FLAG_INDICATE = 0x0020
+
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+_IRQ_GATTS_READ_REQUEST = 4
+_IRQ_GATTS_INDICATE_DONE = 20
+_IRQ_MTU_EXCHANGED = 21
+_IRQ_CONNECTION_UPDATE = 27
+_IRQ_ENCRYPTION_UPDATE = 28
+_IRQ_GET_SECRET = 29
+_IRQ_SET_SECRET = 30
+_IRQ_PASSKEY_ACTION = 31
+
+_PASSKEY_ACTION_INPUT = 2
+_PASSKEY_ACTION_DISP = 3
+_PASSKEY_ACTION_NUMCMP = 4
+
+_IO_CAPABILITY_DISPLAY_ONLY = 0
+_IO_CAPABILITY_DISPLAY_YESNO = 1
+_IO_CAPABILITY_KEYBOARD_ONLY = 2
+_IO_CAPABILITY_NO_INPUT_OUTPUT = 3
+_IO_CAPABILITY_KEYBOARD_DISPLAY = 4
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_HALF = _TICKS_PERIOD >> 1
+
+
+class UUID:
+    def __init__(self, value):
+        if isinstance(value, UUID):
+            value = value._value
+        elif isinstance(value, str):
+            value = bytes.fromhex(value.replace("-", ""))[::-1]
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            value = bytes(value)
+            if len(value) == 2:
+                value = struct.unpack("<H", value)[0]
+        elif isinstance(value, float):
+            value = int(value)
+        self._value = value
+
+    def __bytes__(self):
+        if isinstance(self._value, int):
+            return struct.pack("<H" if self._value <= 0xFFFF else "<I", self._value)
+        return self._value
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self._value == other._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __repr__(self):
+        if isinstance(self._value, int):
+            return "UUID(0x%04x)" % self._value
+        return "UUID(%r)" % self._value
+
+
+# Virtual clock with an event queue. Time only moves when run_for(),
+# run_until() or the patched time.sleep_ms() are called, so a simulation
+# gives the same result on every run.
+class Clock:
+    def __init__(self):
+        self.now_us = 0
+        self._events = []
+        self._seq = 0
+
+    # Call fn(*args) delay_us microseconds from now. Returns a handle for cancel().
+    def schedule(self, delay_us, fn, *args):
+        self._seq += 1
+        event = [self.now_us + max(0, int(delay_us)), self._seq, fn, args]
+        heapq.heappush(self._events, event)
+        return event
+
+    def cancel(self, event):
+        event[2] = None
+
+    # Run all events due up to and including t_us, then set the time to t_us.
+    def run_until(self, t_us):
+        events = self._events
+        while events and events[0][0] <= t_us:
+            when, _seq, fn, args = heapq.heappop(events)
+            self.now_us = max(self.now_us, when)                                                                        # Events delayed by elapse() run late.
+            if fn is not None:
+                fn(*args)
+        self.now_us = max(self.now_us, t_us)
+
+    def run_for(self, us):
+        self.run_until(self.now_us + us)
+
+    def run_for_ms(self, ms):
+        self.run_until(self.now_us + int(ms * 1000))
+
+    # Let time pass without running events, e.g., while the stack is busy.
+    def elapse(self, us):
+        self.now_us += int(us)
+
+    # Replace the MicroPython tick functions of the time module with ones
+    # running on this clock.
+    def install(self):
+        time.ticks_us = lambda: self.now_us % _TICKS_PERIOD
+        time.ticks_ms = lambda: (self.now_us // 1000) % _TICKS_PERIOD
+        time.ticks_cpu = time.ticks_us
+        time.ticks_add = lambda ticks, delta: (ticks + delta) % _TICKS_PERIOD
+        time.ticks_diff = lambda a, b: ((a - b + _TICKS_HALF) % _TICKS_PERIOD) - _TICKS_HALF
+        time.sleep_ms = lambda ms: self.run_for(int(ms * 1000))
+        time.sleep_us = lambda us: self.run_for(int(us))
+
+
+clock = Clock()
+_ble = None
+
+
+# Start over with a new clock and radio, e.g., between test runs.
+def reset():
+    global clock, _ble
+    clock = Clock()
+    _ble = None
+    return clock
+
+
+# A notification or indication waiting for a connection event.
+class _Packet:
+    def __init__(self, value_handle, data, queued_us, indicate):
+        self.value_handle = value_handle
+        self.data = data
+        self.queued_us = queued_us
+        self.indicate = indicate
+
+
+# State of one connection to a scripted central.
+class _Link:
+    def __init__(self, conn_handle, central, interval_us, latency, timeout_ms):
+        self.conn_handle = conn_handle
+        self.central = central
+        self.interval_us = interval_us
+        self.latency = latency
+        self.timeout_ms = timeout_ms
+        self.mtu = 23
+        self.queue = []
+        self.event = None
+        self.encrypted = False
+        self.authenticated = False
+        self.bonded = False
+        self.subscribed = set()                                                                                         # CCCD handles written by the central.
+
+
+# Emulated radio. BLE() returns the same instance until reset(), like on the device.
+class BLE:
+    def __new__(cls):
+        global _ble
+        if _ble is None:
+            _ble = object.__new__(cls)
+            _ble._init()
+        return _ble
+
+    def _init(self):
+        self.clock = clock
+        self._handler = None
+        self._active = False
+        self._config = {"mtu": 23, "gap_name": "MPY", "bond": False, "le_secure": False, "mitm": False, "io": _IO_CAPABILITY_NO_INPUT_OUTPUT, "mac": (0, b"\x24\x0a\xc4\x00\x00\x01")}
+        self._values = {}
+        self._buffer_len = {}
+        self._flags = {}
+        self._next_handle = 1
+        self._next_conn = 0
+        self.links = {}
+        self.advertising = None                                                                                         # (interval_us, adv_data, resp_data, connectable) or None.
+        self.advertising_since_us = 0                                                                                   # Time of the first advertising event, see Central.scan().
+        self._adv_data = None
+        self._resp_data = None
+
+        # Link model, change before connecting centrals.
+        self.tx_buffers = 12                                                                                            # Stack buffers shared by all queued notifications.
+        self.notify_per_event = 4                                                                                       # Notifications sent per connection event.
+        self.max_connections = 3
+
+        # Time taken by the stack per call, passed on the clock so start and
+        # switch latencies can be measured. Rough figures for an ESP32 with
+        # NimBLE, change them to match the board.
+        self.cost_us = {"active": 250000, "config": 100, "register": 2000, "attribute": 250, "write": 150, "advertise": 500}
+
+        self.free_buffers = self.tx_buffers
+        self.stats = {"notify": 0, "indicate": 0, "enomem": 0, "truncated": 0, "dropped": 0, "irq": 0, "active": 0, "config": 0, "register": 0, "write": 0, "advertise": 0}
+
+    def _irq(self, event, data):
+        self.stats["irq"] += 1
+        if self._handler is not None:
+            return self._handler(event, data)
+        return None
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def _cost(self, kind, n=1):
+        self.stats[kind] += 1
+        self.clock.elapse(self.cost_us[kind] * n)
+
+    # Remove the registered services, like powering down or registering again does.
+    def _clear_services(self):
+        self._values = {}
+        self._buffer_len = {}
+        self._flags = {}
+        self._next_handle = 1
+        for link in self.links.values():
+            link.subscribed = set()
+
+    def active(self, active=None):
+        if active is None:
+            return self._active
+        self._cost("active")
+        self._active = bool(active)
+        if not self._active:
+            for conn_handle in list(self.links):
+                self._drop_link(conn_handle)
+            self.advertising = None
+            self._clear_services()
+        self.free_buffers = self.tx_buffers
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        for key, value in kwargs.items():
+            self._cost("config")
+            self._config[key] = value
+            if key == "rxbuf" or key == "tx_buffers":
+                self.tx_buffers = self.free_buffers = value
+
+    # Allocate handles like the stack: a declaration handle per service and
+    # characteristic, a value handle per characteristic, a CCCD after the value
+    # of characteristics that notify or indicate, and a handle per descriptor.
+    # Returns the value and descriptor handles per service. Replaces the
+    # services registered before. Like NimBLE, refuses with EBUSY while
+    # centrals are connected.
+    def gatts_register_services(self, services):
+        if self.links:
+            raise OSError(errno.EBUSY, "EBUSY")
+        self._clear_services()
+        result = []
+        for _uuid, characteristics in services:
+            self._next_handle += 1
+            handles = []
+            for characteristic in characteristics:
+                flags = characteristic[1]
+                self._next_handle += 1
+                value_handle = self._next_handle
+                self._next_handle += 1
+                self._values[value_handle] = b""
+                self._buffer_len[value_handle] = 20
+                self._flags[value_handle] = flags
+                handles.append(value_handle)
+                if flags & (FLAG_NOTIFY | FLAG_INDICATE):
+                    self._values[self._next_handle] = b"\x00\x00"
+                    self._next_handle += 1
+                if len(characteristic) > 2:
+                    for _descriptor in characteristic[2]:
+                        self._values[self._next_handle] = b""
+                        self._buffer_len[self._next_handle] = 20
+                        handles.append(self._next_handle)
+                        self._next_handle += 1
+            result.append(tuple(handles))
+        self._cost("register")
+        self.clock.elapse(self.cost_us["attribute"] * (self._next_handle - 1))
+        return tuple(result)
+
+    def gatts_read(self, value_handle):
+        return self._values[value_handle]
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._cost("write")
+        data = bytes(data)
+        self._values[value_handle] = data
+        if len(data) > self._buffer_len.get(value_handle, 20):
+            self._buffer_len[value_handle] = len(data)
+        if send_update:
+            for link in self.links.values():
+                if value_handle + 1 in link.subscribed:
+                    self._queue(link, value_handle, data, self._flags.get(value_handle, 0) & FLAG_INDICATE and not self._flags[value_handle] & FLAG_NOTIFY)
+
+    def gatts_set_buffer(self, value_handle, length, append=False):
+        self._buffer_len[value_handle] = length
+
+    def _queue(self, link, value_handle, data, indicate):
+        if self.free_buffers == 0:
+            self.stats["enomem"] += 1
+            raise OSError(errno.ENOMEM, "ENOMEM")
+        if len(data) > link.mtu - 3:
+            data = data[: link.mtu - 3]
+            self.stats["truncated"] += 1
+        self.free_buffers -= 1
+        link.queue.append(_Packet(value_handle, data, self.clock.now_us, indicate))
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        link = self.links.get(conn_handle)
+        if link is None:
+            raise OSError(errno.ENOTCONN, "ENOTCONN")
+        self.stats["notify"] += 1
+        self._queue(link, value_handle, bytes(self._values[value_handle] if data is None else data), False)
+
+    def gatts_indicate(self, conn_handle, value_handle, data=None):
+        link = self.links.get(conn_handle)
+        if link is None:
+            raise OSError(errno.ENOTCONN, "ENOTCONN")
+        self.stats["indicate"] += 1
+        self._queue(link, value_handle, bytes(self._values[value_handle] if data is None else data), True)
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        self._cost("advertise")
+        if adv_data is not None:
+            self._adv_data = bytes(adv_data)
+        if resp_data is not None:
+            self._resp_data = bytes(resp_data)
+        if interval_us is None or interval_us == 0:
+            self.advertising = None
+        else:
+            self.advertising = (interval_us, self._adv_data, self._resp_data, connectable)
+            self.advertising_since_us = self.clock.now_us                                                               # The first event, see next_advertising_event().
+
+    # Time of the first advertising event at or after t_us. Events follow
+    # each other by the interval plus an advDelay of 0 to 10 ms, taken from
+    # a fixed pseudo-random sequence so every run gives the same events.
+    def next_advertising_event(self, t_us):
+        interval_us = self.advertising[0]
+        t = self.advertising_since_us
+        k = 0
+        while t < t_us:
+            k += 1
+            t += interval_us + (k * 2654435761 & 0xFFFFFFFF) % 10000
+        return t
+
+    def gap_disconnect(self, conn_handle):
+        if conn_handle not in self.links:
+            return False
+        self.clock.schedule(0, self._disconnect, conn_handle)
+        return True
+
+    def gap_passkey(self, conn_handle, action, passkey):
+        link = self.links.get(conn_handle)
+        if link is not None:
+            link.central._passkey_reply(action, passkey)
+
+    # Connection events: deliver up to notify_per_event queued packets.
+    def _connection_event(self, link):
+        n = self.notify_per_event
+        while link.queue and n:
+            packet = link.queue.pop(0)
+            self.free_buffers += 1
+            n -= 1
+            link.central._deliver(packet, self.clock.now_us)
+            if packet.indicate:
+                self._irq(_IRQ_GATTS_INDICATE_DONE, (link.conn_handle, packet.value_handle, 0))
+        if link.conn_handle in self.links:
+            link.event = self.clock.schedule(link.interval_us, self._connection_event, link)
+
+    def _connect(self, central):
+        if not self._active or self.advertising is None or not self.advertising[3]:
+            raise OSError(errno.ECONNREFUSED, "ECONNREFUSED")
+        if len(self.links) >= self.max_connections:
+            raise OSError(errno.ECONNREFUSED, "ECONNREFUSED")
+        self._next_conn += 1
+        link = _Link(self._next_conn, central, central.interval_us, central.latency, central.timeout_ms)
+        self.links[link.conn_handle] = link
+        self.advertising = None                                                                                         # The stack stops advertising on connect.
+        self._irq(_IRQ_CENTRAL_CONNECT, (link.conn_handle, central.addr_type, central.addr))
+        if link.conn_handle in self.links:
+            self._irq(_IRQ_CONNECTION_UPDATE, (link.conn_handle, link.interval_us // 1250, link.latency, link.timeout_ms // 10, 0))
+            link.event = self.clock.schedule(link.interval_us, self._connection_event, link)
+        return link
+
+    def _drop_link(self, conn_handle):
+        link = self.links.pop(conn_handle, None)
+        if link is None:
+            return None
+        if link.event is not None:
+            self.clock.cancel(link.event)
+        self.free_buffers += len(link.queue)
+        self.stats["dropped"] += len(link.queue)
+        link.queue = []
+        return link
+
+    def _disconnect(self, conn_handle):
+        link = self._drop_link(conn_handle)
+        if link is not None:
+            link.central._disconnected()
+            self._irq(_IRQ_CENTRAL_DISCONNECT, (conn_handle, link.central.addr_type, link.central.addr))
@@ -0,0 +1,161 @@
+# Scripted centrals for the emulated bluetooth module. A central connects to
+# the advertising peripheral, exchanges the MTU, pairs, subscribes to report
+# characteristics and records every notification it receives, so tests can
+# measure the delivered report rate and latency.
+
+import bluetooth
+
+_SEC_TYPE_LTK = 1
+
+
+class Central:
+    def __init__(self, addr=b"\xc0\xff\xee\x00\x00\x01", addr_type=0, interval_ms=7.5, latency=0, timeout_ms=5000, mtu=247, ble=None):
+        self.ble = ble if ble is not None else bluetooth.BLE()
+        self.addr = bytes(addr)
+        self.addr_type = addr_type
+        self.interval_us = int(interval_ms * 1000)
+        self.latency = latency
+        self.timeout_ms = timeout_ms
+        self.mtu = mtu
+        self.link = None
+        self.passkey = None                                                                                             # The passkey shown or sent by the peripheral.
+        self.received = []                                                                                              # (value_handle, data, queued_us, delivered_us) per notification.
+        self.ltk = None                                                                                                 # Long term key after bonding.
+
+    @property
+    def conn_handle(self):
+        return self.link.conn_handle if self.link is not None else None
+
+    def is_connected(self):
+        return self.link is not None and self.link.conn_handle in self.ble.links
+
+    # Connect to the peripheral. It must be advertising and connectable.
+    def connect(self):
+        self.link = self.ble._connect(self)
+        if self.ltk is not None:                                                                                        # Bonded before, restore encryption.
+            key = self.ble._irq(bluetooth._IRQ_GET_SECRET, (_SEC_TYPE_LTK, 0, self.addr))
+            if key == self.ltk:
+                self._encrypted(self.link.authenticated, True)
+        return self.conn_handle
+
+    # Scan like a host reconnecting in the background, window_ms every
+    # interval_ms from phase_ms before now, and connect at the first
+    # advertising event heard, running the clock up to it. The advertising
+    # interval may change meanwhile. Returns the connection handle, or None
+    # if nothing was heard within timeout_ms.
+    def scan(self, window_ms=30, interval_ms=150, phase_ms=0, timeout_ms=60000):
+        ble = self.ble
+        clock = ble.clock
+        window_us = int(window_ms * 1000)
+        interval_us = int(interval_ms * 1000)
+        scan_start = clock.now_us - int(phase_ms * 1000)
+        end = clock.now_us + int(timeout_ms * 1000)
+        while clock.now_us < end:
+            advertising = ble.advertising
+            if advertising is not None:
+                t = ble.next_advertising_event(clock.now_us)
+                if (t - scan_start) % interval_us < window_us:
+                    clock.run_until(t)
+                    if ble.advertising is advertising:
+                        return self.connect()
+                    continue
+                clock.run_until(min(t + 1, end))
+            else:
+                clock.run_for(1000)
+        return None
+
+    def disconnect(self):
+        if self.is_connected():
+            self.ble._disconnect(self.link.conn_handle)
+
+    def exchange_mtu(self, mtu=None):
+        mtu = min(self.mtu if mtu is None else mtu, self.ble.config("mtu"))                                             # The peripheral's preferred MTU caps the result.
+        self.link.mtu = mtu
+        self.ble._irq(bluetooth._IRQ_MTU_EXCHANGED, (self.link.conn_handle, mtu))
+        return mtu
+
+    # Pair with the peripheral. Passkey entry and numeric comparison are
+    # answered by the peripheral through gap_passkey(), see _passkey_reply().
+    # Returns whether the link is encrypted afterwards.
+    def pair(self, bond=True, passkey=None):
+        ble = self.ble
+        link = self.link
+        io = ble.config("io")
+        mitm = ble.config("mitm")
+        authenticated = False
+        if mitm and io != bluetooth._IO_CAPABILITY_NO_INPUT_OUTPUT:
+            self._accepted = None
+            if io == bluetooth._IO_CAPABILITY_DISPLAY_YESNO or io == bluetooth._IO_CAPABILITY_KEYBOARD_DISPLAY:
+                action = bluetooth._PASSKEY_ACTION_NUMCMP
+            elif io == bluetooth._IO_CAPABILITY_KEYBOARD_ONLY:
+                action = bluetooth._PASSKEY_ACTION_INPUT
+            else:
+                action = bluetooth._PASSKEY_ACTION_DISP
+            ble._irq(bluetooth._IRQ_PASSKEY_ACTION, (link.conn_handle, action, passkey if action == bluetooth._PASSKEY_ACTION_NUMCMP else 0))
+            if action == bluetooth._PASSKEY_ACTION_NUMCMP:
+                authenticated = bool(self._accepted)
+            else:                                                                                                       # The passkey must match, any passkey if None.
+                authenticated = self._accepted is not None and (passkey is None or self._accepted == passkey)
+            if not authenticated:
+                return False
+        bonded = bond and ble.config("bond")
+        if bonded:
+            self.ltk = bytes((self.addr[-1], link.conn_handle)) * 8
+            ble._irq(bluetooth._IRQ_SET_SECRET, (_SEC_TYPE_LTK, self.addr, self.ltk))
+        self._encrypted(authenticated, bonded)
+        return True
+
+    def _encrypted(self, authenticated, bonded):
+        link = self.link
+        link.encrypted = True
+        link.authenticated = authenticated
+        link.bonded = bonded
+        self.ble._irq(bluetooth._IRQ_ENCRYPTION_UPDATE, (link.conn_handle, True, authenticated, bonded, 16))
+
+    def _passkey_reply(self, action, passkey):
+        if action == bluetooth._PASSKEY_ACTION_DISP:
+            self.passkey = passkey
+        self._accepted = passkey
+
+    # Enable notifications of a characteristic by writing its CCCD.
+    def subscribe(self, value_handle):
+        self.link.subscribed.add(value_handle + 1)
+        self.ble._values[value_handle + 1] = b"\x01\x00"
+
+    # Read a characteristic. Raises OSError with the ATT error code on refusal.
+    def read(self, value_handle):
+        status = self.ble._irq(bluetooth._IRQ_GATTS_READ_REQUEST, (self.link.conn_handle, value_handle))
+        if status:
+            raise OSError(status)
+        return self.ble.gatts_read(value_handle)
+
+    # Write a characteristic, e.g., the keyboard LED output report.
+    def write(self, value_handle, data):
+        self.ble._values[value_handle] = bytes(data)
+        return self.ble._irq(bluetooth._IRQ_GATTS_WRITE, (self.link.conn_handle, value_handle))
+
+    def _deliver(self, packet, now_us):
+        if packet.value_handle + 1 in self.link.subscribed:
+            self.received.append((packet.value_handle, packet.data, packet.queued_us, now_us))
+
+    # Called when the peripheral disconnected. Override to react, e.g., reconnect.
+    def _disconnected(self):
+        pass
+
+    def clear(self):
+        self.received = []
+
+    # Delivered reports, rate and latency, optionally for one value handle.
+    # The rate is over the time from the first queued to the last delivered report.
+    def stats(self, value_handle=None):
+        received = [r for r in self.received if value_handle is None or r[0] == value_handle]
+        if not received:
+            return {"delivered": 0, "rate": 0.0, "latency_avg_ms": 0.0, "latency_max_ms": 0.0}
+        latencies = [r[3] - r[2] for r in received]
+        span = received[-1][3] - received[0][2]
+        return {
+            "delivered": len(received),
+            "rate": len(received) * 1000000.0 / span if span > 0 else 0.0,
+            "latency_avg_ms": sum(latencies) / len(latencies) / 1000.0,
+            "latency_max_ms": max(latencies) / 1000.0,
+        }
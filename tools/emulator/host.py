@@ -0,0 +1,40 @@
+# Set up a CPython process to run this library against the emulated radio:
+#   import tools.emulator.host as host   (or run with tools/emulator on sys.path)
+#   host.install()
+#   from lib.hidservices.mouse import Mouse
+# install() puts the emulated bluetooth, micropython and machine modules on
+# sys.path, makes the repository importable as lib like on the device, and
+# runs the time tick functions on the virtual clock, unless virtual_time is
+# False, e.g., to time code with the host's clock. It also changes into a
+# new temporary directory, so the files the library writes, e.g., keys.json,
+# do not land in the working tree.
+
+import os
+import sys
+import tempfile
+import types
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(os.path.dirname(_HERE))
+
+
+def install(root=_ROOT, virtual_time=True):
+    if _HERE not in sys.path:
+        sys.path.insert(0, _HERE)
+    if "lib" not in sys.modules:
+        lib = types.ModuleType("lib")
+        lib.__path__ = [root]
+        sys.modules["lib"] = lib
+    import bluetooth
+    if virtual_time:
+        bluetooth.clock.install()
+    os.chdir(tempfile.mkdtemp())
+    return bluetooth.clock
+
+
+# Start a new simulation: a new virtual clock and radio.
+def reset():
+    import bluetooth
+    clock = bluetooth.reset()
+    clock.install()
+    return clock
@@ -0,0 +1,53 @@
+# Emulated machine module for running this library on a host with CPython,
+# see tools/emulator/host.py. Only Timer, running on the virtual clock of
+# the emulated bluetooth module, and the user memory of RTC are provided.
+
+import bluetooth
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self._event = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=None, callback=None):
+        self.deinit()
+        self._period_us = int(1000000 / freq) if freq else int(period * 1000)
+        self._mode = mode
+        self._callback = callback
+        self._event = bluetooth.clock.schedule(self._period_us, self._fire)
+
+    def _fire(self):
+        if self._mode == Timer.PERIODIC:
+            self._event = bluetooth.clock.schedule(self._period_us, self._fire)
+        else:
+            self._event = None
+        if self._callback is not None:
+            self._callback(self)
+
+    def deinit(self):
+        if self._event is not None:
+            bluetooth.clock.cancel(self._event)
+            self._event = None
+
+
+_rtc_memory = b""                                                                                                       # Kept across RTC instances, like across deep sleep.
+
+
+class RTC:
+    MEMORY_MAX = 2048                                                                                                   # As on the ESP32.
+
+    def __init__(self, id=0):
+        pass
+
+    def memory(self, data=None):
+        global _rtc_memory
+        if data is None:
+            return _rtc_memory
+        if len(data) > RTC.MEMORY_MAX:
+            raise ValueError("buffer too long")
+        _rtc_memory = bytes(data)
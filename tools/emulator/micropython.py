@@ -0,0 +1,17 @@
+# Emulated micropython module for running this library on a host with
+# CPython, see tools/emulator/host.py.
+
+import bluetooth
+
+
+def const(value):
+    return value
+
+
+# Run fn(arg) soon, from the virtual clock's event loop.
+def schedule(fn, arg):
+    bluetooth.clock.schedule(0, fn, arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
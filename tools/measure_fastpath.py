@@ -0,0 +1,94 @@
+# Check and time the hot paths of hidservices/fastpath.py. check() must find
+# the selected versions, native or viper where they compile, equal to the
+# pure Python ones. The pure Python versions are checked against the values
+# they must give, and the devices that use them against the emulated radio:
+# the reports a central receives from a Mouse and a Keyboard, and the name
+# and services decoded from the advertising payload. Last, benchmark() times
+# both versions, which are the same functions where the native emitter is
+# missing, e.g., on CPython. Runs on the host with CPython, timed with the
+# host's clock:
+#   python tools/measure_fastpath.py [calls]
+# On a board, fastpath.check() and fastpath.benchmark() can be called from
+# the REPL to compare the native versions.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+host.install(virtual_time=False)
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+from lib.hidservices import fastpath
+from lib.hidservices.fastpath import py_clamp, py_put_s8x2, py_bits8, py_decode_field
+
+
+def check_python():
+    assert (py_clamp(300, -127, 127), py_clamp(-300, -127, 127), py_clamp(5, -127, 127)) == (127, -127, 5)
+    buf = bytearray(4)
+    py_put_s8x2(buf, 1, -5, 127)
+    assert buf == b"\x00\xfb\x7f\x00"
+    assert py_bits8(1, 0, 1, 0, 0, 0, 0, 1) == 0x85
+    payload = b"\x02\x01\x06\x03\x03\x12\x18\x05\x09abcd"
+    assert py_decode_field(payload, 0x09) == [b"abcd"] and py_decode_field(payload, 0x03) == [b"\x12\x18"]
+    assert py_decode_field(payload, 0x19) == []
+
+
+# The reports a central receives from devices using the selected versions.
+def check_devices():
+    clock = host.reset()
+    import bluetooth
+    from central import Central
+    from lib.hidservices.mouse import Mouse
+    from lib.hidservices.keyboard import Keyboard
+
+    mouse = Mouse("Fast Mouse")
+    mouse.start()
+    mouse.start_advertising()
+    _interval, payload, _resp, _connectable = bluetooth.BLE().advertising
+    assert mouse.adv.decode_name(payload) == "Fast Mouse"
+    assert [str(uuid) for uuid in mouse.adv.decode_services(payload)] == [str(bluetooth.UUID(0x1812))]
+
+    central = Central()
+    central.connect()
+    central.pair()
+    central.subscribe(mouse.h_rep)
+    mouse.set_axes(-300, 42)                                                                                            # Clamped to -127.
+    mouse.set_buttons(1, 0, 1)
+    mouse.notify_hid_report()
+    clock.run_for_ms(20)
+    assert central.received[-1][1] == b"\x05\x81\x2a\x00", central.received[-1][1]
+    mouse.stop()
+
+    clock = host.reset()
+    keyboard = Keyboard("Fast Keyboard")
+    keyboard.start()
+    keyboard.start_advertising()
+    central = Central()
+    central.connect()
+    central.pair()
+    central.subscribe(keyboard.h_rep)
+    keyboard.set_modifiers(left_shift=1, right_alt=1)
+    keyboard.set_keys(0x04)
+    keyboard.notify_hid_report()
+    clock.run_for_ms(20)
+    assert central.received[-1][1] == b"\x42\x00\x04\x00\x00\x00\x00\x00", central.received[-1][1]
+
+
+def run(n=20000):
+    errors = fastpath.check()
+    _print("native: %s, check: %d mismatches" % (fastpath.NATIVE, errors))
+    assert errors == 0, "selected versions differ from the pure Python ones"
+    check_python()
+    check_devices()
+    _print("pure Python values and device reports: ok")
+    for name, (selected_us, python_us) in sorted(fastpath.benchmark(n).items()):
+        _print("%-12s selected %.3f us, Python %.3f us per call" % (name, selected_us, python_us))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
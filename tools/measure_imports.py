@@ -0,0 +1,61 @@
+# Measure the import time and heap use of the library modules. Meant for the
+# MicroPython unix port, which has gc.mem_alloc(), run from the directory
+# that holds lib/, with the emulated bluetooth module of tools/emulator on
+# the path:
+#   MICROPYPATH=lib/tools/emulator:.frozen:. micropython lib/tools/measure_imports.py [module ...]
+# Also runs with CPython, using tracemalloc:
+#   python tools/measure_imports.py [module ...]
+# Each module is measured in a fresh process, pass one module per run to
+# compare, e.g., lib.hidservices.mouse before and after a change. The
+# default measures the package and a device class through it.
+
+import gc
+import sys
+import time
+
+try:
+    mem_alloc = gc.mem_alloc
+    mem_peak = None
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:                                                                                                  # CPython.
+    import os
+    import tracemalloc
+
+    ticks_us = lambda: time.perf_counter_ns() // 1000                                                                   # Wall time, host.install() puts time.ticks_us() on the virtual clock.
+    ticks_diff = lambda a, b: a - b
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+    import host
+
+    host.install()
+    tracemalloc.start()
+    mem_alloc = lambda: tracemalloc.get_traced_memory()[0]
+    mem_peak = lambda: tracemalloc.get_traced_memory()[1]
+
+
+def measure(name, attribute=None):
+    gc.collect()
+    before = mem_alloc()
+    start = ticks_us()
+    module = __import__(name, None, None, (attribute,) if attribute else ())
+    if attribute:
+        getattr(module, attribute)
+    elapsed = ticks_diff(ticks_us(), start)
+    after = mem_alloc()
+    gc.collect()
+    kept = mem_alloc() - before
+    loaded = sorted(m for m in sys.modules if m.startswith("lib.") or m in ("json", "binascii"))
+    print("%s%s: %d us, %d bytes allocated, %d bytes kept%s" % (
+        name, "." + attribute if attribute else "", elapsed, after - before, kept,
+        ", peak %d bytes" % (mem_peak() - before) if mem_peak else ""))
+    print("  loaded:", " ".join(loaded))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for name in sys.argv[1:]:
+            measure(name)
+    else:
+        measure("lib.hidservices")
+        measure("lib.hidservices", "Mouse")
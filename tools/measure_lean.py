@@ -0,0 +1,67 @@
+# Measure the heap a started device keeps, with and without lean mode, see
+# HumanInterfaceDevice.set_lean(). Meant for the MicroPython unix port,
+# which has gc.mem_free(), run from the directory that holds lib/, with the
+# emulated bluetooth module of tools/emulator on the path:
+#   MICROPYPATH=lib/tools/emulator:.frozen:. micropython lib/tools/measure_lean.py [device ...]
+# Also runs with CPython, using tracemalloc:
+#   python tools/measure_lean.py [device ...]
+# Fails if a lean device keeps more than a normal one, or if it cannot be
+# restarted.
+
+import gc
+import sys
+
+try:
+    mem_free = gc.mem_free
+    import bluetooth
+    reset = bluetooth.reset
+except AttributeError:                                                                                                  # CPython.
+    import os
+    import tracemalloc
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+    import host
+
+    host.install()
+    reset = host.reset
+    tracemalloc.start()
+    mem_free = lambda: -tracemalloc.get_traced_memory()[0]
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+import lib.hidservices
+from lib.hid_services import HumanInterfaceDevice
+
+
+# Start a device on a new radio and return the bytes it keeps.
+def kept(cls, lean):
+    reset()
+    HumanInterfaceDevice._owner = None
+    HumanInterfaceDevice._radio_config = {}
+    gc.collect()
+    before = mem_free()
+    device = cls()
+    device.set_lean(lean)
+    device.start()
+    gc.collect()
+    size = before - mem_free()
+    device.stop()
+    device.start()                                                                                                      # Lean devices rebuild what they released.
+    assert device.services is not None or lean
+    return size
+
+
+def run(names):
+    for name in names:
+        cls = getattr(lib.hidservices, name)
+        kept(cls, False)                                                                                                # Load the modules first.
+        normal = kept(cls, False)
+        lean = kept(cls, True)
+        _print("%-14s %6d bytes, lean %6d bytes, saved %d" % (name, normal, lean, normal - lean))
+        assert lean <= normal, name
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:] or ["Mouse", "Keyboard", "Joystick", "Gamepad", "AbsoluteMouse", "GenericDevice", "Touchpad"])
@@ -0,0 +1,81 @@
+# Check and time the sampling of hidservices/pipeline.py. FakeSources feed
+# an InputPipeline: a centered stick must read 0, a full deflection the
+# full range of the device, and a stick returning to its center must
+# settle at 0 from both sides. A button must read the same for debounce
+# samples to change, and a bounce must not change it. Last, benchmark()
+# prints the samples per second per channel of a few layouts. Runs on the
+# host with CPython, timed with the host's clock:
+#   python tools/measure_pipeline.py [samples]
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+host.install(virtual_time=False)
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+from lib.hidservices.gamepad import Gamepad
+from lib.hidservices.mouse import Mouse
+from lib.hidservices.pipeline import FakeSource, InputPipeline, calibration_table
+
+_LAYOUTS = (("Mouse", Mouse, 2, 3), ("Gamepad", Gamepad, 6, 16))
+
+
+# Sample n times, enough for the smoothing to reach its target.
+def _settle(pipeline, n=100):
+    for _ in range(n):
+        pipeline.sample()
+
+
+def check():
+    for name, cls, axes, buttons in _LAYOUTS:
+        device = cls()
+        out_max = getattr(device, "AXIS_MAX", 127)
+        sticks = FakeSource(axes)
+        keys = FakeSource(0)
+        keys.channels = buttons
+        table = calibration_table(raw_min=1024, raw_max=64512, deadzone=512, out_max=out_max)                            # A stick that does not reach the ends of the ADC.
+        pipeline = InputPipeline(device, sticks, keys, [table] * axes, smoothing=2, debounce=3)
+
+        _settle(pipeline)
+        assert all(value == 0 for value in pipeline.axes), "centered stick off 0"
+        for raw, out in ((65535, out_max), (0, -out_max)):
+            for i in range(axes):
+                sticks.values[i] = raw
+            _settle(pipeline)
+            assert all(value == out for value in pipeline.axes), "full deflection not %d" % out
+            for i in range(axes):
+                sticks.values[i] = 32768
+            _settle(pipeline)
+            assert all(value == 0 for value in pipeline.axes), "does not settle at 0 from %d" % out
+
+        keys.buttons = 1
+        pipeline.sample()
+        keys.buttons = 0                                                                                                # A bounce.
+        pipeline.sample()
+        keys.buttons = 1
+        for _ in range(pipeline.debounce - 1):
+            pipeline.sample()
+            assert pipeline.buttons == 0, "button changed before debounce"
+        pipeline.sample()
+        assert pipeline.buttons == 1, "button not pressed after debounce"
+        _print("%-7s %d axes, %d buttons: center 0, range +-%d, debounce %d" % (name, axes, buttons, out_max, pipeline.debounce))
+
+
+def run(n=20000):
+    check()
+    for name, cls, axes, buttons in _LAYOUTS:
+        keys = FakeSource(0)
+        keys.channels = buttons
+        for smoothing in (0, 2):
+            pipeline = InputPipeline(cls(), FakeSource(axes), keys, smoothing=smoothing)
+            _print("%-7s smoothing %d: %d samples/s per channel" % (name, smoothing, pipeline.benchmark(n)))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,104 @@
+# Check and time the table-driven pointer acceleration of
+# hidservices/pointer.py. Every curve and a few DPI scales run the same
+# deltas through PointerAcceleration and its float reference. The check
+# fails if a sample differs by more than 1 count, or if motion is lost: the
+# output of a sample within the report range and what it carries must sum
+# to the exact motion of its gain, and less than a count may carry over.
+# A fast flick must stop with the next still sample.
+# A Mouse with a DPI scale of 2 then moves against the emulated
+# radio, and the central must receive twice the motion. Last, benchmark()
+# times both versions, the table must be faster. Runs on the host with
+# CPython, timed with the host's clock:
+#   python tools/measure_pointer.py [samples]
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+import host
+
+host.install(virtual_time=False)
+
+import builtins
+_print = builtins.print
+builtins.print = lambda *args, **kwargs: None                                                                           # The library prints a lot, keep the output readable.
+
+from lib.hidservices.pointer import FLAT, SOFT, STEEP, PointerAcceleration, FloatPointerAcceleration, benchmark
+
+_CURVES = (("FLAT", FLAT), ("SOFT", SOFT), ("STEEP", STEEP))
+_SCALES = (0.5, 1.0, 2.0, 3.3)
+
+
+# Deltas of a stroke to the right and down, with varying speed.
+def _deltas(n):
+    for i in range(n):
+        yield ((i * 37) % 61) - 20, ((i * 13) % 41) - 15
+
+
+def check(n=5000):
+    for name, curve in _CURVES:
+        for scale in _SCALES:
+            table = PointerAcceleration(curve, scale)
+            reference = FloatPointerAcceleration(curve, scale)
+            total = [0, 0]
+            reference_total = [0, 0]
+            worst = 0
+            for dx, dy in _deltas(n):
+                gain = table._table[min(max(abs(dx), abs(dy)), 127)]
+                exact = (table._rx + dx * gain, table._ry + dy * gain)                                                  # Motion of this sample and the carried fractions.
+                table.apply(dx, dy)
+                reference.apply(dx, dy)
+                worst = max(worst, abs(table.x - reference.x), abs(table.y - reference.y))
+                total[0] += table.x
+                total[1] += table.y
+                reference_total[0] += reference.x
+                reference_total[1] += reference.y
+                for out, carried, motion in ((table.x, table._rx, exact[0]), (table.y, table._ry, exact[1])):
+                    assert 0 <= carried < 256, "carries more than a count"
+                    assert out in (-127, 127) or (out << 8) + carried == motion, "motion lost"
+            _print("%-5s x%.1f: max sample difference %d, motion %d, %d (float %d, %d)" % (name, scale, worst, total[0], total[1], reference_total[0], reference_total[1]))
+            assert worst <= 1, "sample differs from the float reference"
+            for axis in (0, 1):
+                assert abs(total[axis] - reference_total[axis]) <= abs(reference_total[axis]) // 200 + 2, "drifts from the float reference"
+
+            for _ in range(10):                                                                                         # A fast flick, then the hand stops.
+                table.apply(120, -120)
+            table.apply(0, 0)
+            assert (table.x, table.y) == (0, 0), "moves on after a flick"
+
+
+# Move a Mouse with a DPI scale of 2 and count what the central receives.
+def check_mouse(moves=100):
+    clock = host.reset()
+    from central import Central
+    from lib.hidservices.mouse import Mouse
+
+    mouse = Mouse("Emulated Mouse")
+    mouse.start()
+    mouse.start_advertising()
+    central = Central()
+    central.connect()
+    central.pair()
+    central.subscribe(mouse.h_rep)
+    mouse.set_acceleration(FLAT, 2.0)
+    for _ in range(moves):
+        mouse.set_axes(1, -1)
+        mouse.notify_hid_report()
+        clock.run_for_ms(10)
+    x = sum(((data[1] + 128) & 0xFF) - 128 for _handle, data, _queued, _delivered in central.received)
+    y = sum(((data[2] + 128) & 0xFF) - 128 for _handle, data, _queued, _delivered in central.received)
+    _print("mouse x2.0: %d moves of (1, -1) delivered as (%d, %d) in %d reports" % (moves, x, y, len(central.received)))
+    assert (x, y) == (2 * moves, -2 * moves), "scaled motion not delivered"
+
+
+def run(n=20000):
+    check()
+    check_mouse()
+    for name, curve in _CURVES:
+        table_us, float_us = benchmark(curve, 1.0, n)
+        _print("%-5s table %.2f us, float %.2f us per sample, %.1fx" % (name, table_us, float_us, float_us / table_us))
+        assert table_us < float_us, "table slower than the float reference"
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,116 @@
+# Build keyboard layout packs for hidservices/layout.py from text sources.
+# Runs on the host with CPython:
+#   python tools/mklayout.py hidservices/layouts/de.txt [more.txt ...]
+# writes hidservices/layouts/de.bin next to each source.
+#
+# Source format, one definition per line, # starts a comment line:
+#   <char> <key>               a character typed with a single key
+#   dead <name> <key>          a dead key, named by the character it adds
+#   <char> <name> <base>       a character typed as dead key <name> followed
+#                              by the key of character <base>
+# A <char> is either the character itself or U+XXXX, e.g., U+0020 for space
+# and U+0023 for #.
+# A <key> is the hex HID usage, optionally prefixed by shift+ and/or altgr+,
+# e.g., 1e, shift+1e, altgr+14 or shift+altgr+2e.
+
+import struct
+import sys
+
+# Must match hidservices/layout.py.
+LAYOUT_MAGIC = b"KL"
+LAYOUT_VERSION = 1
+LAYOUT_HEADER = "<2sBBHHHH"
+
+MODIFIERS = {"shift": 0x02, "altgr": 0x40, "ctrl": 0x01}
+
+# Characters below this codepoint go into the direct table.
+DIRECT_LIMIT = 0x100
+
+
+def parse_char(token):
+    if len(token) > 2 and token[:2] in ("U+", "u+"):
+        return int(token[2:], 16)
+    if len(token) != 1:
+        raise ValueError("Not a character: " + token)
+    return ord(token)
+
+
+def parse_key(token):
+    parts = token.lower().split("+")
+    modifiers = 0
+    for part in parts[:-1]:
+        modifiers |= MODIFIERS[part]
+    usage = int(parts[-1], 16)
+    if not 0 < usage < 0xE0:
+        raise ValueError("Bad usage: " + token)
+    return modifiers, usage
+
+
+def parse(source):
+    keys = {}                                                                                                           # codepoint -> (modifiers, usage)
+    dead_keys = {}                                                                                                      # name -> (modifiers, usage)
+    composed = {}                                                                                                       # codepoint -> (dead key name, base codepoint)
+    for number, line in enumerate(source.splitlines(), 1):
+        tokens = line.split()
+        if not tokens or tokens[0].startswith("#"):
+            continue
+        try:
+            if tokens[0] == "dead" and len(tokens) == 3:
+                dead_keys[tokens[1]] = parse_key(tokens[2])
+            elif len(tokens) == 2:
+                keys[parse_char(tokens[0])] = parse_key(tokens[1])
+            elif len(tokens) == 3:
+                composed[parse_char(tokens[0])] = (tokens[1], parse_char(tokens[2]))
+            else:
+                raise ValueError("Expected 2 or 3 fields")
+        except (ValueError, KeyError) as e:
+            raise SystemExit("line %d: %s: %s" % (number, line.strip(), e))
+    return keys, dead_keys, composed
+
+
+def build(keys, dead_keys, composed):
+    direct = sorted(c for c in keys if c < DIRECT_LIMIT)
+    extra = sorted(c for c in keys if c >= DIRECT_LIMIT)
+    start = direct[0] if direct else 0
+    count = direct[-1] - start + 1 if direct else 0
+
+    if extra and extra[-1] > 0xFFFF or composed and max(composed) > 0xFFFF:
+        raise SystemExit("Codepoints above U+FFFF are not supported")
+
+    table = bytearray(2 * count)
+    for c in direct:
+        table[2 * (c - start)] = keys[c][0]
+        table[2 * (c - start) + 1] = keys[c][1]
+
+    extras = b"".join(struct.pack("<HBB", c, *keys[c]) for c in extra)
+
+    deads = b""
+    for c in sorted(composed):
+        if c in keys:
+            raise SystemExit("U+%04X has both a key and a dead key sequence" % c)
+        name, base = composed[c]
+        if name not in dead_keys:
+            raise SystemExit("U+%04X uses unknown dead key %s" % (c, name))
+        if base not in keys:
+            raise SystemExit("U+%04X uses base U+%04X which has no key" % (c, base))
+        deads += struct.pack("<HBBBB", c, dead_keys[name][0], dead_keys[name][1], keys[base][0], keys[base][1])
+
+    header = struct.pack(LAYOUT_HEADER, LAYOUT_MAGIC, LAYOUT_VERSION, 0, start, count, len(extra), len(composed))
+    return header + bytes(table) + extras + deads
+
+
+def main(paths):
+    if not paths:
+        raise SystemExit("usage: mklayout.py layout.txt [layout.txt ...]")
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            keys, dead_keys, composed = parse(file.read())
+        pack = build(keys, dead_keys, composed)
+        out = path.rsplit(".", 1)[0] + ".bin"
+        with open(out, "wb") as file:
+            file.write(pack)
+        print("%s: %d keys, %d dead key sequences, %d bytes" % (out, len(keys), len(composed), len(pack)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])